@@ -1,9 +1,18 @@
 # imports
+import argparse, os
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
-import geopandas as gpd, pandas as pd, numpy as np
+import numpy as np, shapely
+from scipy import sparse
+# local imports
+from utils.generate_metrics import greedy_match, load_geojson_polygons, read_label_mask, raster_iou_matrix
+
+THRESHOLDS = tuple(np.round(np.arange(0.5, 1.0, 0.05), 2))
+
 
 class MetricsCalculator:
-    def __init__(self, gt_dir: Path, pred_dir: Path, output_csv: Path, iou_threshold: float = 0.5):
+    def __init__(self, gt_dir: Path, pred_dir: Path, output_csv: Path, iou_threshold: float = 0.5,
+                 thresholds=THRESHOLDS, n_workers: int = None):
         """
         Calculate metrics between ground truth and predicted GeoJSONs.
         gt_dir : Directory containing ground-truth GeoJSON files.
@@ -11,94 +20,188 @@ class MetricsCalculator:
         output_csv : Path to write the metrics CSV.
         iou_threshold : float
         Minimum IoU to count a match as a true positive.
+        thresholds : IoU thresholds reported in the per-threshold CSV (default 0.5:0.95).
+        n_workers : Number of worker processes (default: all CPUs, at most one per image).
         """
         self.gt_dir = Path(gt_dir)
         self.pred_dir = Path(pred_dir)
         self.output_csv = Path(output_csv)
         self.iou_threshold = iou_threshold
+        self.thresholds = tuple(thresholds)
+        self.n_workers = n_workers or os.cpu_count() or 1
 
     @staticmethod
-    def compute_iou_matrix(gt_polys, pred_polys) -> np.ndarray:
+    def compute_iou_matrix(gt_polys, pred_polys) -> sparse.csr_matrix:
         """
-        Compute IoU matrix between two lists of Shapely geometries.
+        Compute a sparse IoU matrix between two sequences of Shapely geometries.
+        Candidate pairs come from an STRtree bulk query, so IoU is only evaluated
+        for polygons that actually intersect; all other entries are implicit zeros.
         """
-        n_gt, n_pred = len(gt_polys), len(pred_polys)
-        iou = np.zeros((n_gt, n_pred), dtype=float)
-        for i, g in enumerate(gt_polys):
-            for j, p in enumerate(pred_polys):
-                inter = g.intersection(p).area
-                union = g.union(p).area
-                iou[i, j] = inter / union if union > 0 else 0.0
-        return iou
-
-    def match_and_metrics(self, iou_mat: np.ndarray):
+        gt = np.asarray(gt_polys, dtype=object)
+        pred = np.asarray(pred_polys, dtype=object)
+        n_gt, n_pred = len(gt), len(pred)
+        if n_gt == 0 or n_pred == 0:
+            return sparse.csr_matrix((n_gt, n_pred), dtype=float)
+
+        tree = shapely.STRtree(pred)
+        gt_idx, pred_idx = tree.query(gt, predicate="intersects")
+        inter = shapely.area(shapely.intersection(gt[gt_idx], pred[pred_idx]))
+        union = shapely.area(gt)[gt_idx] + shapely.area(pred)[pred_idx] - inter
+        iou = np.divide(inter, union, out=np.zeros_like(inter), where=union > 0)
+
+        keep = iou > 0  # touching polygons intersect with zero area
+        return sparse.csr_matrix((iou[keep], (gt_idx[keep], pred_idx[keep])), shape=(n_gt, n_pred))
+
+    def match_and_metrics(self, iou_mat: sparse.spmatrix):
         """
-        Greedy matching on IoU matrix.
-        Returns TP, FP, FN, and mean IoU over matched pairs.
+        Greedy matching on a sparse IoU matrix.
+        Returns TP, FP, FN, and mean IoU over pairs matched at iou_threshold.
         """
-        matches, gt_used, pred_used = list(), set(), set()
-        flat = [(i, j, iou_mat[i, j])
-                for i in range(iou_mat.shape[0])
-                for j in range(iou_mat.shape[1])]
-        flat.sort(key=lambda x: x[2], reverse=True)
-
-        for i, j, val in flat:
-            # if val < self.iou_threshold:
-            #     break
-            if i not in gt_used and j not in pred_used:
-                matches.append(val)
-                gt_used.add(i)
-                pred_used.add(j)
-
-        tp = len(matches)
-        fn = iou_mat.shape[0] - tp
-        fp = iou_mat.shape[1] - tp
-        mean_iou = float(np.mean(matches)) if matches else 0.0
+        _, _, matched = greedy_match(iou_mat)
+        return self._counts(iou_mat.shape, matched, self.iou_threshold)
+
+    @staticmethod
+    def _counts(shape, matched: np.ndarray, threshold: float):
+        # greedy matching above a threshold is the prefix of the full greedy matching,
+        # so one matching serves every threshold
+        hits = matched[matched >= threshold]
+        tp = len(hits)
+        fn = shape[0] - tp
+        fp = shape[1] - tp
+        mean_iou = float(np.mean(hits)) if tp else 0.0
         return tp, fp, fn, mean_iou
 
-    def compute_image_metrics(self, gt_file: Path, pred_file: Path) -> dict:
-        """
-        Load GeoJSONs and compute metrics for a single image.
-        """
-        gt_gdf = gpd.read_file(gt_file)
-        pred_gdf = gpd.read_file(pred_file)
-        iou_mat = self.compute_iou_matrix(gt_gdf.geometry, pred_gdf.geometry)
-        tp, fp, fn, mean_iou = self.match_and_metrics(iou_mat)
+    @staticmethod
+    def _scores(tp: int, fp: int, fn: int):
         precision = tp / (tp + fp) if (tp + fp) else 0.0
         recall    = tp / (tp + fn) if (tp + fn) else 0.0
         f1_score  = (2 * precision * recall / (precision + recall)
                      if (precision + recall) else 0.0)
+        ap = tp / (tp + fp + fn) if (tp + fp + fn) else 0.0
+        return precision, recall, f1_score, ap
 
-        return {"image": gt_file.name, "n_gt": len(gt_gdf), "n_pred": len(pred_gdf),
-                "TP": tp, "FP": fp, "FN": fn, "precision": precision, "recall": recall, 
-                "f1_score": f1_score, "mean_iou": mean_iou}
+    def summarize(self, image_name: str, iou_mat: sparse.spmatrix):
+        """
+        Match once and turn the result into the CSV record at iou_threshold
+        plus one record per entry of self.thresholds.
+        """
+        _, _, matched = greedy_match(iou_mat)
+        tp, fp, fn, mean_iou = self._counts(iou_mat.shape, matched, self.iou_threshold)
+        precision, recall, f1_score, _ = self._scores(tp, fp, fn)
+        record = {"image": image_name, "n_gt": iou_mat.shape[0], "n_pred": iou_mat.shape[1],
+                  "TP": tp, "FP": fp, "FN": fn, "precision": precision, "recall": recall,
+                  "f1_score": f1_score, "mean_iou": mean_iou}
 
-    def run(self):
-        """Iterate over all GeoJSONs in gt_dir, compute metrics, and save CSV."""
-        records = []
-        print(sorted(self.gt_dir.glob("*.geojson")))
-        print(self.gt_dir)
+        per_threshold = []
+        for t in self.thresholds:
+            t_tp, t_fp, t_fn, _ = self._counts(iou_mat.shape, matched, t)
+            t_precision, t_recall, t_f1, t_ap = self._scores(t_tp, t_fp, t_fn)
+            per_threshold.append({"image": image_name, "threshold": float(t), "TP": t_tp, "FP": t_fp, "FN": t_fn,
+                                  "precision": t_precision, "recall": t_recall, "f1_score": t_f1, "ap": t_ap})
+        return record, per_threshold
+
+    def compute_image_metrics(self, gt_file: Path, pred_file: Path):
+        """
+        Load GeoJSONs and compute metrics for a single image.
+        Returns (record, per_threshold_records), see summarize.
+        """
+        iou_mat = self.compute_iou_matrix(load_geojson_polygons(gt_file), load_geojson_polygons(pred_file))
+        return self.summarize(self.stem(gt_file), iou_mat)
+
+    def stem(self, gt_path: Path) -> str:
+        """Slide stem of a ground-truth file: the "image" column of both CSVs, in every mode."""
+        return gt_path.stem
+
+    def pairs(self):
+        """Yield (gt_path, pred_path) for every ground-truth file that has a prediction."""
         for gt_path in sorted(self.gt_dir.glob("*.geojson")):
-            print(gt_path)
             pred_path = self.pred_dir / gt_path.name
-            print(pred_path)
             if not pred_path.exists():
                 print(f"[WARN] Prediction missing for {gt_path.name}, skipping.")
                 continue
-            print(gt_path, pred_path)
-            rec = self.compute_image_metrics(gt_path, pred_path)
-            records.append(rec)
+            yield gt_path, pred_path
+
+    def run(self):
+        """
+        Compute metrics for every ground-truth file in gt_dir (in parallel when n_workers > 1)
+        and save the CSV plus a per-threshold CSV next to it (<output_csv stem>_thresholds.csv).
+        """
+        import pandas as pd  # only needed for the CSVs: keeps imports of this module light
+        pairs = list(self.pairs())
+        gt_paths = [gt_path for gt_path, _ in pairs]
+        pred_paths = [pred_path for _, pred_path in pairs]
+        if self.n_workers > 1 and len(gt_paths) > 1:
+            with ProcessPoolExecutor(max_workers=min(self.n_workers, len(gt_paths))) as pool:
+                results = list(pool.map(self.compute_image_metrics, gt_paths, pred_paths))
+        else:
+            results = [self.compute_image_metrics(g, p) for g, p in zip(gt_paths, pred_paths)]
 
-        df = pd.DataFrame(records)
+        df = pd.DataFrame([record for record, _ in results])
         df.to_csv(self.output_csv, index=False)
         print(f"[INFO] Metrics written to {self.output_csv}")
 
+        thresholds_df = pd.DataFrame([rec for _, per_threshold in results for rec in per_threshold])
+        thresholds_csv = self.output_csv.with_name(f"{self.output_csv.stem}_thresholds.csv")
+        thresholds_df.to_csv(thresholds_csv, index=False)
+        if not thresholds_df.empty:
+            ap = thresholds_df.groupby("threshold")["ap"].mean()
+            print(f"[INFO] AP@0.5 = {ap.iloc[0]:.4f}, mAP@{ap.index[0]:.2f}:{ap.index[-1]:.2f} = {ap.mean():.4f}")
+        print(f"[INFO] Per-threshold metrics written to {thresholds_csv}")
+
+
+class RasterMetricsCalculator(MetricsCalculator):
+    """
+    Same metrics as MetricsCalculator, computed straight from label rasters
+    (e.g. TRAIN_MASKS_DIR/<stem>_masks.tif against STITCHED_MASKS_DIR/<stem>.npy).
+    The overlap contingency is accumulated chunk by chunk, so memory-mapped
+    slide-scale masks are never loaded whole.
+
+    Unlike vector mode, n_workers defaults to 1: every worker holds a whole
+    ground-truth/prediction mask pair, and a few slide-scale pairs at once can
+    exhaust memory. Pass more workers only when the masks are small.
+    """
+
+    def __init__(self, gt_dir: Path, pred_dir: Path, output_csv: Path, iou_threshold: float = 0.5,
+                 thresholds=THRESHOLDS, n_workers: int = 1,
+                 gt_suffix: str = "_masks.tif", pred_suffix: str = ".npy", chunk_rows: int = 512):
+        super().__init__(gt_dir, pred_dir, output_csv, iou_threshold, thresholds, n_workers or 1)
+        self.gt_suffix = gt_suffix
+        self.pred_suffix = pred_suffix
+        self.chunk_rows = chunk_rows
+
+    def compute_image_metrics(self, gt_file: Path, pred_file: Path):
+        """
+        Read both label masks and compute metrics for a single image.
+        """
+        iou_mat = raster_iou_matrix(read_label_mask(gt_file), read_label_mask(pred_file), self.chunk_rows)
+        return self.summarize(self.stem(gt_file), iou_mat)
+
+    def stem(self, gt_path: Path) -> str:
+        return gt_path.name[:-len(self.gt_suffix)]
+
+    def pairs(self):
+        for gt_path in sorted(self.gt_dir.glob(f"*{self.gt_suffix}")):
+            stem = self.stem(gt_path)
+            pred_path = self.pred_dir / f"{stem}{self.pred_suffix}"
+            if not pred_path.exists():
+                print(f"[WARN] Prediction missing for {gt_path.name}, skipping.")
+                continue
+            yield gt_path, pred_path
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compute segmentation metrics against ground truth.")
+    parser.add_argument("--gt-dir", type=Path, required=True)
+    parser.add_argument("--pred-dir", type=Path, required=True)
+    parser.add_argument("--output-csv", type=Path, required=True)
+    parser.add_argument("--iou-threshold", type=float, default=0.5)
+    parser.add_argument("--workers", type=int, default=None,
+                        help="worker processes, one image pair in memory each (default: all CPUs in vector mode, 1 in raster mode)")
+    parser.add_argument("--mode", choices=("vector", "raster"), default="vector",
+                        help="vector: GeoJSON polygons; raster: label masks (<stem>_masks.tif vs <stem>.npy)")
+    args = parser.parse_args()
 
-# # testing
-# if __name__ == "__main__":
-#     GT_DIR        = Path("/mnt/WorkingDos/cellpose_sam/manual_labels")
-#     PRED_DIR      = Path("/mnt/WorkingDos/cellpose_sam/model_labels")
-#     OUTPUT_CSV    = Path("/mnt/WorkingDos/cellpose_sam/metrics.csv")
-#     IOU_THRESHOLD = 0.5
-#     calc = MetricsCalculator(gt_dir=GT_DIR, pred_dir=PRED_DIR, output_csv=OUTPUT_CSV, iou_threshold=IOU_THRESHOLD)
-#     calc.run()
\ No newline at end of file
+    calc_cls = RasterMetricsCalculator if args.mode == "raster" else MetricsCalculator
+    calc = calc_cls(gt_dir=args.gt_dir, pred_dir=args.pred_dir, output_csv=args.output_csv, iou_threshold=args.iou_threshold,
+                     n_workers=args.workers)
+    calc.run()
@@ -0,0 +1,365 @@
+#!/usr/bin/env python3
+"""
+Developed by Nikhil Nageshwar Inturi
+
+Reproducible benchmark suite on synthetic slides (see utils/generate_synthetic_slides.py).
+
+Micro-benchmarks time one pipeline step on one slide, on inputs prepared once:
+    tiff_to_png     TiffToPngConverter.convert_file
+    split           ImageSplitter.split_file
+    detect_stub     cellpose_sam_detect_files with StubCellposeModel (CPU, no weights)
+    stitch_npy      NPYMaskStitcher.stitch_stem
+    stitch_masks    MaskStitcher.stitch_all
+    plots           PlotGenerator.plot_mask
+    geojson         MaskToGeoJSONConverter.convert_file
+    metrics         MetricsCalculator.compute_image_metrics
+The macro-benchmark runs the whole pipeline (pngs → ... → geojsons → metrics) over
+n_slides slides from a clean state.
+
+Every run is written to <out_dir>/results/bench_<timestamp>_<commit>.json and
+compared with the newest earlier run of the same configuration (or --baseline);
+benchmarks whose median wall time grew by more than --tolerance are flagged.
+
+Usage:
+    python -m bin.run_benchmarks --size small --repeat 3
+    python -m bin.run_benchmarks --size medium --only split stitch_npy --fail-on-regression
+"""
+
+# imports
+import argparse, hashlib, importlib.util, json, logging, os, platform, shutil, statistics, subprocess, sys, threading, time
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Union
+import numpy as np, pandas as pd, shapely, tifffile, cv2
+# local imports
+from utils.constants import setup_logging
+from utils.generate_instrumentation import current_rss
+from utils.generate_synthetic_slides import StubCellposeModel, ellipse_polygons, polygons_to_geojson, write_synthetic_slide
+from utils.generate_pngs import TiffToPngConverter
+from utils.generate_split_images import ImageSplitter
+from utils.generate_combine_masks import NPYMaskStitcher
+from utils.generate_masks import MaskStitcher
+from utils.generate_plots import PlotGenerator
+from utils.generate_geojson_qp_mask import MaskToGeoJSONConverter
+from bin.generate_metrics import MetricsCalculator
+
+SIZES = {
+    "small": dict(height=2048, width=2048, n_cells=600),
+    "medium": dict(height=8192, width=8192, n_cells=10000),
+    "large": dict(height=16384, width=16384, n_cells=40000),
+}
+MICRO_BENCHMARKS = ("tiff_to_png", "split", "detect_stub", "stitch_npy", "stitch_masks", "plots", "geojson", "metrics")
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True, cwd=Path(__file__).resolve().parent).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class PeakRSS:
+    """
+    Samples the process RSS in a background thread while active; peak_mb is the growth over the start.
+    """
+
+    def __init__(self, interval: float = 0.01) -> None:
+        self.interval = interval
+        self.start_rss = self.peak_rss = 0
+        self._stop = threading.Event()
+
+    def _sample(self) -> None:
+        while not self._stop.wait(self.interval):
+            self.peak_rss = max(self.peak_rss, current_rss())
+
+    def __enter__(self) -> "PeakRSS":
+        self.start_rss = self.peak_rss = current_rss()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self._stop.set()
+        self._thread.join()
+        self.peak_rss = max(self.peak_rss, current_rss())
+
+    @property
+    def peak_mb(self) -> float:
+        return (self.peak_rss - self.start_rss) / 2 ** 20
+
+
+def compare_results(current: dict, baseline: dict, tolerance: float = 0.10, min_delta_s: float = 0.01) -> Dict[str, dict]:
+    """
+    Compare median wall times per benchmark. A benchmark regressed when it is slower than the
+    baseline by more than tolerance (relative) and min_delta_s (absolute, ignores timer noise).
+    """
+    comparison = {}
+    for name, result in current["results"].items():
+        base = baseline["results"].get(name)
+        if not base or "wall_s" not in result or "wall_s" not in base:
+            continue
+        new_s, old_s = result["wall_s"]["median"], base["wall_s"]["median"]
+        ratio = new_s / old_s if old_s > 0 else float("inf")
+        if new_s - old_s > min_delta_s and ratio > 1 + tolerance:
+            status = "regression"
+        elif old_s - new_s > min_delta_s and ratio < 1 - tolerance:
+            status = "improvement"
+        else:
+            status = "ok"
+        comparison[name] = {"baseline_s": old_s, "current_s": new_s, "ratio": ratio, "status": status}
+    return comparison
+
+
+def find_baseline(results_dir: Path, config_key: str, exclude: Path = None) -> Optional[Path]:
+    """
+    Newest earlier result file of the same benchmark configuration.
+    """
+    for path in sorted(results_dir.glob("bench_*.json"), reverse=True):
+        if path == exclude:
+            continue
+        try:
+            if json.loads(path.read_text())["meta"]["config_key"] == config_key:
+                return path
+        except (ValueError, KeyError):
+            continue
+    return None
+
+
+class BenchmarkSuite:
+    """
+    Prepare synthetic inputs under <out_dir>/data/<config_key>/ (reused across runs of the
+    same configuration) and run the micro- and macro-benchmarks on them.
+    """
+
+    def __init__(self, out_dir: Union[str, Path], size: str = "small", scaling_factor: float = 0.5, tile_size: int = 512,
+                 n_slides: int = 2, repeat: int = 3, warmup: int = 1, seed: int = 0) -> None:
+        self.config = dict(size=size, **SIZES[size], scaling_factor=scaling_factor, tile_size=tile_size,
+                           n_slides=n_slides, seed=seed)
+        self.config_key = hashlib.blake2b(json.dumps(self.config, sort_keys=True).encode(), digest_size=6).hexdigest()
+        self.out_dir = Path(out_dir)
+        self.data_dir = self.out_dir / "data" / self.config_key
+        self.run_dir = self.out_dir / "runs" / self.config_key
+        self.repeat = repeat
+        self.warmup = warmup
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.stems = [f"synthetic_{i}" for i in range(n_slides)]
+        self.results: Dict[str, dict] = {}
+        self.detect_impl = None
+
+    # inputs
+    def _dir(self, *parts: str, clean: bool = False) -> Path:
+        path = self.run_dir.joinpath(*parts)
+        if clean and path.exists():
+            shutil.rmtree(path)
+        path.mkdir(parents=True, exist_ok=True)
+        return path
+
+    def prepare(self) -> None:
+        """
+        Write the synthetic slides (once per configuration) and the inputs of every micro-benchmark:
+        PNG, tiles, tile masks, stitched mask and predicted GeoJSON of the first slide, ground-truth GeoJSON of all.
+        """
+        cfg = self.config
+        for i, stem in enumerate(self.stems):
+            if not (self.data_dir / "tifs" / f"{stem}.tif").exists():
+                write_synthetic_slide(self.data_dir, stem, cfg["height"], cfg["width"], cfg["n_cells"], seed=cfg["seed"] + i)
+        stem = self.stems[0]
+        f = cfg["scaling_factor"]
+        TiffToPngConverter(f, self.data_dir / "tifs", self._dir("pngs", clean=True)).convert_file(self.data_dir / "tifs" / f"{stem}.tif")
+        ImageSplitter(self._dir("pngs"), self._dir("tiles", clean=True), cfg["tile_size"], cfg["tile_size"]).split_file(self._dir("pngs") / f"{stem}.png")
+        self.detect_tiles(sorted(self._dir("tiles").glob("*.png")), self._dir("tile_masks", clean=True))
+
+        # MaskStitcher layout: <root>/segmentation/*.npy and <root>/masks/*.png
+        seg_dir, png_dir = self._dir("cellpose_root", "segmentation", clean=True), self._dir("cellpose_root", "masks", clean=True)
+        for npy in sorted(self._dir("tile_masks").glob("*.npy")):
+            tile = np.load(npy)
+            shutil.copy(npy, seg_dir / npy.name)
+            cv2.imwrite(str(png_dir / f"{npy.stem}.png"), tile.astype(np.uint16))
+
+        NPYMaskStitcher(self._dir("tile_masks"), self._dir("stitched", clean=True)).stitch_stem(stem)
+        gt_dir = self._dir("gt_geojsons", clean=True)  # ground truth at PNG scale, like the predictions
+        for i, gt_stem in enumerate(self.stems):
+            polygons = ellipse_polygons(cfg["height"], cfg["width"], cfg["n_cells"], seed=cfg["seed"] + i)
+            (gt_dir / f"{gt_stem}.geojson").write_text(json.dumps(polygons_to_geojson(polygons, scale=f)))
+        MaskToGeoJSONConverter(self._dir("stitched"), self._dir("pred_geojsons", clean=True)).convert_file(self._dir("stitched") / f"{stem}.npy")
+        self.logger.info(f"Prepared benchmark inputs in {self.run_dir}")
+
+    def detect_tiles(self, tile_files: List[Path], out_dir: Path) -> None:
+        """
+        Run the stub model over tiles with the pipeline's detection loop, or, when the model
+        module cannot be imported here (no cellpose/tqdm), with an equivalent direct loop.
+        """
+        try:
+            from model.run_cellpose_sam import DETECT_DEPENDENCIES, cellpose_sam_detect_files
+            # the loop imports these on first use, not at module import
+            missing = [m for m in DETECT_DEPENDENCIES if importlib.util.find_spec(m) is None]
+            if missing:
+                raise ImportError(f"No module named {', '.join(missing)}")
+        except ImportError as e:
+            if self.detect_impl is None:
+                self.logger.warning(f"model.run_cellpose_sam unavailable ({e}); detecting tiles directly with the stub")
+            self.detect_impl = "direct"
+            model = StubCellposeModel()
+            for tile in tile_files:
+                masks, _, _ = model.eval([cv2.cvtColor(cv2.imread(str(tile)), cv2.COLOR_BGR2RGB)])
+                np.save(out_dir / f"{tile.stem}.npy", masks[0])
+            return
+        self.detect_impl = "cellpose_sam_detect_files"
+        cellpose_sam_detect_files(StubCellposeModel(), tile_files, out_dir, slide_dir=self._dir("pngs"))
+
+    # measurement
+    def measure(self, name: str, kind: str, fn: Callable[[], None], setup: Callable[[], None] = None,
+                items: Dict[str, float] = None) -> dict:
+        """
+        Time fn over warmup + repeat runs (setup runs before each, untimed).
+        Records wall/CPU time, peak RSS growth and throughput for items.
+        """
+        walls, cpus, peaks = [], [], []
+        for i in range(self.warmup + self.repeat):
+            if setup:
+                setup()
+            with PeakRSS() as rss:
+                wall0, cpu0 = time.perf_counter(), time.process_time()
+                fn()
+                wall, cpu = time.perf_counter() - wall0, time.process_time() - cpu0
+            if i >= self.warmup:
+                walls.append(wall)
+                cpus.append(cpu)
+                peaks.append(rss.peak_mb)
+        median = statistics.median(walls)
+        result = {"kind": kind, "repeat": self.repeat,
+                  "wall_s": {"min": min(walls), "median": median, "mean": statistics.fmean(walls), "max": max(walls)},
+                  "cpu_s": statistics.median(cpus), "peak_rss_mb": max(peaks),
+                  "items": dict(items or {}),
+                  "rates": {f"{k}_per_s": v / median for k, v in (items or {}).items() if median > 0}}
+        self.results[name] = result
+        self.logger.info(f"[{name}] median {median:.3f}s (min {min(walls):.3f}s), cpu {result['cpu_s']:.3f}s, "
+                         f"+{result['peak_rss_mb']:.0f} MB")
+        return result
+
+    def run_micro(self, only: List[str] = None) -> None:
+        cfg, stem = self.config, self.stems[0]
+        f, tile = cfg["scaling_factor"], cfg["tile_size"]
+        tif = self.data_dir / "tifs" / f"{stem}.tif"
+        png = self._dir("pngs") / f"{stem}.png"
+        tiles = sorted(self._dir("tiles").glob("*.png"))
+        stitched = self._dir("stitched") / f"{stem}.npy"
+        slide_px = cfg["height"] * cfg["width"]
+        png_px = int(cfg["height"] * f) * int(cfg["width"] * f)
+        n_cells = int(np.load(stitched, mmap_mode="r").max())
+        out = lambda name: self._dir("out", name, clean=True)
+
+        benchmarks = {
+            "tiff_to_png": (lambda: TiffToPngConverter(f, tif.parent, out("tiff_to_png")).convert_file(tif),
+                            {"pixels": slide_px}),
+            "split": (lambda: ImageSplitter(png.parent, out("split"), tile, tile).split_file(png),
+                      {"pixels": png_px, "tiles": len(tiles)}),
+            "detect_stub": (lambda: self.detect_tiles(tiles, out("detect_stub")), {"tiles": len(tiles)}),
+            "stitch_npy": (lambda: NPYMaskStitcher(self._dir("tile_masks"), out("stitch_npy")).stitch_stem(stem),
+                           {"pixels": png_px, "tiles": len(tiles)}),
+            "stitch_masks": (lambda: MaskStitcher(self._dir("cellpose_root"), out("stitch_masks")).stitch_all(),
+                             {"pixels": 2 * png_px, "tiles": 2 * len(tiles)}),
+            "plots": (lambda: PlotGenerator(png.parent, stitched.parent, out("plots")).plot_mask(stitched),
+                      {"pixels": png_px}),
+            "geojson": (lambda: MaskToGeoJSONConverter(stitched.parent, out("geojson")).convert_file(stitched),
+                        {"cells": n_cells}),
+            "metrics": (lambda: MetricsCalculator(self._dir("gt_geojsons"), self._dir("pred_geojsons"), out("metrics") / "metrics.csv",
+                                                  n_workers=1).compute_image_metrics(self._dir("gt_geojsons") / f"{stem}.geojson",
+                                                                                     self._dir("pred_geojsons") / f"{stem}.geojson"),
+                        {"cells": cfg["n_cells"] + n_cells}),
+        }
+        for name in only or MICRO_BENCHMARKS:
+            fn, items = benchmarks[name]
+            self.measure(name, "micro", fn, items=items)
+
+    def run_macro(self) -> None:
+        """
+        End-to-end pipeline over all slides from a clean state, with per-stage timings.
+        """
+        cfg, f, tile = self.config, self.config["scaling_factor"], self.config["tile_size"]
+        stage_walls: Dict[str, List[float]] = {}
+        dirs = {}
+
+        def setup():
+            for name in ("pngs", "tiles", "tile_masks", "stitched", "plots", "geojsons", "metrics"):
+                dirs[name] = self._dir("macro", name, clean=True)
+
+        def timed(stage, fn):
+            start = time.perf_counter()
+            fn()
+            stage_walls.setdefault(stage, []).append(time.perf_counter() - start)
+
+        def pipeline():
+            timed("pngs", lambda: TiffToPngConverter(f, self.data_dir / "tifs", dirs["pngs"]).convert_all())
+            timed("splits", lambda: ImageSplitter(dirs["pngs"], dirs["tiles"], tile, tile).split_all())
+            timed("detect", lambda: self.detect_tiles(sorted(dirs["tiles"].glob("*.png")), dirs["tile_masks"]))
+            timed("stitch", lambda: NPYMaskStitcher(dirs["tile_masks"], dirs["stitched"]).stitch_all())
+            timed("plots", lambda: PlotGenerator(dirs["pngs"], dirs["stitched"], dirs["plots"]).run())
+            timed("geojsons", lambda: MaskToGeoJSONConverter(dirs["stitched"], dirs["geojsons"]).convert_all())
+            timed("metrics", lambda: MetricsCalculator(self._dir("gt_geojsons"), dirs["geojsons"], dirs["metrics"] / "metrics.csv",
+                                                       n_workers=1).run())
+
+        result = self.measure("pipeline", "macro", pipeline, setup=setup,
+                              items={"slides": len(self.stems), "pixels": len(self.stems) * cfg["height"] * cfg["width"]})
+        result["stages"] = {stage: statistics.median(walls[self.warmup:]) for stage, walls in stage_walls.items()}
+
+    def run(self, only: List[str] = None, macro: bool = True) -> dict:
+        self.prepare()
+        self.run_micro(only)
+        if macro:
+            self.run_macro()
+        return {"meta": {"timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"), "commit": git_commit(),
+                         "config": self.config, "config_key": self.config_key, "detect": self.detect_impl,
+                         "repeat": self.repeat, "warmup": self.warmup,
+                         "platform": platform.platform(), "python": sys.version.split()[0], "cpu_count": os.cpu_count(),
+                         "versions": {"numpy": np.__version__, "opencv": cv2.__version__, "tifffile": tifffile.__version__,
+                                      "pandas": pd.__version__, "shapely": shapely.__version__}},
+                "results": self.results}
+
+
+def save_results(report: dict, results_dir: Path) -> Path:
+    results_dir.mkdir(parents=True, exist_ok=True)
+    stamp = report["meta"]["timestamp"].replace("-", "").replace(":", "").replace("T", "_")
+    path = results_dir / f"bench_{stamp}_{report['meta']['commit'] or 'nogit'}.json"
+    path.write_text(json.dumps(report, indent=2))
+    return path
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the pipeline on synthetic slides.")
+    parser.add_argument("--out-dir", type=Path, default=Path("benchmarks"), help="synthetic data, scratch outputs and results")
+    parser.add_argument("--size", choices=sorted(SIZES), default="small")
+    parser.add_argument("--slides", type=int, default=2, help="slides in the macro-benchmark")
+    parser.add_argument("--scaling-factor", type=float, default=0.5)
+    parser.add_argument("--tile-size", type=int, default=512)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--warmup", type=int, default=1)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--only", nargs="+", choices=MICRO_BENCHMARKS, help="micro-benchmarks to run (default: all)")
+    parser.add_argument("--no-macro", action="store_true", help="skip the end-to-end pipeline benchmark")
+    parser.add_argument("--baseline", type=Path, help="result JSON to compare with (default: newest run of the same config)")
+    parser.add_argument("--tolerance", type=float, default=0.10, help="relative slowdown flagged as a regression")
+    parser.add_argument("--fail-on-regression", action="store_true", help="exit with status 1 if anything regressed")
+    args = parser.parse_args()
+
+    setup_logging(logging.INFO)
+    logging.getLogger("TiffToPngConverter").setLevel(logging.WARNING)  # per-file/per-tile info lines swamp the report
+    logging.getLogger("ImageSplitter").setLevel(logging.WARNING)
+    logger = logging.getLogger("benchmarks")
+
+    suite = BenchmarkSuite(args.out_dir, args.size, args.scaling_factor, args.tile_size, args.slides, args.repeat, args.warmup, args.seed)
+    report = suite.run(args.only, macro=not args.no_macro)
+    results_dir = args.out_dir / "results"
+    baseline_path = args.baseline or find_baseline(results_dir, suite.config_key)
+    if baseline_path:
+        report["baseline"] = str(baseline_path)
+        report["comparison"] = compare_results(report, json.loads(Path(baseline_path).read_text()), args.tolerance)
+    path = save_results(report, results_dir)
+    logger.info(f"Results written to {path}")
+
+    regressions = {name: c for name, c in report.get("comparison", {}).items() if c["status"] == "regression"}
+    for name, c in report.get("comparison", {}).items():
+        log = logger.warning if c["status"] == "regression" else logger.info
+        log(f"[{name}] {c['baseline_s']:.3f}s → {c['current_s']:.3f}s ({c['ratio']:.2f}x) {c['status']}")
+    if regressions and args.fail_on_regression:
+        sys.exit(1)
@@ -1,16 +1,22 @@
 # imports
-import numpy as np
-from cellpose import models, core, io, plot, train
+import importlib.metadata, logging, time
+import numpy as np, torch
+from cellpose import models, core, io, plot, train, dynamics, transforms
 from pathlib import Path
-from tqdm import trange
 import matplotlib.pyplot as plt
+# local imports
+from utils.generate_flow_cache import FLOW_CACHE_DIR, load_flow_targets
+from utils.generate_tile_index import TILE_INDEX_NAME, load_tile_index, tile_sampling_probs
+from utils.generate_training_crops import RandomCropDataset
 
 io.logger_setup() # run this to get printing of progress
+logger = logging.getLogger(__name__)
 
 train_dir = "/mnt/WorkingDos/cellpose_sam/8_hdrg_jayden_dataset_data"
 model_name = "cp_sam_hdrg_topoint_model"
 
-def train_cp_sam_model(train_dir, model_name, n_epochs=100, learning_rate=1e-5, weight_decay=0.1, batch_size=1):
+def train_cp_sam_model(train_dir, model_name, n_epochs=100, learning_rate=1e-5, weight_decay=0.1, batch_size=1, use_flow_cache=True,
+                       use_tile_index=True, min_cells=1):
   """
   Train a Cellpose model using the SAM (Segment Anything) algorithm.
 
@@ -21,6 +27,12 @@ def train_cp_sam_model(train_dir, model_name, n_epochs=100, learning_rate=1e-5,
     learning_rate (float): Learning rate for the optimizer.
     weight_decay (float): Weight decay for the optimizer.
     batch_size (int): Batch size for training.
+    use_flow_cache (bool): Read flow targets from <train_dir>/_flows (written by split_folder with
+      compute_flows=True), computing and storing only the missing ones, instead of letting
+      train_seg recompute all of them.
+    use_tile_index (bool): If <train_dir>/tile_index.csv exists (written by split_folder), load only
+      tiles with at least min_cells cells and sample them balanced across sparse and dense regions.
+    min_cells (int): Minimum number of cells for a tile to be used with the tile index.
 
   Returns:
     None
@@ -45,9 +57,152 @@ def train_cp_sam_model(train_dir, model_name, n_epochs=100, learning_rate=1e-5,
   if(len(files)==0):raise FileNotFoundError("no files found, did you specify the correct folder and extension?")
   else:print(f"{len(files)} files in folder:")
 
-  output = io.load_train_test_data(train_dir, test_dir, mask_filter=masks_ext)
-  train_data, train_labels, _, test_data, test_labels, _ = output
-  new_model_path, train_losses, test_losses = train.train_seg(model.net, train_data=train_data, train_labels=train_labels, batch_size=batch_size, n_epochs=n_epochs, learning_rate=learning_rate, weight_decay=weight_decay, nimg_per_epoch=max(2, len(train_data)), model_name=model_name)
+  train_probs = None
+  if use_tile_index and (Path(train_dir) / TILE_INDEX_NAME).exists():
+    index = load_tile_index(train_dir)
+    probs = tile_sampling_probs(index, min_cells=min_cells)
+    probs = probs[probs > 0]
+    mask_names = index.set_index("image").loc[probs.index, "mask"]
+    print(f"tile index: training on {len(probs)} of {len(index)} tiles")
+    train_data = [io.imread(str(Path(train_dir) / name)) for name in probs.index]
+    train_labels = [io.imread(str(Path(train_dir) / name)) for name in mask_names]
+    train_probs = probs.values
+  else:
+    output = io.load_train_test_data(train_dir, test_dir, mask_filter=masks_ext)
+    train_data, train_labels, _, test_data, test_labels, _ = output
+  if use_flow_cache:
+    # (4, H, W) labels are taken by train_seg as precomputed flows
+    train_labels = load_flow_targets(train_labels, Path(train_dir) / FLOW_CACHE_DIR)
+  new_model_path, train_losses, test_losses = train.train_seg(model.net, train_data=train_data, train_labels=train_labels, train_probs=train_probs, batch_size=batch_size, n_epochs=n_epochs, learning_rate=learning_rate, weight_decay=weight_decay, nimg_per_epoch=max(2, len(train_data)), model_name=model_name)
+
+
+# train.train_seg internals the lazy loop reuses: private in cellpose, so only trusted on the pinned major version
+CELLPOSE_TRAIN_INTERNALS = ("_reshape_norm", "_loss_fn_seg")
+CELLPOSE_TRAIN_MAJOR = "4"
+
+def _train_internals():
+  """
+  (train._reshape_norm, train._loss_fn_seg), or ImportError if this cellpose does not provide them as 4.x does.
+  """
+  cellpose_version = importlib.metadata.version("cellpose")
+  missing = [name for name in CELLPOSE_TRAIN_INTERNALS if not hasattr(train, name)]
+  if cellpose_version.split(".")[0] != CELLPOSE_TRAIN_MAJOR or missing:
+    raise ImportError(f"train_cp_sam_model_lazy needs cellpose {CELLPOSE_TRAIN_MAJOR}.x (train.{', train.'.join(CELLPOSE_TRAIN_INTERNALS)}), "
+                      f"found cellpose {cellpose_version}{' without ' + ', '.join(missing) if missing else ''}; "
+                      f"install the version from requirements.txt or use train_cp_sam_model")
+  return train._reshape_norm, train._loss_fn_seg
+
+def _lr_schedule(learning_rate, n_epochs):
+  """
+  Per-epoch learning rates of train.train_seg: 10 warmup epochs, then constant, halved
+  ten times over the last 100 (n_epochs > 300) or 50 (n_epochs > 99) epochs.
+  """
+  LR = np.linspace(0, learning_rate, 10)
+  LR = np.append(LR, learning_rate * np.ones(max(0, n_epochs - 10)))
+  if n_epochs > 300:
+    LR = LR[:-100]
+    for _ in range(10):
+      LR = np.append(LR, LR[-1] / 2 * np.ones(10))
+  elif n_epochs > 99:
+    LR = LR[:-50]
+    for _ in range(10):
+      LR = np.append(LR, LR[-1] / 2 * np.ones(5))
+  return LR
+
+def train_cp_sam_model_lazy(img_dir, mask_dir, model_name, n_epochs=100, learning_rate=1e-5, weight_decay=0.1, batch_size=1,
+                            crop_size=1024, nimg_per_epoch=200, empty_keep_prob=0.1, bsize=256, geojson_dir=None, save_path=None,
+                            test_img_dir=None, test_mask_dir=None, test_geojson_dir=None, nimg_test=20, save_every=100):
+  """
+  Train a Cellpose-SAM model on random crops drawn on demand from whole slides,
+  instead of pre-split tiles loaded into memory (see utils/generate_training_crops.py).
+
+  Args:
+    img_dir (str): Directory with the original slide TIFFs.
+    mask_dir (str): Directory with the <stem>_masks.tif label masks (ignored if geojson_dir is set).
+    model_name (str): Name of the model to be trained.
+    n_epochs (int): Number of epochs to train the model.
+    learning_rate (float): Peak learning rate (same warmup/decay schedule as train.train_seg).
+    weight_decay (float): Weight decay for the optimizer.
+    batch_size (int): Batch size for training.
+    crop_size (int): Side of the crops read from the slides.
+    nimg_per_epoch (int): Crops drawn per epoch.
+    empty_keep_prob (float): Probability of keeping a crop without any labels.
+    bsize (int): Size of the augmented patches fed to the network (as in train.train_seg).
+    geojson_dir (str): Optional directory of <stem>.geojson annotations rasterized per crop.
+    save_path (str): Root for models/<model_name> (default: img_dir).
+    test_img_dir (str): Optional directory of held-out slides, evaluated when train.train_seg would.
+    test_mask_dir (str): Label masks of the held-out slides.
+    test_geojson_dir (str): GeoJSON annotations of the held-out slides (instead of test_mask_dir).
+    nimg_test (int): Held-out crops, drawn once so test losses compare across epochs.
+    save_every (int): Save a checkpoint every save_every epochs (as train.train_seg), and after the last one.
+
+  Returns:
+    Path of the saved model.
+  """
+  reshape_norm, loss_fn_seg = _train_internals()
+  if core.use_gpu()==False:raise ImportError("No GPU access, change your runtime")
+
+  model = models.CellposeModel(gpu=True)
+  net, device = model.net, model.device
+  dataset = RandomCropDataset(img_dir, mask_dir, crop_h=crop_size, crop_w=crop_size,
+                              empty_keep_prob=empty_keep_prob, geojson_dir=geojson_dir)
+  test_imgs = test_lbls = None
+  if test_img_dir is not None:
+    test_dataset = RandomCropDataset(test_img_dir, test_mask_dir, crop_h=crop_size, crop_w=crop_size,
+                                     empty_keep_prob=empty_keep_prob, geojson_dir=test_geojson_dir, seed=0)
+    test_imgs, test_masks = test_dataset.batch(nimg_test)
+    test_imgs = reshape_norm(test_imgs, normalize_params=models.normalize_default)
+    test_lbls = [f[1:] for f in dynamics.labels_to_flows(test_masks, device=device)]
+  optimizer = torch.optim.AdamW(net.parameters(), lr=learning_rate, weight_decay=weight_decay)
+  LR = _lr_schedule(learning_rate, n_epochs)
+  model_path = Path(save_path or img_dir) / "models" / model_name
+  model_path.parent.mkdir(parents=True, exist_ok=True)
+
+  def batch_loss(imgs, lbls):
+    X, lbl = transforms.random_rotate_and_resize(imgs, lbls=lbls, bsize=bsize, scale_range=0.5, device=device)[:2]
+    with torch.autocast(device_type=device.type, dtype=net.dtype):
+      y = net(X)[0]
+    return loss_fn_seg(lbl, y, device)
+
+  # same per-batch steps as train.train_seg, but images come from the lazy dataset
+  # and flows are computed for each batch of crops instead of for all data up front
+  n_batches = max(1, nimg_per_epoch // batch_size)
+  t0 = time.time()
+  for epoch in range(n_epochs):
+    for param_group in optimizer.param_groups:
+      param_group["lr"] = LR[epoch]
+    net.train()
+    epoch_loss = 0.0
+    for _ in range(n_batches):
+      imgs, masks = dataset.batch(batch_size)
+      imgs = reshape_norm(imgs, normalize_params=models.normalize_default)
+      lbls = [f[1:] for f in dynamics.labels_to_flows(masks, device=device)]
+      loss = batch_loss(imgs, lbls)
+      optimizer.zero_grad()
+      loss.backward()
+      optimizer.step()
+      epoch_loss += loss.item()
+    epoch_loss /= n_batches
+
+    if epoch == 5 or epoch % 10 == 0:
+      test_loss = ""
+      if test_imgs is not None:
+        net.eval()
+        rng_state = np.random.get_state()
+        np.random.seed(42)  # same augmentation of the held-out crops at every evaluation
+        losses = []
+        with torch.no_grad():
+          for i in range(0, len(test_imgs), batch_size):
+            losses.append(batch_loss(test_imgs[i:i + batch_size], test_lbls[i:i + batch_size]).item())
+        np.random.set_state(rng_state)
+        test_loss = f", test_loss={np.mean(losses):.4f}"
+      logger.info(f"{epoch}, train_loss={epoch_loss:.4f}{test_loss}, LR={LR[epoch]:.6f}, time {time.time() - t0:.2f}s")
+    if epoch % save_every == 0 and epoch != 0:
+      net.save_model(str(model_path))
+
+  net.save_model(str(model_path))
+  logger.info(f"saved model to {model_path}")
+  return model_path
 
 
 if __name__ == "__main__":
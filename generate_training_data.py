@@ -3,41 +3,72 @@ import logging, os
 from pathlib import Path
 from utils.constants import *
 from utils.generate_split_images import ImageSplitter
-from utils.generate_masks import MaskStitcher
 from utils.generate_pngs import TiffToPngConverter
-from model.run_cellpose import CellposeBatchProcessor
-from utils.generate_image_overlays import OverlayGenerator
 from utils.generate_training_dataset import *
 from utils.generate_training_split_img_masks import split_folder
+from utils.generate_pipeline import PipelineRunner, Stage
 
 # constants
 TILE_H = TILE_W = 1024  # training tile size
+RASTERIZE_INTO_TILES = False  # True: burn GeoJSONs straight into the training tiles, no full-size masks/previews
+PRECOMPUTE_FLOWS = True  # compute Cellpose flow targets for the mask tiles in parallel, read back by train_cp_sam_model
+SKIP_EMPTY_TILES = False  # True: index tiles without cells but do not write them
+PREVIEW_DOWNSAMPLES = (8, 32)  # mask preview scales, finest first
 
-# generate - pngs
-setup_logging(logging.INFO)
-converter = TiffToPngConverter(scaling_factor=SCALING_FACTOR, tif_dir=TIF_IMAGES_DIR, output_dir=PNG_IMAGES_DIR)
-converter.convert_all()
-
-# generate - splits
-setup_logging(logging.INFO)
-splitter = ImageSplitter(source_dir=PNG_IMAGES_DIR, output_dir=SPLIT_IMAGES_DIR, sub_image_width=IMG_WIDTH, sub_image_height=IMG_HEIGHT)
-splitter.split_all()
-
-# generate - masks for training
-setup_logging(logging.INFO)
-os.makedirs(TRAIN_MASKS_DIR, exist_ok=True)
-for image in TIF_IMAGES_DIR.glob("*.tif"):
-    img_path = Path(image)
-    geojson_path = GEOJSON_DIR / (img_path.stem + ".geojson")
-    mask_png = TRAIN_MASKS_DIR / (img_path.stem + "_masks.tif")
-    geojson_to_mask_png(img_path, geojson_path, mask_png)
-    label_mask = np.array(Image.open(mask_png), dtype=np.uint16)
-    make_bw_preview(label_mask, mask_png.with_name(img_path.stem + "_mask_bw.png"))
-    make_colored_preview(label_mask, mask_png.with_name(img_path.stem + "_mask_color.png"))
+# parameters (part of each stage's fingerprint: changing one only reruns that stage and its dependants)
+png_params = dict(scaling_factor=SCALING_FACTOR)
+split_params = dict(sub_image_width=IMG_WIDTH, sub_image_height=IMG_HEIGHT)
+mask_params = dict(preview_downsamples=PREVIEW_DOWNSAMPLES)
+tile_params = dict(TILE_H=TILE_H, TILE_W=TILE_W, compute_flows=PRECOMPUTE_FLOWS, skip_empty=SKIP_EMPTY_TILES,
+                   preview_downsamples=PREVIEW_DOWNSAMPLES)
+
+# generate - masks for training (full-size label masks and their previews)
+def generate_masks():
+    os.makedirs(TRAIN_MASKS_DIR, exist_ok=True)
+    for image in TIF_IMAGES_DIR.glob("*.tif"):
+        img_path = Path(image)
+        geojson_path = GEOJSON_DIR / (img_path.stem + ".geojson")
+        mask_png = TRAIN_MASKS_DIR / (img_path.stem + "_masks.tif")
+        # rasterized in row bands: previews are sampled from each band, the mask goes straight to disk
+        previewer = geojson_to_mask_tif(img_path, geojson_path, mask_png, preview_downsamples=mask_params["preview_downsamples"])
+        previewer.save(TRAIN_MASKS_DIR, img_path.stem)
 
 # generate - split images and masks for training
-setup_logging(logging.INFO)
-split_folder(TIF_IMAGES_DIR, TRAIN_MASKS_DIR, TRAIN_SPLIT_IMG_MASKS_DIR, TILE_H, TILE_W)
+def generate_tiles():
+    split_folder(TIF_IMAGES_DIR, TRAIN_MASKS_DIR, TRAIN_SPLIT_IMG_MASKS_DIR,
+                 geojson_dir=GEOJSON_DIR if RASTERIZE_INTO_TILES else None,
+                 preview_dir=TRAIN_MASKS_DIR if RASTERIZE_INTO_TILES else None, **tile_params)
+
+if RASTERIZE_INTO_TILES:
+    tile_labels = [(GEOJSON_DIR, "*.geojson")]
+    tile_outputs = [TRAIN_SPLIT_IMG_MASKS_DIR, (TRAIN_MASKS_DIR, "*_mask_*.png")]
+else:
+    tile_labels = [(TRAIN_MASKS_DIR, "*_masks.tif")]
+    tile_outputs = [TRAIN_SPLIT_IMG_MASKS_DIR]
+
+stages = [
+    # generate - pngs
+    Stage("pngs", lambda: TiffToPngConverter(tif_dir=TIF_IMAGES_DIR, output_dir=PNG_IMAGES_DIR, **png_params).convert_all(),
+          inputs=[(TIF_IMAGES_DIR, "*.tif")], outputs=[(PNG_IMAGES_DIR, "*.png")], params=png_params),
+    # generate - splits
+    Stage("splits", lambda: ImageSplitter(source_dir=PNG_IMAGES_DIR, output_dir=SPLIT_IMAGES_DIR, **split_params).split_all(),
+          inputs=[(PNG_IMAGES_DIR, "*.png")], outputs=[(SPLIT_IMAGES_DIR, "*.png")], params=split_params),
+    # generate - training tiles (and flow targets, tile index), from the masks or straight from the geojsons
+    Stage("training_tiles", generate_tiles, inputs=[(TIF_IMAGES_DIR, "*.tif")] + tile_labels, outputs=tile_outputs,
+          params=dict(tile_params, rasterize_into_tiles=RASTERIZE_INTO_TILES)),
+]
+if not RASTERIZE_INTO_TILES:
+    stages.append(Stage("training_masks", generate_masks, inputs=[(TIF_IMAGES_DIR, "*.tif"), (GEOJSON_DIR, "*.geojson")],
+                        outputs=[(TRAIN_MASKS_DIR, "*_masks.tif"), (TRAIN_MASKS_DIR, "*_mask_*.png")], params=mask_params))
+
+# run - stage DAG: only stages whose inputs, parameters or outputs changed
+# (own state directory: main.py records its "pngs"/"splits" runs under PIPELINE_STATE_DIR)
+def main(force=()):
+    setup_logging(logging.INFO)
+    PipelineRunner(stages, state_dir=PIPELINE_STATE_DIR / "training", force=force).run()
+
+if __name__ == "__main__":
+    main()
 
 
 
@@ -1,5 +1,6 @@
 # imports
-import logging
+import logging, re
+from glob import escape as glob_escape
 from pathlib import Path
 from utils.constants import *
 from utils.generate_plots import PlotGenerator
@@ -7,43 +8,123 @@ from utils.generate_split_images import ImageSplitter
 from utils.generate_masks import MaskStitcher
 from utils.generate_combine_masks import NPYMaskStitcher
 from utils.generate_pngs import TiffToPngConverter
-from model.run_cellpose import CellposeBatchProcessor
-from utils.generate_image_overlays import OverlayGenerator
-from model.run_cellpose_sam import cellpose_sam_detect_images_eval
 from utils.generate_geojson_qp_mask import MaskToGeoJSONConverter
+from utils.generate_pipeline import PipelineRunner, Stage
+from utils.generate_slide_scheduler import SlideScheduler, SlideStage
+from utils.generate_work_queue import WorkQueue, parse_tile_range, tile_ranges
 
-# generate - pngs
-setup_logging(logging.INFO)
-converter = TiffToPngConverter(scaling_factor=SCALING_FACTOR, tif_dir=TIF_IMAGES_DIR, output_dir=PNG_IMAGES_DIR)
-converter.convert_all()
+# constants
+SLIDE_PIPELINING = False  # True: schedule batch runs slide by slide across stages (no stage skipping)
+SHARED_QUEUE = False  # True: share the work with other nodes running this script on the same CONFIG_DIR
+DETECT_TILES_PER_ITEM = 64  # tiles per detect work item in SHARED_QUEUE mode
 
-# generate - splits
-setup_logging(logging.INFO)
-splitter = ImageSplitter(source_dir=PNG_IMAGES_DIR, output_dir=SPLIT_IMAGES_DIR, sub_image_width=IMG_WIDTH, sub_image_height=IMG_HEIGHT)
-splitter.split_all()
+# parameters (part of each stage's fingerprint: changing one only reruns that stage and its dependants)
+png_params = dict(scaling_factor=SCALING_FACTOR)
+split_params = dict(sub_image_width=IMG_WIDTH, sub_image_height=IMG_HEIGHT)
+detect_params = dict(model_path=MODEL, flow_threshold=0.9, cellprob_threshold=-6, min_size=1)
+stitch_params = dict(feature_dir=GEOJSON_OUTS_DIR, image_dir=PNG_IMAGES_DIR)
+plot_params = dict(overlay_color=(238,144,144), boundary_color=(100,100,255), alpha=0.5)
+geojson_params = dict(upscale_factor=SCALING_FACTOR)
 
-# generate - cellpose masks (detect step using a pre-trained model)
-setup_logging(logging.INFO)
-cellpose_sam_detect_images_eval(model_path=MODEL, image_input_dir=SPLIT_IMAGES_DIR, image_output_dir=CELLPOSE_MASKS_DIR)
+stages = [
+    # generate - pngs
+    Stage("pngs", lambda: TiffToPngConverter(tif_dir=TIF_IMAGES_DIR, output_dir=PNG_IMAGES_DIR, **png_params).convert_all(),
+          inputs=[(TIF_IMAGES_DIR, "*.tif")], outputs=[(PNG_IMAGES_DIR, "*.png")], params=png_params),
+    # generate - splits
+    Stage("splits", lambda: ImageSplitter(source_dir=PNG_IMAGES_DIR, output_dir=SPLIT_IMAGES_DIR, **split_params).split_all(),
+          inputs=[(PNG_IMAGES_DIR, "*.png")], outputs=[(SPLIT_IMAGES_DIR, "*.png")], params=split_params),
+    # generate - cellpose masks (detect step using a pre-trained model)
+    Stage("detect", lambda: detect_images(image_input_dir=SPLIT_IMAGES_DIR, image_output_dir=CELLPOSE_MASKS_DIR, slide_dir=PNG_IMAGES_DIR, **detect_params),
+          inputs=[(SPLIT_IMAGES_DIR, "*.png"), (PNG_IMAGES_DIR, "*.png"), Path(MODEL)], outputs=[(CELLPOSE_MASKS_DIR, "*.npy")], params=detect_params),
+    # generate - stitched masks (.npy files) and per-cell feature tables next to the geojsons
+    Stage("stitch", lambda: NPYMaskStitcher(input_dir=CELLPOSE_MASKS_DIR, output_dir=STITCHED_MASKS_DIR, **stitch_params).stitch_all(),
+          inputs=[(CELLPOSE_MASKS_DIR, "*.npy"), (PNG_IMAGES_DIR, "*.png")],
+          outputs=[(STITCHED_MASKS_DIR, "*.npy"), (GEOJSON_OUTS_DIR, "*_cells.parquet")], params=stitch_params),
+    # generate - plots
+    Stage("plots", lambda: PlotGenerator(image_dir=PNG_IMAGES_DIR, mask_dir=STITCHED_MASKS_DIR, output_dir=OUTPUT_DIR, **plot_params).run(),
+          inputs=[(PNG_IMAGES_DIR, "*.png"), (STITCHED_MASKS_DIR, "*.npy")], outputs=[OUTPUT_DIR], params=plot_params),
+    # generate - geojsons
+    Stage("geojsons", lambda: MaskToGeoJSONConverter(mask_dir=STITCHED_MASKS_DIR, output_dir=GEOJSON_OUTS_DIR, **geojson_params).convert_all(),
+          inputs=[(STITCHED_MASKS_DIR, "*.npy")], outputs=[(GEOJSON_OUTS_DIR, "*.geojson"), (GEOJSON_OUTS_DIR, "*_index.npz")], params=geojson_params),
+]
 
-# generate - stitched masks (.npy files)
-setup_logging(logging.INFO)
-stitcher = NPYMaskStitcher(input_dir=CELLPOSE_MASKS_DIR, output_dir=STITCHED_MASKS_DIR)
-stitcher.stitch_all()
+# model code (cellpose, torch, skimage) is only imported once detection actually runs
+def detect_images(**kwargs):
+    from model.run_cellpose_sam import cellpose_sam_detect_images_eval
+    cellpose_sam_detect_images_eval(**kwargs)
 
-# generate - plots
-setup_logging(logging.INFO)
-plotter = PlotGenerator(image_dir=PNG_IMAGES_DIR, mask_dir=STITCHED_MASKS_DIR, output_dir=OUTPUT_DIR, overlay_color=(238,144,144), boundary_color=(100,100,255), alpha=0.5)
-plotter.run()
+# per-slide stages for batch runs: each slide moves on as soon as its previous stage is done
+def slide_tiles(stem):
+    return sorted(p for p in SPLIT_IMAGES_DIR.glob(f"{glob_escape(stem)}_*_*.png") if re.fullmatch(rf"{re.escape(stem)}_\d+_\d+", p.stem))
 
-# generate - geojsons
-setup_logging(logging.INFO)
-converter = MaskToGeoJSONConverter(mask_dir=STITCHED_MASKS_DIR, output_dir=GEOJSON_OUTS_DIR, upscale_factor=SCALING_FACTOR)
-converter.convert_all()
+def tile_detector():
+    from model.run_cellpose_sam import cellpose_sam_detect_files, load_cellpose_sam_model
+    model, normalizers = load_cellpose_sam_model(detect_params["model_path"]), {}
+    detect_kwargs = {k: v for k, v in detect_params.items() if k != "model_path"}
+    return lambda tile_files: cellpose_sam_detect_files(model, tile_files, CELLPOSE_MASKS_DIR, slide_dir=PNG_IMAGES_DIR,
+                                                        normalizers=normalizers, **detect_kwargs)
+
+def slide_stages(detect=None):
+    converter = TiffToPngConverter(tif_dir=TIF_IMAGES_DIR, output_dir=PNG_IMAGES_DIR, **png_params)
+    splitter = ImageSplitter(source_dir=PNG_IMAGES_DIR, output_dir=SPLIT_IMAGES_DIR, **split_params)
+    detect = detect or tile_detector()
+    stitcher = NPYMaskStitcher(input_dir=CELLPOSE_MASKS_DIR, output_dir=STITCHED_MASKS_DIR, **stitch_params)
+    plotter = PlotGenerator(image_dir=PNG_IMAGES_DIR, mask_dir=STITCHED_MASKS_DIR, output_dir=OUTPUT_DIR, **plot_params)
+    geojsons = MaskToGeoJSONConverter(mask_dir=STITCHED_MASKS_DIR, output_dir=GEOJSON_OUTS_DIR, **geojson_params)
+    return [
+        SlideStage("pngs", lambda stem: converter.convert_file(TIF_IMAGES_DIR / f"{stem}.tif"), workers=2),
+        SlideStage("splits", lambda stem: splitter.split_file(PNG_IMAGES_DIR / f"{stem}.png"), workers=2),
+        SlideStage("detect", lambda stem: detect(slide_tiles(stem)), workers=1),
+        SlideStage("stitch", lambda stem: stitcher.stitch_stem(stem), workers=2),
+        SlideStage("plots", lambda stem: plotter.plot_mask(STITCHED_MASKS_DIR / f"{stem}.npy"), workers=2, after=["stitch"]),
+        SlideStage("geojsons", lambda stem: geojsons.convert_file(STITCHED_MASKS_DIR / f"{stem}.npy"), workers=2, after=["stitch"]),
+    ]
+
+# multi-node run: every node claims slides (tile ranges for detection) from a lease-file queue under CONFIG_DIR
+def run_shared_queue():
+    stems = sorted(p.stem for p in TIF_IMAGES_DIR.glob("*.tif"))
+    queue = WorkQueue(WORK_QUEUE_DIR)
+    detect = tile_detector()
+    run = {stage.name: stage.run for stage in slide_stages(detect)}
+
+    def detect_ranges(stem):
+        return tile_ranges(stem, len(slide_tiles(stem)), DETECT_TILES_PER_ITEM)
+
+    def detect_range(item):
+        stem, start, end = parse_tile_range(item)
+        detect(slide_tiles(stem)[start:end])
+
+    def stage_done(stage):
+        return lambda stem: queue.is_done(stage, stem)
+
+    queue.work([
+        ("pngs", stems, run["pngs"], None),
+        ("splits", stems, run["splits"], stage_done("pngs")),
+        ("detect", lambda: [item for stem in stems if queue.is_done("splits", stem) for item in detect_ranges(stem)], detect_range, None),
+        # stitch a slide once every tile range of it is detected, by whichever nodes
+        ("stitch", stems, run["stitch"], lambda stem: queue.is_done("splits", stem) and queue.all_done("detect", detect_ranges(stem))),
+        ("plots", stems, run["plots"], stage_done("stitch")),
+        ("geojsons", stems, run["geojsons"], stage_done("stitch")),
+    ])
+
+# run - stage DAG: only stages whose inputs, parameters or outputs changed, plots and geojsons concurrently
+def main(force=()):
+    setup_logging(logging.INFO, metrics_dir=METRICS_DIR, profile_stages=PROFILE_STAGES)
+    if SHARED_QUEUE:
+        run_shared_queue()
+    elif SLIDE_PIPELINING:
+        SlideScheduler(slide_stages()).run(sorted(p.stem for p in TIF_IMAGES_DIR.glob("*.tif")))
+    else:
+        PipelineRunner(stages, state_dir=PIPELINE_STATE_DIR, force=force).run()
+
+if __name__ == "__main__":
+    main()
 
 
 
 ########## archived code ##########
+# from model.run_cellpose import CellposeBatchProcessor
+# from utils.generate_image_overlays import OverlayGenerator
 # # cellpose - masks
 # setup_logging(logging.INFO)
 # processor = CellposeBatchProcessor(input_dir=SPLIT_IMAGES_DIR, output_dir=CELLPOSE_MASKS_DIR, model_name="",
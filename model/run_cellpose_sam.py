@@ -1,12 +1,19 @@
 # imports
 from pathlib import Path
-import os, re, numpy as np
-from cellpose import models
-from skimage import io as skio
-from tqdm import tqdm
+import os, re, time, numpy as np
+# local imports
+from utils.generate_slide_norm import SlideNormalizer
+from utils.generate_instrumentation import instrumented, stage_add, stage_observe
 
+DETECT_DEPENDENCIES = ("skimage", "tqdm")  # imported by cellpose_sam_detect_files on first use
 
-def cellpose_sam_detect_images_eval(model_path, image_input_dir, image_output_dir, image_ext=".png", flow_threshold=0.9, cellprob_threshold=-6, min_size=1):
+
+def load_cellpose_sam_model(model_path):
+    from cellpose import models  # torch import: only when a model is actually loaded
+    return models.CellposeModel(gpu=True, pretrained_model=model_path)
+
+
+def cellpose_sam_detect_images_eval(model_path, image_input_dir, image_output_dir, image_ext=".png", flow_threshold=0.9, cellprob_threshold=-6, min_size=1, slide_dir=None):
     """
     Detect images using Cellpose SAM.
     
@@ -18,17 +25,44 @@ def cellpose_sam_detect_images_eval(model_path, image_input_dir, image_output_di
         flow_threshold (float): Flow threshold for Cellpose SAM.
         cellprob_threshold (float): Cell probability threshold for Cellpose SAM.
         min_size (int): Minimum size for Cellpose SAM.
+        slide_dir (Path): Optional directory with the full slides the tiles were split from
+            (<slide>_<row>_<col> → <slide><image_ext>). Tiles are then normalized with the
+            slide's percentile bounds (computed once, stored as <slide>.norm.json) instead of
+            Cellpose's per-tile percentiles.
     """
     print(image_output_dir)
     image_files = [f for f in image_input_dir.glob("*"+image_ext) if "_masks" not in f.name and "_flows" not in f.name]
-    model = models.CellposeModel(gpu=True, pretrained_model=model_path)
+    model = load_cellpose_sam_model(model_path)
+    cellpose_sam_detect_files(model, image_files, image_output_dir, image_ext=image_ext, flow_threshold=flow_threshold,
+                              cellprob_threshold=cellprob_threshold, min_size=min_size, slide_dir=slide_dir)
+
+
+@instrumented(name="detect")
+def cellpose_sam_detect_files(model, image_files, image_output_dir, image_ext=".png", flow_threshold=0.9, cellprob_threshold=-6, min_size=1, slide_dir=None, normalizers=None):
+    """
+    Detect the given image files with an already loaded Cellpose SAM model (see cellpose_sam_detect_images_eval).
+    normalizers can be shared between calls to keep slide bounds loaded.
+    """
+    from skimage import io as skio
+    from tqdm import tqdm
     os.makedirs(image_output_dir, exist_ok=True)
+    normalizers = {} if normalizers is None else normalizers
 
     for image_file in tqdm(image_files, desc="Segmenting images"):
-        image_path = os.path.join(image_input_dir, image_file)
-        img = skio.imread(image_path)
-        masks, flows, styles = model.eval([img], batch_size = 16, flow_threshold=flow_threshold, cellprob_threshold=cellprob_threshold, augment=True, resample=True, min_size=min_size)
+        img = skio.imread(str(image_file))
+        normalize = True
+        tile_match = re.match(r"(.+)_\d+_\d+$", Path(image_file).stem) if slide_dir is not None else None
+        if tile_match:
+            slide = tile_match.group(1)
+            if slide not in normalizers:
+                normalizers[slide] = SlideNormalizer.for_slide(Path(slide_dir) / f"{slide}{image_ext}")
+            img = normalizers[slide].apply(img)
+            normalize = {"lowhigh": [0, 255]}  # already scaled by the slide bounds
+        start = time.perf_counter()
+        masks, flows, styles = model.eval([img], batch_size = 16, flow_threshold=flow_threshold, cellprob_threshold=cellprob_threshold, augment=True, resample=True, min_size=min_size, normalize=normalize)
         mask = masks[0]
+        stage_observe("detect", "tile_latency_s", time.perf_counter() - start)
+        stage_add("detect", tiles=1, cells=int(mask.max()), bytes=img.nbytes)
         base_name = Path(image_file).stem
         mask_path = os.path.join(image_output_dir, f"{base_name}.npy")
-        np.save(mask_path, mask)
\ No newline at end of file
+        np.save(mask_path, mask)
@@ -3,72 +3,137 @@
 Streamlit front-end for the Cellpose automation pipeline.
 Allows uploading a TIF, runs conversion → split → cellpose → stitching → overlay/comparison → geojson,
 then displays results and provides download links.
+
+Every upload becomes a background job with its own workspace under JOBS_DIR/<session>/<job>,
+so several users can segment slides at the same time; all sessions share one JobManager
+and therefore one loaded model. Results are cached by upload content, model and parameters
+(RESULT_CACHE_DIR), so re-submitting a slide returns at once and a changed display
+setting only reruns the stages it affects.
+
+A browser upload arrives as an in-memory UploadedFile, so its size (and the
+app's memory per upload) is bounded by server.maxUploadSize; it is saved, hashed
+and TIFF-inspected in one pass (utils.generate_upload). Large slides belong under
+SERVER_SLIDE_DIRS and the "Server path" mode, which opens them in place with no
+upload, no copy and no full read.
 """
 
 # imports
-import streamlit as st, logging, shutil
-from PIL import Image
+import streamlit as st, uuid
 from pathlib import Path
 from utils.constants import *
-from utils.generate_plots import PlotGenerator
-from utils.generate_split_images import ImageSplitter
-from utils.generate_masks import MaskStitcher
-from utils.generate_combine_masks import NPYMaskStitcher
-from utils.generate_pngs import TiffToPngConverter
-from model.run_cellpose import CellposeBatchProcessor
-from utils.generate_image_overlays import OverlayGenerator
-from model.run_cellpose_sam import cellpose_sam_detect_images_eval
-from utils.generate_geojson_qp_mask import MaskToGeoJSONConverter
-
-dirs = [TIF_IMAGES_DIR, PNG_IMAGES_DIR, SPLIT_IMAGES_DIR, CELLPOSE_MASKS_DIR, STITCHED_MASKS_DIR, OUTPUT_DIR, GEOJSON_OUTS_DIR]
+from utils.generate_jobs import JobManager
+from utils.generate_result_cache import ResultCache
+from utils.generate_upload import SlideUpload, TiffInfo, server_slide, stat_digest
+from utils.generate_tile_pyramid import read_pyramid_view
+
+MAX_CONCURRENT_JOBS = 2  # slides processed at once (detection still takes turns on the one model)
+job_params = dict(model=MODEL, scaling_factor=SCALING_FACTOR, tile_width=IMG_WIDTH, tile_height=IMG_HEIGHT,
+                  flow_threshold=0.9, cellprob_threshold=-6, min_size=1,
+                  overlay_color=(238,144,144), boundary_color=(100,100,255), alpha=0.5)
+STAGE_ICONS = {"pending": "⏳", "running": "🔄", "done": "✅", "failed": "❌", "skipped": "⏭️", "cached": "♻️"}
+
+
+def load_model():
+    from model.run_cellpose_sam import load_cellpose_sam_model  # torch/cellpose: only on the first detection
+    return load_cellpose_sam_model(MODEL)
+
+
+@st.cache_resource
+def job_manager() -> JobManager:
+    # one per server process, shared by every session: the model is loaded once and stays warm
+    cache = ResultCache(RESULT_CACHE_DIR, max_bytes=int(RESULT_CACHE_MAX_GB * 2 ** 30))
+    return JobManager(JOBS_DIR, model_loader=load_model, max_workers=MAX_CONCURRENT_JOBS, cache=cache)
+
+
+@st.cache_data(max_entries=32)
+def overlay_view(dzi_path: str, mtime: float):
+    return read_pyramid_view(dzi_path, max_size=2048)
+
+
+@st.cache_data(max_entries=8)
+def download_bytes(path: str, mtime: float) -> bytes:
+    # read once per file version, not on every rerun of the job panel
+    return Path(path).read_bytes()
+
 
 st.title("Cellpose-sam for DRGs - Automated Pipeline")
+session_id = st.session_state.setdefault("session_id", uuid.uuid4().hex[:12])
+manager = job_manager()
+
+def submit(tif_path, info: TiffInfo, content_hash: str, workspace=None) -> None:
+    # downscale from the smallest pyramid level that still covers the PNG, when the slide has one
+    params = dict(job_params, tif_level=info.png_level(SCALING_FACTOR) if info else 0)
+    job = manager.submit(session_id, tif_path, params, workspace=workspace, content_hash=content_hash)
+    if info:
+        st.caption(f"{info.describe()} → reading level {params['tif_level']}")
+    st.success(f"Queued {Path(tif_path).name} (job {job.id})")
+
 
-uploaded = st.file_uploader("Upload a TIFF image", type=["tif"])
-if uploaded:
-
-    for d in dirs:
-        p = Path(d)
-        if p.exists() and p.is_dir():
-            shutil.rmtree(p) # to refresh the directory
-        p.mkdir(parents=True, exist_ok=True)
-
-    tif_path = TIF_IMAGES_DIR / uploaded.name
-    with open(tif_path, "wb") as f:
-        f.write(uploaded.getbuffer())  # save TIFF
-    st.success(f"Saved input to {tif_path}")
-    stem = tif_path.stem
-
-    # generate - pngs
-    with st.spinner("Converting TIFF to PNG..."):
-        TiffToPngConverter(scaling_factor=SCALING_FACTOR, tif_dir=TIF_IMAGES_DIR, output_dir=PNG_IMAGES_DIR).convert_all()
-    # generate - splits
-    with st.spinner("Splitting PNG into tiles..."):
-        ImageSplitter(source_dir=PNG_IMAGES_DIR, output_dir=SPLIT_IMAGES_DIR, sub_image_width=IMG_WIDTH, sub_image_height=IMG_HEIGHT).split_all()
-    # generate - cellpose masks (detect step using a pre-trained model)
-    with st.spinner("Running Cellpose segmentation..."):
-        cellpose_sam_detect_images_eval(model_path=MODEL, image_input_dir=SPLIT_IMAGES_DIR, image_output_dir=CELLPOSE_MASKS_DIR)
-    # generate - stitched masks (.npy files)
-    with st.spinner("Stitching masks..."):
-        NPYMaskStitcher(input_dir=CELLPOSE_MASKS_DIR, output_dir=STITCHED_MASKS_DIR).stitch_all()
-    # generate - plots
-    with st.spinner("Generating overlays and comparisons..."):
-        PlotGenerator(image_dir=PNG_IMAGES_DIR, mask_dir=STITCHED_MASKS_DIR, output_dir=OUTPUT_DIR, overlay_color=(238,144,144), boundary_color=(100,100,255), alpha=0.5).run()
-    # generate - geojsons
-    with st.spinner("Generating GeoJSON files..."):
-        MaskToGeoJSONConverter(mask_dir=STITCHED_MASKS_DIR, output_dir=GEOJSON_OUTS_DIR, upscale_factor=SCALING_FACTOR).convert_all()
-
-    st.success("Pipeline complete!")
-
-    # download buttons
-    st.header("Download segmentation masks")
-    geojson_file = GEOJSON_OUTS_DIR / f"{stem}.geojson"
-
-    if geojson_file.exists():
-        st.download_button(label="Download .geojson mask", data=open(geojson_file, "rb"), file_name=geojson_file.name)
-    
-    overlay_file = OUTPUT_DIR / f"{stem}_overlay.png"
-    if overlay_file.exists():
-        st.image(Image.open(overlay_file), caption="{stem} - overlay", use_column_width=True)
+source = st.radio("Slide source", ["Upload", "Server path"], horizontal=True)
+if source == "Upload":
+    uploaded = st.file_uploader("Upload a TIFF image", type=["tif", "tiff"])
+    if uploaded and st.button("Segment slide"):
+        workspace = manager.new_workspace(session_id)
+        uploaded.seek(0)
+        # already in memory (at most server.maxUploadSize): one pass saves, hashes and inspects it
+        upload = SlideUpload(workspace.tif_dir / uploaded.name).write(uploaded)
+        submit(upload.path, upload.info, upload.content_hash, workspace=workspace)
 else:
-    st.info("Please upload a TIFF image to begin.")
\ No newline at end of file
+    typed = st.text_input("Slide path on the server", help=f"Under {', '.join(map(str, SERVER_SLIDE_DIRS))}")
+    if typed and st.button("Segment slide"):
+        try:
+            tif_path = server_slide(typed, SERVER_SLIDE_DIRS)
+        except (OSError, ValueError) as e:
+            st.error(str(e))
+        else:
+            try:
+                info = TiffInfo.read(tif_path)
+            except Exception:
+                info = None
+            submit(tif_path, info, stat_digest(tif_path))  # used in place: no copy, no full read
+if not manager.session_jobs(session_id):
+    st.info("Please upload a TIFF image to begin.")
+
+
+def jobs_active() -> bool:
+    return any(job.status in ("queued", "running") for job in manager.session_jobs(session_id))
+
+
+# job list: reruns on its own every few seconds while a job is queued or running, the rest of the page stays put
+polling = jobs_active()
+
+@st.fragment(run_every=2 if polling else None)
+def job_panel():
+    if polling and not jobs_active():
+        st.rerun()  # last job finished: rerun the page once so the panel stops polling
+    for i, job in enumerate(manager.session_jobs(session_id)):
+        with st.expander(f"{job.stem} - {job.status}", expanded=i == 0 or job.status != "done"):
+            stage = job.current_stage
+            text = job.status if stage is None else stage
+            if stage == "detect":
+                text += f" ({job.tiles_done}/{job.tiles_total} tiles)"
+            st.progress(job.progress, text=text)
+            st.caption("  ".join(f"{STAGE_ICONS[s['status']]} {name}" + (f" {s['seconds']:.0f}s" if s["seconds"] is not None else "")
+                                 for name, s in job.stages.items()))
+            if job.status == "failed":
+                st.error(job.error)
+            if job.status != "done":
+                continue
+
+            # download buttons
+            geojson_file = job.output("geojson")
+            if geojson_file.exists():
+                st.download_button(label="Download .geojson mask", data=download_bytes(str(geojson_file), geojson_file.stat().st_mtime),
+                                   file_name=geojson_file.name, key=f"geojson_{job.id}")
+            cells_file = job.output("cells")
+            if cells_file.exists():
+                st.download_button(label="Download per-cell features (.parquet)", data=download_bytes(str(cells_file), cells_file.stat().st_mtime),
+                                   file_name=cells_file.name, key=f"cells_{job.id}")
+            # only the pyramid level that fits the page is read, never the full-resolution overlay
+            overlay_dzi = job.output("overlay_dzi")
+            if overlay_dzi.exists():
+                st.image(overlay_view(str(overlay_dzi), overlay_dzi.stat().st_mtime), caption=f"{job.stem} - overlay",
+                         use_column_width=True)
+
+
+job_panel()
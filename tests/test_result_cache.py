@@ -0,0 +1,51 @@
+# imports
+import shutil
+# local imports
+from utils.generate_jobs import JOB_STAGES, Workspace
+from utils.generate_result_cache import STAGE_OUTPUTS, ResultCache, stage_keys
+
+PARAMS = dict(model="cpsam", scaling_factor=0.5, tif_level=0, tile_width=256, tile_height=256, flow_threshold=0.9,
+              cellprob_threshold=-6, min_size=1, overlay_color=(1, 2, 3), boundary_color=(4, 5, 6), alpha=0.5)
+
+
+def write_outputs(workspace, stage, stem):
+    for attr, pattern in STAGE_OUTPUTS[stage]:
+        name = pattern.format(stem=stem).replace("*", "0")
+        (getattr(workspace, attr) / name).write_bytes(stage.encode())
+
+
+def cached_job(tmp_path):
+    cache = ResultCache(tmp_path / "cache", max_bytes=2 ** 30)
+    keys = stage_keys("content", PARAMS, JOB_STAGES)
+    workspace = Workspace(tmp_path / "job0").create()
+    for stage in JOB_STAGES:
+        write_outputs(workspace, stage, "slide")
+        cache.put(keys[stage], stage, workspace, "slide")
+    return cache, keys
+
+
+def test_full_hit_runs_nothing(tmp_path):
+    cache, keys = cached_job(tmp_path)
+    workspace = Workspace(tmp_path / "job1").create()
+    assert cache.plan(keys, workspace, "renamed", JOB_STAGES) == []
+    assert (workspace.geojson_dir / "renamed.geojson").exists()
+    assert (workspace.stitched_dir / "renamed.npy").exists()
+
+
+def test_evicted_upstream_entries_do_not_rerun(tmp_path):
+    cache, keys = cached_job(tmp_path)
+    for stage in ("pngs", "splits", "detect"):
+        shutil.rmtree(tmp_path / "cache" / keys[stage])
+    workspace = Workspace(tmp_path / "job1").create()
+    assert cache.plan(keys, workspace, "slide", JOB_STAGES) == []
+    assert (workspace.output_dir / "slide0").exists()
+
+
+def test_missing_final_stage_pulls_in_its_inputs(tmp_path):
+    cache, keys = cached_job(tmp_path)
+    for stage in ("detect", "stitch"):
+        shutil.rmtree(tmp_path / "cache" / keys[stage])
+    workspace = Workspace(tmp_path / "job1").create()
+    assert cache.plan(keys, workspace, "slide", JOB_STAGES) == ["detect", "stitch"]
+    assert (workspace.split_dir / "slide_0_0.png").exists()  # detect's input restored
+    assert (workspace.png_dir / "slide.png").exists()  # stitch's image input restored
@@ -0,0 +1,101 @@
+# imports
+import json, multiprocessing, os, time
+from pathlib import Path
+# local imports
+from utils.generate_work_queue import WorkQueue, tile_ranges
+
+N_NODES = 4
+STEMS = [f"s{i}" for i in range(5)]
+
+
+def record(log_dir, stage, item, node):
+    with open(Path(log_dir) / f"{stage}_{item}", "a") as fh:
+        fh.write(json.dumps({"node": node, "time": time.time()}) + "\n")
+
+
+def records(log_dir, stage, item):
+    path = Path(log_dir) / f"{stage}_{item}"
+    return [json.loads(line) for line in path.read_text().splitlines()] if path.exists() else []
+
+
+def run_items(queue_dir, log_dir, node, items, lease_seconds):
+    queue = WorkQueue(queue_dir, node_id=node, lease_seconds=lease_seconds)
+
+    def fn(item):
+        time.sleep(0.01)
+        record(log_dir, "detect", item, node)
+
+    queue.work([("detect", items, fn, None)], poll_seconds=0.05)
+
+
+def crash_holding(queue_dir, item):
+    lease = WorkQueue(queue_dir, node_id="crashed", lease_seconds=0.5).try_claim("detect", item)
+    assert lease is not None
+    os._exit(1)  # die without releasing or completing
+
+
+def run_pipeline(queue_dir, log_dir, node):
+    queue = WorkQueue(queue_dir, node_id=node, lease_seconds=2.0)
+
+    def step(stage):
+        def fn(item):
+            time.sleep(0.01)
+            record(log_dir, stage, item, node)
+        return fn
+
+    def ranges(stem):
+        return tile_ranges(stem, 10, 3)
+
+    def stitch(stem):
+        assert queue.all_done("detect", ranges(stem))
+        step("stitch")(stem)
+
+    queue.work([("split", STEMS, step("split"), None),
+                ("detect", lambda: [r for s in STEMS if queue.is_done("split", s) for r in ranges(s)], step("detect"), None),
+                ("stitch", STEMS, stitch, lambda s: queue.is_done("split", s) and queue.all_done("detect", ranges(s)))],
+               poll_seconds=0.05)
+
+
+def run_nodes(target, args_per_node):
+    ctx = multiprocessing.get_context("spawn")
+    procs = [ctx.Process(target=target, args=args) for args in args_per_node]
+    for p in procs:
+        p.start()
+    for p in procs:
+        p.join(timeout=120)
+        assert p.exitcode is not None, "worker did not finish"
+    return procs
+
+
+def test_each_item_claimed_once(tmp_path):
+    items = [f"item{i}" for i in range(40)]
+    procs = run_nodes(run_items, [(tmp_path / "queue", tmp_path, f"node{i}", items, 30.0) for i in range(N_NODES)])
+    assert all(p.exitcode == 0 for p in procs)
+    for item in items:
+        assert len(records(tmp_path, "detect", item)) == 1
+    assert WorkQueue(tmp_path / "queue").all_done("detect", items)
+
+
+def test_expired_lease_is_reclaimed_once(tmp_path):
+    queue_dir, items = tmp_path / "queue", ["a", "b", "c"]
+    run_nodes(crash_holding, [(queue_dir, "b")])
+    lease_path = WorkQueue(queue_dir)._lease_path("detect", "b")
+    assert json.loads(lease_path.read_text())["node"] == "crashed"
+    time.sleep(1.0)  # let the crashed node's lease expire
+    procs = run_nodes(run_items, [(queue_dir, tmp_path, f"node{i}", items, 0.5) for i in range(N_NODES)])
+    assert all(p.exitcode == 0 for p in procs)
+    for item in items:
+        assert len(records(tmp_path, "detect", item)) == 1
+    # the stale lease was renamed away and removed, no leftovers in the lease directory
+    assert not any(lease_path.parent.iterdir())
+
+
+def test_stitch_waits_for_all_detect_ranges(tmp_path):
+    procs = run_nodes(run_pipeline, [(tmp_path / "queue", tmp_path, f"node{i}") for i in range(N_NODES)])
+    assert all(p.exitcode == 0 for p in procs)
+    for stem in STEMS:
+        stitched = records(tmp_path, "stitch", stem)
+        assert len(stitched) == 1
+        detected = [records(tmp_path, "detect", r) for r in tile_ranges(stem, 10, 3)]
+        assert all(len(d) == 1 for d in detected)
+        assert max(d[0]["time"] for d in detected) <= stitched[0]["time"]
@@ -7,14 +7,24 @@ import logging, sys, colorlog
 from pathlib import Path
 from typing import Union
 
-def setup_logging(level: int | str = "INFO") -> None:
+def setup_logging(level: int | str = "INFO", metrics_dir: Union[str, Path, None] = None,
+                  profile_stages: tuple = (), profile_dir: Union[str, Path, None] = None) -> None:
     handler = colorlog.StreamHandler(sys.stdout)
     handler.setFormatter(colorlog.ColoredFormatter("%(asctime)s [%(levelname)s] %(name)s: %(message)s"))
     logging.basicConfig(handlers=[handler], level=level, force=True)
+    if metrics_dir is not None:
+        # per-stage timings/memory/throughput, written as JSON + Prometheus text at exit
+        from utils.generate_instrumentation import enable_metrics
+        enable_metrics(metrics_dir)
+    # stage profiling: off unless profile_stages or PIPELINE_PROFILE=<stage,...> is set
+    from utils.generate_profiling import configure_profiling
+    configure_profiling(profile_stages, profile_dir or PROFILE_DIR)
 
 # setup_logging - usage
 # from constants import setup_logging
 # setup_logging(logging.INFO)
+# setup_logging(logging.INFO, metrics_dir=METRICS_DIR)  # also record stage metrics
+# PIPELINE_PROFILE=MaskToGeoJSONConverter python main.py  # profile one stage into PROFILE_DIR
 
 cp_sam_model = "/mnt/WorkingDos/cellpose_sam/models/cp_sam_hdrg_topoint_model"
 MODEL = cp_sam_model  # "cyto3_restore"  # "/Users/discovery/Downloads/xenium_testing_jit/spinal_cord_samples_fr/train/models/cellpose_1746568542.462492"  # "cyto3_restore"
@@ -34,6 +44,15 @@ OUTPUT_DIR = CONFIG_DIR / '6_output_masks'
 TRAIN_MASKS_DIR = CONFIG_DIR / '7_train_masks'
 TRAIN_SPLIT_IMG_MASKS_DIR = CONFIG_DIR / '8_train_split_img_masks'
 GEOJSON_OUTS_DIR = CONFIG_DIR / '9_geojson_outs'
+PIPELINE_STATE_DIR = CONFIG_DIR / '.pipeline'  # stage fingerprints written by PipelineRunner
+WORK_QUEUE_DIR = CONFIG_DIR / '.queue'  # leases/completion markers shared by nodes (WorkQueue)
+METRICS_DIR = CONFIG_DIR / 'metrics'  # per-run stage reports (utils.generate_instrumentation)
+PROFILE_DIR = CONFIG_DIR / 'profiles'  # per-stage cProfile/tracemalloc/stack dumps (utils.generate_profiling)
+JOBS_DIR = CONFIG_DIR / 'jobs'  # per-session/per-job workspaces of the Streamlit app (utils.generate_jobs)
+RESULT_CACHE_DIR = CONFIG_DIR / '.result_cache'  # stage artifacts by (slide content, model, parameters) (utils.generate_result_cache)
+RESULT_CACHE_MAX_GB = 50  # least recently used entries are evicted beyond this
+SERVER_SLIDE_DIRS = (TIF_IMAGES_DIR,)  # slides the Streamlit app may open in place instead of uploading
+PROFILE_STAGES = ()  # stages to profile, e.g. ("MaskToGeoJSONConverter", "detect"); PIPELINE_PROFILE overrides
 
 GEOJSON_DIR = Path('/Users/discovery/Downloads/xenium_testing_jit/spinal_cord_samples_fr/geojsons_dir')  # training param
 
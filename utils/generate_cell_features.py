@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+"""
+Developed by Nikhil Nageshwar Inturi
+
+This module computes a per-cell feature table while NPYMaskStitcher places the
+tiles of a slide, so analyses (cell counts, sizes, per-cell NeuN intensity)
+read one small columnar file instead of the stitched mask and image.
+
+Cellpose labels cells per tile, and the stitched mask keeps those tile-local
+labels, so a cell is identified by (tile_row, tile_col, label); cell_id numbers
+them across the slide. Each tile is one chunk: sums (area, centroid,
+intensity) are np.bincount reductions, extrema (bounding box, max intensity)
+ufunc.reduceat over the pixels sorted by label, never a per-cell loop.
+
+Columns (coordinates in stitched-mask pixels, i.e. the PNG; divide by
+SCALING_FACTOR for slide pixels as MaskToGeoJSONConverter does):
+
+    cell_id, tile_row, tile_col, label, area,
+    centroid_x, centroid_y, bbox_x0, bbox_y0, bbox_x1, bbox_y1 (end-exclusive),
+    mean_c<i>, max_c<i> per image channel
+"""
+
+# imports
+import logging
+from pathlib import Path
+from typing import Dict, List, Optional, Union
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+IMAGE_SUFFIXES = (".png", ".tif", ".tiff")
+
+
+def tile_features(tile: np.ndarray, image: Optional[np.ndarray] = None, y0: int = 0, x0: int = 0) -> Dict[str, np.ndarray]:
+    """
+    Features of the labelled cells of one tile whose top-left corner sits at (y0, x0) in the slide;
+    image is the matching window (H, W) or (H, W, C), or None for geometry only.
+    """
+    h, w = tile.shape
+    flat = np.asarray(tile).ravel()  # reads the tile if it is memory-mapped
+    pixels = np.flatnonzero(flat)  # only cell pixels from here on
+    if not len(pixels):
+        return {}
+    values = flat[pixels]
+    labels = values.astype(np.intp)
+    area = np.bincount(labels)
+    ids = np.flatnonzero(area)  # background has no pixels left
+    # pixels grouped by label, row-major inside each group (radix sort for uint16 masks)
+    order = np.argsort(values, kind="stable")
+    starts = np.searchsorted(labels[order], ids)
+    ends = starts + area[ids]
+    ys, xs = np.divmod(pixels, w)
+    sorted_xs, sorted_ys = xs[order], ys[order]
+
+    features = {
+        "label": ids.astype(np.uint32),
+        "area": area[ids],
+        "centroid_x": x0 + np.bincount(labels, weights=xs)[ids] / area[ids],
+        "centroid_y": y0 + np.bincount(labels, weights=ys)[ids] / area[ids],
+        "bbox_x0": x0 + np.minimum.reduceat(sorted_xs, starts),
+        "bbox_y0": y0 + sorted_ys[starts],
+        "bbox_x1": x0 + np.maximum.reduceat(sorted_xs, starts) + 1,
+        "bbox_y1": y0 + sorted_ys[ends - 1] + 1,
+    }
+    if image is not None:
+        channels = image.reshape(h * w, -1)
+        for c in range(channels.shape[1]):
+            values = channels[pixels, c]
+            features[f"mean_c{c}"] = (np.bincount(labels, weights=values)[ids] / area[ids]).astype(np.float32)
+            features[f"max_c{c}"] = np.maximum.reduceat(values[order], starts)
+    return features
+
+
+def load_intensity_image(image_dir: Union[str, Path], stem: str, shape: tuple) -> Optional[np.ndarray]:
+    """
+    <stem>.png (or .tif/.tiff) from image_dir at the stitched mask's resolution: the TIFF pyramid
+    level of that size when there is one, else resized. None if there is no image.
+    """
+    path = next((p for s in IMAGE_SUFFIXES if (p := Path(image_dir) / f"{stem}{s}").exists()), None)
+    if path is None:
+        logger.warning(f"No image for '{stem}' in {image_dir}: cell table without intensities")
+        return None
+    if path.suffix == ".png":
+        from PIL import Image
+        image = np.asarray(Image.open(path))
+    else:
+        import tifffile
+        with tifffile.TiffFile(str(path)) as tif:
+            levels = tif.series[0].levels
+            level = next((l for l in levels if tuple(l.shape[:2]) == tuple(shape)), levels[-1])
+            image = level.asarray()
+    if image.shape[:2] != tuple(shape):
+        import cv2
+        logger.info(f"Resizing {path.name} {image.shape[:2]} to the mask {tuple(shape)} for cell intensities")
+        image = cv2.resize(image, (shape[1], shape[0]), interpolation=cv2.INTER_AREA)
+    return image
+
+
+class CellFeatureTable:
+    """
+    Collects tile_features of one slide tile by tile and writes them as one Parquet file.
+    """
+
+    def __init__(self, image: Optional[np.ndarray] = None) -> None:
+        self.image = image
+        self.parts: List[Dict[str, np.ndarray]] = []
+
+    def add_tile(self, tile: np.ndarray, row: int, col: int, y0: int, x0: int) -> None:
+        h, w = tile.shape
+        window = None if self.image is None else self.image[y0:y0 + h, x0:x0 + w]
+        if window is not None and window.shape[:2] != (h, w):
+            window = None  # tile beyond the image (should not happen for tiles split from it)
+        features = tile_features(tile, window, y0, x0)
+        if features:
+            n = len(features["label"])
+            self.parts.append({"tile_row": np.full(n, row, dtype=np.int32), "tile_col": np.full(n, col, dtype=np.int32), **features})
+
+    def to_frame(self):
+        import pandas as pd
+        columns = {}
+        if self.parts:
+            names = [name for name in self.parts[0] if all(name in part for part in self.parts)]
+            columns = {name: np.concatenate([part[name] for part in self.parts]) for name in names}
+        frame = pd.DataFrame(columns)
+        frame.insert(0, "cell_id", np.arange(len(frame), dtype=np.int64))
+        return frame
+
+    def write(self, path: Union[str, Path]) -> int:
+        """
+        Write the table (pyarrow Parquet); returns the number of cells.
+        """
+        frame = self.to_frame()
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        frame.to_parquet(path, index=False)
+        return len(frame)
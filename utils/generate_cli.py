@@ -0,0 +1,294 @@
+#!/usr/bin/env python3
+"""
+Developed by Nikhil Nageshwar Inturi
+
+Command-line entry point for the pipeline (installed as `auto-segmenter`, see
+pyproject.toml; also `python -m utils.generate_cli`). One subcommand per stage:
+
+    auto-segmenter pngs | splits | detect | stitch | plots | geojsons | metrics
+    auto-segmenter cells STEM --box X0 Y0 X1 Y1 | --roi ROI.geojson   cells in a region
+    auto-segmenter pipeline [--force STAGE ...]     the main.py stage DAG
+    auto-segmenter import-times [--json PATH]       start-up cost of every subcommand
+
+Directories default to utils.constants. Every subcommand imports its stage
+module only when it runs, so e.g. `auto-segmenter metrics` never loads torch,
+cellpose, matplotlib or skimage. `import-times` checks that by timing each
+subcommand's imports in a fresh interpreter (--budget fails the run when one
+exceeds it).
+"""
+
+# imports
+import argparse, json, logging, statistics, subprocess, sys, time
+from pathlib import Path
+# local imports
+from utils.constants import *
+
+COMMANDS = ("pngs", "splits", "detect", "stitch", "plots", "geojsons", "metrics", "cells", "pipeline")
+
+
+# subcommands: each imports what it needs first and returns early for --imports-only
+def run_pngs(args) -> None:
+    from utils.generate_pngs import TiffToPngConverter
+    if args.imports_only:
+        return
+    converter = TiffToPngConverter(scaling_factor=args.scaling_factor, tif_dir=args.tif_dir, output_dir=args.output_dir)
+    if args.stem:
+        for stem in args.stem:
+            converter.convert_file(args.tif_dir / f"{stem}.tif")
+    else:
+        converter.convert_all()
+
+
+def run_splits(args) -> None:
+    from utils.generate_split_images import ImageSplitter
+    if args.imports_only:
+        return
+    splitter = ImageSplitter(source_dir=args.png_dir, output_dir=args.output_dir,
+                             sub_image_width=args.tile_width, sub_image_height=args.tile_height)
+    if args.stem:
+        for stem in args.stem:
+            splitter.split_file(args.png_dir / f"{stem}.png")
+    else:
+        splitter.split_all()
+
+
+def run_detect(args) -> None:
+    from model.run_cellpose_sam import cellpose_sam_detect_images_eval
+    if args.imports_only:
+        return
+    cellpose_sam_detect_images_eval(model_path=args.model, image_input_dir=args.input_dir, image_output_dir=args.output_dir,
+                                    flow_threshold=args.flow_threshold, cellprob_threshold=args.cellprob_threshold,
+                                    min_size=args.min_size, slide_dir=args.slide_dir)
+
+
+def run_stitch(args) -> None:
+    from utils.generate_combine_masks import NPYMaskStitcher
+    if args.imports_only:
+        return
+    feature_dir = None if args.no_features else args.feature_dir
+    stitcher = NPYMaskStitcher(input_dir=args.input_dir, output_dir=args.output_dir, feature_dir=feature_dir, image_dir=args.image_dir)
+    if args.stem:
+        for stem in args.stem:
+            stitcher.stitch_stem(stem)
+    else:
+        stitcher.stitch_all()
+
+
+def run_plots(args) -> None:
+    from utils.generate_plots import PlotGenerator
+    if args.imports_only:
+        return
+    plotter = PlotGenerator(image_dir=args.image_dir, mask_dir=args.mask_dir, output_dir=args.output_dir, output_mode=args.output_mode)
+    if args.stem:
+        for stem in args.stem:
+            plotter.plot_mask(args.mask_dir / f"{stem}.npy")
+    else:
+        plotter.run()
+
+
+def run_geojsons(args) -> None:
+    from utils.generate_geojson_qp_mask import MaskToGeoJSONConverter
+    if args.imports_only:
+        return
+    converter = MaskToGeoJSONConverter(mask_dir=args.mask_dir, output_dir=args.output_dir, upscale_factor=args.upscale_factor)
+    if args.stem:
+        for stem in args.stem:
+            converter.convert_file(args.mask_dir / f"{stem}.npy")
+    else:
+        converter.convert_all()
+
+
+def run_metrics(args) -> None:
+    from bin.generate_metrics import MetricsCalculator, RasterMetricsCalculator
+    if args.imports_only:
+        return
+    if args.gt_dir is None or args.output_csv is None:
+        raise SystemExit("metrics: --gt-dir and --output-csv are required")
+    calc_cls = RasterMetricsCalculator if args.mode == "raster" else MetricsCalculator
+    calc_cls(gt_dir=args.gt_dir, pred_dir=args.pred_dir, output_csv=args.output_csv,
+             iou_threshold=args.iou_threshold, n_workers=args.workers).run()
+
+
+def run_cells(args) -> None:
+    from utils.generate_spatial_index import CellIndex, index_path
+    if args.imports_only:
+        return
+    if args.stem is None or (args.box is None and args.roi is None):
+        raise SystemExit("cells: a slide stem and --box or --roi are required")
+    import shapely
+    logger = logging.getLogger("cells")
+    geojson_path = args.geojson_dir / f"{args.stem}.geojson"
+    path = index_path(geojson_path)
+    if path.exists():
+        index = CellIndex.load(path)
+    else:  # exported before indexes were written
+        index = CellIndex.from_geojson(geojson_path, args.scaling_factor)
+        index.save(path)
+        logger.info(f"Built {path.name} ({len(index)} cells)")
+
+    start = time.perf_counter()
+    if args.box:
+        ids, polygons = index.query_box(*args.box, space=args.space)
+    else:
+        region = shapely.union_all(shapely.get_parts(shapely.from_geojson(args.roi.read_text())))
+        ids, polygons = index.query_polygon(region, space=args.space, predicate=args.predicate)
+    logger.info(f"{len(ids)} of {len(index)} cells in the region ({(time.perf_counter() - start) * 1e3:.1f} ms)")
+    if args.output:
+        features = [{"type": "Feature", "properties": {"cell_id": int(i), "label": int(index.labels[i])},
+                     "geometry": {"type": "Polygon", "coordinates": [polygon.tolist()]}} for i, polygon in zip(ids, polygons)]
+        args.output.write_text(json.dumps({"type": "FeatureCollection", "features": features}))
+        logger.info(f"Cells written to {args.output}")
+
+
+def run_pipeline(args) -> None:
+    import main  # builds the stage list; stage modules load their heavy dependencies when they run
+    if args.imports_only:
+        return
+    main.main(force=args.force)
+
+
+def import_times(args) -> None:
+    """
+    Wall time of `<cli> <command> --imports-only` in a fresh interpreter (min over --repeat runs),
+    i.e. interpreter start-up plus everything the command imports before it does any work.
+    """
+    logger = logging.getLogger("import-times")
+    cmd = [sys.executable, "-m", "utils.generate_cli"]
+    baseline = min(_timed([sys.executable, "-c", "pass"]) for _ in range(args.repeat))
+    results = {"python_startup_s": baseline, "commands": {}}
+    over_budget = []
+    unknown = set(args.commands) - set(COMMANDS)
+    if unknown:
+        raise SystemExit(f"Unknown commands: {sorted(unknown)}")
+    for command in args.commands or COMMANDS:
+        walls = [_timed(cmd + [command, "--imports-only"]) for _ in range(args.repeat)]
+        results["commands"][command] = {"min_s": min(walls), "median_s": statistics.median(walls)}
+        flag = ""
+        if args.budget is not None and min(walls) > args.budget:
+            over_budget.append(command)
+            flag = f"  over budget ({args.budget:.2f}s)"
+        logger.info(f"{command:10s} {min(walls):6.3f}s (python alone {baseline:.3f}s){flag}")
+        if args.detail:
+            for line in _slowest_imports(cmd + [command, "--imports-only"], args.detail):
+                logger.info(f"    {line}")
+    if args.json:
+        Path(args.json).write_text(json.dumps(results, indent=2))
+        logger.info(f"Import times written to {args.json}")
+    if over_budget:
+        raise SystemExit(f"Commands over the {args.budget:.2f}s start-up budget: {over_budget}")
+
+
+def _timed(cmd: list) -> float:
+    start = time.perf_counter()
+    subprocess.run(cmd, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return time.perf_counter() - start
+
+
+def _slowest_imports(cmd: list, n: int) -> list:
+    # -X importtime lines: "import time: self [us] | cumulative | imported package"
+    err = subprocess.run([cmd[0], "-X", "importtime"] + cmd[1:], capture_output=True, text=True).stderr
+    rows = []
+    for line in err.splitlines():
+        parts = line.split("|")
+        if len(parts) == 3 and parts[1].strip().isdigit() and not parts[2].startswith("  "):
+            rows.append((int(parts[1]), parts[2].strip()))  # top-level imports only
+    return [f"{us / 1e6:6.3f}s  {name}" for us, name in sorted(rows, reverse=True)[:n]]
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="auto-segmenter", description="Cellpose-SAM segmentation pipeline.")
+    parser.add_argument("--log-level", default="INFO")
+    parser.add_argument("--metrics-dir", type=Path, help="record per-stage metrics (JSON + Prometheus) here")
+    parser.add_argument("--profile", nargs="+", default=(), metavar="STAGE", help="profile these stages into PROFILE_DIR")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    def command(name, func, help_text, stems=True):
+        p = sub.add_parser(name, help=help_text)
+        p.set_defaults(func=func)
+        p.add_argument("--imports-only", action="store_true", help=argparse.SUPPRESS)
+        if stems:
+            p.add_argument("--stem", nargs="+", help="only these slides (default: all)")
+        return p
+
+    p = command("pngs", run_pngs, "convert TIFF slides to downscaled PNGs")
+    p.add_argument("--tif-dir", type=Path, default=TIF_IMAGES_DIR)
+    p.add_argument("--output-dir", type=Path, default=PNG_IMAGES_DIR)
+    p.add_argument("--scaling-factor", type=float, default=SCALING_FACTOR)
+
+    p = command("splits", run_splits, "split PNGs into tiles")
+    p.add_argument("--png-dir", type=Path, default=PNG_IMAGES_DIR)
+    p.add_argument("--output-dir", type=Path, default=SPLIT_IMAGES_DIR)
+    p.add_argument("--tile-width", type=int, default=IMG_WIDTH)
+    p.add_argument("--tile-height", type=int, default=IMG_HEIGHT)
+
+    p = command("detect", run_detect, "segment tiles with the Cellpose-SAM model", stems=False)
+    p.add_argument("--model", default=MODEL)
+    p.add_argument("--input-dir", type=Path, default=SPLIT_IMAGES_DIR)
+    p.add_argument("--output-dir", type=Path, default=CELLPOSE_MASKS_DIR)
+    p.add_argument("--slide-dir", type=Path, default=PNG_IMAGES_DIR, help="slides for slide-level normalization")
+    p.add_argument("--flow-threshold", type=float, default=0.9)
+    p.add_argument("--cellprob-threshold", type=float, default=-6)
+    p.add_argument("--min-size", type=int, default=1)
+
+    p = command("stitch", run_stitch, "stitch tile masks into slide masks and per-cell feature tables")
+    p.add_argument("--input-dir", type=Path, default=CELLPOSE_MASKS_DIR)
+    p.add_argument("--output-dir", type=Path, default=STITCHED_MASKS_DIR)
+    p.add_argument("--feature-dir", type=Path, default=GEOJSON_OUTS_DIR, help="where <stem>_cells.parquet goes")
+    p.add_argument("--image-dir", type=Path, default=PNG_IMAGES_DIR, help="images for per-cell intensities")
+    p.add_argument("--no-features", action="store_true", help="skip the per-cell feature table")
+
+    p = command("plots", run_plots, "binary masks and overlays")
+    p.add_argument("--image-dir", type=Path, default=PNG_IMAGES_DIR)
+    p.add_argument("--mask-dir", type=Path, default=STITCHED_MASKS_DIR)
+    p.add_argument("--output-dir", type=Path, default=OUTPUT_DIR)
+    p.add_argument("--output-mode", choices=("png", "pyramid", "both"), default="png")
+
+    p = command("geojsons", run_geojsons, "export stitched masks as QuPath GeoJSON")
+    p.add_argument("--mask-dir", type=Path, default=STITCHED_MASKS_DIR)
+    p.add_argument("--output-dir", type=Path, default=GEOJSON_OUTS_DIR)
+    p.add_argument("--upscale-factor", type=float, default=SCALING_FACTOR)
+
+    p = command("metrics", run_metrics, "segmentation metrics against ground truth", stems=False)
+    p.add_argument("--gt-dir", type=Path, help="ground truth (required)")
+    p.add_argument("--pred-dir", type=Path, default=GEOJSON_OUTS_DIR)
+    p.add_argument("--output-csv", type=Path, help="metrics CSV to write (required)")
+    p.add_argument("--iou-threshold", type=float, default=0.5)
+    p.add_argument("--workers", type=int, default=None,
+                   help="worker processes, one image pair in memory each (default: all CPUs for vector, 1 for raster)")
+    p.add_argument("--mode", choices=("vector", "raster"), default="vector")
+
+    p = command("cells", run_cells, "cells of a slide in a box or ROI polygon (spatial index next to the GeoJSON)", stems=False)
+    p.add_argument("stem", nargs="?", help="slide stem (<geojson-dir>/<stem>.geojson; required)")
+    region = p.add_mutually_exclusive_group()
+    region.add_argument("--box", type=float, nargs=4, metavar=("X0", "Y0", "X1", "Y1"), help="region (or --roi; required)")
+    region.add_argument("--roi", type=Path, help="GeoJSON with the region, e.g. a QuPath annotation export")
+    p.add_argument("--space", choices=("slide", "mask"), default="slide", help="coordinates of the region and the output")
+    p.add_argument("--predicate", choices=("intersects", "within", "centroid"), default="intersects", help="for --roi")
+    p.add_argument("--geojson-dir", type=Path, default=GEOJSON_OUTS_DIR)
+    p.add_argument("--scaling-factor", type=float, default=SCALING_FACTOR, help="of the export, when the index has to be built")
+    p.add_argument("--output", type=Path, help="write the selected cells as GeoJSON")
+
+    p = command("pipeline", run_pipeline, "run the stage DAG of main.py (skips up-to-date stages)", stems=False)
+    p.add_argument("--force", nargs="+", default=(), metavar="STAGE", help="rerun these stages even if up to date")
+
+    p = sub.add_parser("import-times", help="benchmark the start-up (import) time of every subcommand")
+    p.set_defaults(func=import_times, imports_only=False)
+    p.add_argument("commands", nargs="*", metavar="COMMAND", help=f"subcommands to time (default: all of {', '.join(COMMANDS)})")
+    p.add_argument("--repeat", type=int, default=3)
+    p.add_argument("--budget", type=float, default=None, help="fail if a command needs more seconds than this")
+    p.add_argument("--detail", type=int, default=0, metavar="N", help="also list the N slowest top-level imports")
+    p.add_argument("--json", type=Path, help="write the timings to this file")
+    return parser
+
+
+def main(argv=None) -> None:
+    args = build_parser().parse_args(argv)
+    if args.imports_only:
+        args.func(args)
+        return
+    setup_logging(args.log_level.upper(), metrics_dir=args.metrics_dir, profile_stages=args.profile)
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -4,12 +4,20 @@ Developed by Nikhil Nageshwar Inturi
 
 This module provides MaskStitcher for stitching tiled .npy masks
 back into full-size masks, one per original image stem.
+
+With feature_dir set, NPYMaskStitcher also writes <feature_dir>/<stem>_cells.parquet,
+the per-cell table of utils.generate_cell_features (intensities from <stem>.png or
+.tif in image_dir), computed tile by tile while the tiles are placed.
 """
 
 import re
+from glob import escape as glob_escape
 from pathlib import Path
 import numpy as np
 import logging
+# local imports
+from utils.generate_cell_features import CellFeatureTable, load_intensity_image
+from utils.generate_instrumentation import instrumented, stage_add
 
 class NPYMaskStitcher:
     """
@@ -20,9 +28,11 @@ class NPYMaskStitcher:
 
     TILE_PATTERN = re.compile(r'^(?P<stem>.+)_(?P<row>\d+)_(?P<col>\d+)\.npy$')
 
-    def __init__(self, input_dir: Path, output_dir: Path) -> None:
+    def __init__(self, input_dir: Path, output_dir: Path, feature_dir: Path = None, image_dir: Path = None) -> None:
         self.input_dir = Path(input_dir)
         self.output_dir = Path(output_dir)
+        self.feature_dir = Path(feature_dir) if feature_dir is not None else None
+        self.image_dir = Path(image_dir) if image_dir is not None else None
         self.logger = logging.getLogger(self.__class__.__name__)
         self._setup_output_directory()
 
@@ -34,6 +44,7 @@ class NPYMaskStitcher:
             self.logger.error(f"Could not create output directory {self.output_dir}: {e}")
             raise
 
+    @instrumented
     def stitch_all(self) -> None:
         """
         Find all .npy tiles, group by stem, and stitch each group.
@@ -60,6 +71,18 @@ class NPYMaskStitcher:
             except Exception:
                 self.logger.exception(f"Failed to stitch tiles for '{stem}'")
 
+    def stitch_stem(self, stem: str) -> None:
+        """
+        Stitch the tiles of one stem only (e.g. as soon as that slide is detected).
+        """
+        paths = [p for p in self.input_dir.glob(f"{glob_escape(stem)}_*_*.npy")
+                 if (m := self.TILE_PATTERN.match(p.name)) and m.group("stem") == stem]
+        if not paths:
+            raise FileNotFoundError(f"No tiles found for '{stem}' in {self.input_dir}")
+        self._stitch_stem(stem, paths)
+        self.logger.info(f"Stitched mask for '{stem}' → {stem}.npy")
+
+    @instrumented(name="NPYMaskStitcher.stitch")
     def _stitch_stem(self, stem: str, paths: list[Path]) -> None:
         """
         Given all tile paths for a single stem, reconstruct the full mask.
@@ -72,7 +95,7 @@ class NPYMaskStitcher:
         for p in paths:
             m = self.TILE_PATTERN.match(p.name)
             row, col = int(m.group("row")), int(m.group("col"))
-            tile = np.load(p)
+            tile = np.load(p, mmap_mode="r")
             mask_map[(row, col)] = tile
             rows.add(row)
             cols.add(col)
@@ -101,15 +124,33 @@ class NPYMaskStitcher:
         # create canvas
         full_mask = np.zeros((total_h, total_w), dtype=np.uint16)
 
+        # per-cell features, gathered tile by tile as they are placed
+        table = None
+        if self.feature_dir is not None:
+            image = load_intensity_image(self.image_dir, stem, (total_h, total_w)) if self.image_dir is not None else None
+            table = CellFeatureTable(image)
+
         # place tiles
-        for (r, c), tile in mask_map.items():
+        for (r, c), tile in sorted(mask_map.items()):
             y0, x0 = row_offsets[r], col_offsets[c]
             h, w = tile.shape
             full_mask[y0:y0+h, x0:x0+w] = tile
+            if table is not None:
+                table.add_tile(full_mask[y0:y0+h, x0:x0+w], r, c, y0, x0)
 
         # save combined mask
         out_path = self.output_dir / f"{stem}.npy"
         np.save(out_path, full_mask)
+        stage_add("NPYMaskStitcher.stitch", masks=1, tiles=len(paths), bytes=full_mask.nbytes)
+        if table is not None:
+            # the mask is saved; a failed feature table must not fail the stitch
+            try:
+                n_cells = table.write(self.feature_dir / f"{stem}_cells.parquet")
+            except Exception:
+                self.logger.exception(f"Failed to write cell features for '{stem}'")
+            else:
+                stage_add("NPYMaskStitcher.stitch", cells=n_cells)
+                self.logger.info(f"Wrote {n_cells} cell features for '{stem}' → {stem}_cells.parquet")
 
 
 
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""
+Developed by Nikhil Nageshwar Inturi
+
+Content-addressed cache of Cellpose flow targets for training tiles.
+
+train.train_seg turns every label mask into a (4, H, W) flow target
+[labels, cell probability, dY, dX] before the first epoch, which for thousands
+of 1024x1024 tiles is a long CPU-bound start. Here the flows are computed once,
+in worker processes while split_folder writes the tiles, and stored as
+<cache_dir>/<digest>.npy where digest is a hash of the mask content. Only dY/dX
+are stored (float16); labels and cell probability are rebuilt from the mask on
+load. Identical masks (e.g. all empty tiles) share one entry, and a cache entry
+stays valid for any tile with the same mask, whatever its file name.
+"""
+
+# imports
+import hashlib, logging, os
+from pathlib import Path
+from typing import List, Optional, Union
+import numpy as np
+
+FLOW_CACHE_DIR = "_flows"  # sub-directory of the training folder; skipped when train_cp_sam_model lists images
+
+logger = logging.getLogger(__name__)
+
+
+def mask_digest(mask: np.ndarray) -> str:
+    """
+    Hash of a label mask's shape and label values (independent of its integer dtype).
+    """
+    mask = np.ascontiguousarray(mask, dtype=np.uint32)
+    h = hashlib.blake2b(digest_size=16)
+    h.update(repr(mask.shape).encode())
+    h.update(mask.data)
+    return h.hexdigest()
+
+
+def flow_path(cache_dir: Union[str, Path], digest: str) -> Path:
+    return Path(cache_dir) / f"{digest}.npy"
+
+
+def compute_flows(mask: np.ndarray) -> np.ndarray:
+    """
+    (2, H, W) float16 flow field of a label mask, computed on the CPU with Cellpose.
+    """
+    import torch
+    from cellpose import dynamics
+    flows = dynamics.labels_to_flows([np.asarray(mask)], device=torch.device("cpu"))[0]
+    return flows[-2:].astype(np.float16)
+
+
+def cache_flows(mask: np.ndarray, cache_dir: Union[str, Path], digest: Optional[str] = None) -> Path:
+    """
+    Compute and store the flows of mask unless an entry with the same digest exists.
+    Safe to call from several processes: entries are written to a temp file and renamed.
+    """
+    digest = digest or mask_digest(mask)
+    path = flow_path(cache_dir, digest)
+    if path.exists():
+        return path
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_suffix(f".{os.getpid()}.tmp")
+    with open(tmp_path, "wb") as f:
+        np.save(f, compute_flows(mask))
+    tmp_path.replace(path)
+    return path
+
+
+def load_flows(mask: np.ndarray, cache_dir: Union[str, Path], compute_missing: bool = True,
+               digest: Optional[str] = None) -> Optional[np.ndarray]:
+    """
+    (4, H, W) float32 flow target for mask, in the layout train.train_seg accepts as precomputed.
+    Missing entries are computed and stored (or None is returned if compute_missing is False).
+    """
+    digest = digest or mask_digest(mask)
+    path = flow_path(cache_dir, digest)
+    if not path.exists():
+        if not compute_missing:
+            return None
+        cache_flows(mask, cache_dir, digest)
+    flows = np.load(path)
+    labels = np.asarray(mask, dtype=np.float32)
+    return np.concatenate((labels[np.newaxis], (labels > 0.5)[np.newaxis], flows), axis=0).astype(np.float32)
+
+
+def load_flow_targets(masks: List[np.ndarray], cache_dir: Union[str, Path]) -> List[np.ndarray]:
+    """
+    Flow targets for a list of label masks, computing only the ones not in the cache.
+    """
+    targets, hits = [], 0
+    for mask in masks:
+        digest = mask_digest(mask)
+        hits += flow_path(cache_dir, digest).exists()
+        targets.append(load_flows(mask, cache_dir, digest=digest))
+    logger.info(f"flow cache {cache_dir}: {hits}/{len(masks)} hits")
+    return targets
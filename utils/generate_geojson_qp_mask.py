@@ -5,6 +5,8 @@ Developed by Nikhil Nageshwar Inturi
 
 This module converts full-size .npy mask files into GeoJSON polygon files,
 scaling coordinates back to the original image resolution using a scale factor.
+Next to each <stem>.geojson it writes <stem>_index.npz, the spatial cell index
+of utils.generate_spatial_index (build_index=False skips it).
 """
 
 import json
@@ -12,6 +14,9 @@ from pathlib import Path
 import numpy as np
 import cv2
 import logging
+# local imports
+from utils.generate_instrumentation import instrumented, stage_add
+from utils.generate_spatial_index import CellIndex, index_path
 
 class MaskToGeoJSONConverter:
     """
@@ -19,13 +24,16 @@ class MaskToGeoJSONConverter:
     scales coordinates by upscale_factor, and writes out a GeoJSON file per mask.
     """
 
-    def __init__(self, mask_dir: Path, output_dir: Path, upscale_factor: float = 1.0):
+    def __init__(self, mask_dir: Path, output_dir: Path, upscale_factor: float = 1.0, build_index: bool = True):
         self.mask_dir = Path(mask_dir)
         self.output_dir = Path(output_dir)
+        self.upscale_factor = upscale_factor
         self.upscale = 1/(upscale_factor)
+        self.build_index = build_index
         self.logger = logging.getLogger(self.__class__.__name__)
         self.output_dir.mkdir(parents=True, exist_ok=True)
 
+    @instrumented
     def convert_all(self) -> None:
         mask_files = list(self.mask_dir.glob("*.npy"))
         if not mask_files:
@@ -34,16 +42,18 @@ class MaskToGeoJSONConverter:
 
         for mask_fp in mask_files:
             try:
-                self._convert_file(mask_fp)
+                self.convert_file(mask_fp)
                 self.logger.info(f"Converted {mask_fp.name} to GeoJSON")
             except Exception:
                 self.logger.exception(f"Failed to convert {mask_fp.name}")
 
-    def _convert_file(self, mask_fp: Path) -> None:
+    @instrumented
+    def convert_file(self, mask_fp: Path) -> None:
         mask = np.load(mask_fp)
         labels = np.unique(mask)
         labels = labels[labels != 0]
         features = []
+        index_coords, index_lengths = [], []  # polygon vertices for the spatial index
 
         for label in labels:
             binary = (mask == label).astype(np.uint8)
@@ -57,6 +67,8 @@ class MaskToGeoJSONConverter:
                 scaled = [[int(x * self.upscale), int(y * self.upscale)] for [x, y] in coords]
                 if scaled[0] != scaled[-1]:
                     scaled.append(scaled[0])
+                index_coords.extend(scaled)
+                index_lengths.append(len(scaled))
 
                 feature = {
                     "type": "Feature",
@@ -68,7 +80,11 @@ class MaskToGeoJSONConverter:
                 }
                 features.append(feature)
 
+        stage_add("MaskToGeoJSONConverter.convert_file", masks=1, cells=len(labels), features=len(features))
         geojson = {"type": "FeatureCollection", "features": features}
         out_fp = self.output_dir / f"{mask_fp.stem}.geojson"
         with open(out_fp, "w") as f:
-            json.dump(geojson, f)
\ No newline at end of file
+            json.dump(geojson, f)
+        if self.build_index:
+            feature_labels = [feature["properties"]["label"] for feature in features]
+            CellIndex.build(index_coords, index_lengths, feature_labels, self.upscale_factor).save(index_path(out_fp))
\ No newline at end of file
@@ -3,14 +3,17 @@
 Developed by Nikhil Nageshwar Inturi
 
 Overlay original PNGs with their corresponding stitched masks,
-then generate side-by-side comparison mosaics.
+then generate side-by-side comparison mosaics. With output_mode "pyramid"
+(or "both") the overlay is written as a Deep Zoom tile pyramid instead.
 """
 
 # imports
 from pathlib import Path
 from typing import Union
 from PIL import Image, ImageOps, ImageEnhance
-import os
+import os, numpy as np
+# local imports
+from utils.generate_boundaries import iter_boundary_chunks
 
 
 class OverlayGenerator:
@@ -19,12 +22,16 @@ class OverlayGenerator:
     create an overlay with transparency, and a side-by-side composite.
     """
     def __init__(self, original_dir: Union[str, Path], mask_dir: Union[str, Path], output_dir: Union[str, Path], 
-    mask_color: tuple = (255, 0, 0), alpha: float = 0.8) -> None:
+    mask_color: tuple = (255, 0, 0), alpha: float = 0.8, output_mode: str = "png", boundary_color: tuple = None) -> None:
+        if output_mode not in ("png", "pyramid", "both"):
+            raise ValueError(f"Unknown output_mode '{output_mode}', expected 'png', 'pyramid' or 'both'")
         self.original_dir = Path(original_dir)
         self.mask_dir = Path(mask_dir)
         self.output_dir = Path(output_dir)
         self.mask_color = mask_color
         self.alpha = alpha
+        self.output_mode = output_mode
+        self.boundary_color = boundary_color
         self.output_dir.mkdir(parents=True, exist_ok=True)
 
     def run(self) -> None:
@@ -35,17 +42,48 @@ class OverlayGenerator:
             if not mask_path.exists():
                 print(f"Warning: mask not found for {stem}")
                 continue
-            self._make_overlay(orig_path, mask_path)
+            if self.output_mode != "png":
+                self._make_pyramid(orig_path, mask_path)
+            if self.output_mode != "pyramid":
+                self._make_overlay(orig_path, mask_path)
             self._make_comparison(orig_path, mask_path)
 
+    @staticmethod
+    def _label_array(mask: Image.Image, size: tuple) -> np.ndarray:
+        """
+        (H, W) labels of a mask image at size (width, height): colour masks are converted to "L",
+        16/32-bit label masks kept as they are, and masks of another size resized (nearest).
+        """
+        if mask.mode != "L" and not mask.mode.startswith("I"):
+            mask = mask.convert("L")
+        if mask.size != size:
+            mask = mask.resize(size, resample=Image.NEAREST)
+        return np.array(mask)
+
+    def _make_pyramid(self, orig_path: Path, mask_path: Path) -> None:
+        from utils.generate_tile_pyramid import TilePyramidGenerator
+        orig = Image.open(orig_path).convert("RGB")
+        image = np.array(orig)
+        mask = self._label_array(Image.open(mask_path), orig.size)
+        TilePyramidGenerator(self.original_dir, self.mask_dir, self.output_dir, overlay_color=self.mask_color,
+                             boundary_color=self.boundary_color if self.boundary_color is not None else self.mask_color,
+                             alpha=self.alpha).build(orig_path.stem, image, mask)
+
     def _make_overlay(self, orig_path: Path, mask_path: Path) -> None:
         orig = Image.open(orig_path).convert("RGBA")
-        mask = Image.open(mask_path).convert("L")
+        mask_image = Image.open(mask_path)
+        mask = mask_image.convert("L")
         # if mask.size != orig.size:
         #     mask = mask.resize(orig.size, resample=Image.NEAREST)
         color_mask = Image.new("RGBA", orig.size, self.mask_color + (0,))
         color_mask.putalpha(ImageEnhance.Brightness(mask).enhance(self.alpha))
         overlay = Image.alpha_composite(orig, color_mask)
+        if self.boundary_color is not None:
+            overlay = np.array(overlay)
+            labels = self._label_array(mask_image, orig.size)  # same file, no second read
+            for y0, y1, _, boundary in iter_boundary_chunks(labels):
+                overlay[y0:y1][boundary] = tuple(self.boundary_color) + (255,)
+            overlay = Image.fromarray(overlay)
         out_path = self.output_dir / f"{orig_path.stem}_overlay.png"
         overlay.save(out_path)
 
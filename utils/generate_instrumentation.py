@@ -0,0 +1,287 @@
+#!/usr/bin/env python3
+"""
+Developed by Nikhil Nageshwar Inturi
+
+Per-stage performance instrumentation for the pipeline.
+
+Stage methods are wrapped with @instrumented; the segmentation loop adds
+counters and per-tile latencies with stage_add / stage_observe. For every
+stage the run records calls, wall and CPU time, peak RSS while the stage was
+active, item counters (tiles, cells, bytes, ...) and their rates, and latency
+percentiles. At exit (or on write_metrics) the run is written to
+
+    <metrics_dir>/run_<timestamp>.json   full per-run report
+    <metrics_dir>/pipeline.prom          Prometheus text format (textfile collector)
+
+An @instrumented call made while another @instrumented stage is being
+recorded on the same thread (split_all → split_file) is not recorded again:
+the outer stage's time already includes it, and its counters are added to
+the outer stage. The pipeline.* / slides.* entries of PipelineRunner and
+SlideScheduler are inclusive totals of the method stages they run.
+
+Recording is enabled by setup_logging(..., metrics_dir=...); when it is off
+(and no stage is profiled, see utils.generate_profiling), the wrappers cost
+two attribute checks per call.
+"""
+
+# imports
+import atexit, functools, itertools, json, logging, os, sys, threading, time
+from collections import defaultdict
+from pathlib import Path
+from typing import Dict, Optional, Union
+import numpy as np
+# local imports
+from utils.generate_profiling import PROFILER
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+logger = logging.getLogger(__name__)
+
+
+def current_rss() -> int:
+    """
+    Resident set size of this process in bytes (0 if it cannot be measured).
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        pass
+    try:
+        import psutil  # optional: current RSS on macOS and Windows
+        return psutil.Process().memory_info().rss
+    except ImportError:
+        pass
+    if resource is not None:
+        # no procfs (macOS): fall back to the lifetime peak
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
+    return 0
+
+
+class StageStats:
+    def __init__(self) -> None:
+        self.calls = 0
+        self.wall_s = 0.0
+        self.cpu_s = 0.0
+        self.peak_rss = 0
+        self.counters: Dict[str, float] = defaultdict(float)
+        self.samples: Dict[str, list] = defaultdict(list)
+
+    def report(self) -> dict:
+        rates = {f"{k}_per_s": v / self.wall_s for k, v in self.counters.items() if self.wall_s > 0}
+        latencies = {name: {"count": len(vals), "sum": float(np.sum(vals)), "mean": float(np.mean(vals)),
+                            **{f"p{q}": float(np.percentile(vals, q)) for q in (50, 90, 99)}}
+                     for name, vals in self.samples.items() if vals}
+        return {"calls": self.calls, "wall_s": self.wall_s, "cpu_s": self.cpu_s,
+                "peak_rss_mb": self.peak_rss / 2 ** 20, "counters": dict(self.counters),
+                "rates": rates, "latencies": latencies}
+
+
+class MetricsRecorder:
+    """
+    Process-wide collector of StageStats, safe to use from concurrent stages.
+    Peak RSS is sampled by a background thread while any stage is active; with
+    stages running concurrently it is the process peak during each stage.
+    """
+
+    def __init__(self) -> None:
+        self.enabled = False
+        self.metrics_dir: Optional[Path] = None
+        self.stages: Dict[str, StageStats] = defaultdict(StageStats)
+        self.started = time.time()
+        self._lock = threading.Lock()
+        self._active: Dict[int, str] = {}
+        self._sampler: Optional[threading.Thread] = None
+        self._sample_interval = 0.05
+        self._tokens = itertools.count()
+
+    def enable(self, metrics_dir: Union[str, Path], sample_interval: float = 0.05) -> None:
+        if not self.enabled:
+            atexit.register(self.write)
+        self.metrics_dir = Path(metrics_dir)
+        self._sample_interval = sample_interval
+        self.enabled = True
+
+    # stage bookkeeping
+    def _sample_rss(self) -> None:
+        while True:
+            with self._lock:
+                if not self._active:
+                    self._sampler = None
+                    return
+                rss = current_rss()
+                for name in set(self._active.values()):
+                    stats = self.stages[name]
+                    stats.peak_rss = max(stats.peak_rss, rss)
+            time.sleep(self._sample_interval)
+
+    def start(self, name: str) -> int:
+        token = next(self._tokens)
+        with self._lock:
+            self._active[token] = name
+            self.stages[name].peak_rss = max(self.stages[name].peak_rss, current_rss())
+            if self._sampler is None:
+                self._sampler = threading.Thread(target=self._sample_rss, daemon=True)
+                self._sampler.start()
+        return token
+
+    def stop(self, token: int, wall_s: float, cpu_s: float) -> None:
+        with self._lock:
+            name = self._active.pop(token)
+            stats = self.stages[name]
+            stats.calls += 1
+            stats.wall_s += wall_s
+            stats.cpu_s += cpu_s
+            stats.peak_rss = max(stats.peak_rss, current_rss())
+        logger.debug(f"[{name}] {wall_s:.3f}s wall, {cpu_s:.3f}s cpu")
+
+    def add(self, name: str, **counters: float) -> None:
+        with self._lock:
+            for key, value in counters.items():
+                self.stages[name].counters[key] += value
+
+    def observe(self, name: str, metric: str, value: float) -> None:
+        with self._lock:
+            self.stages[name].samples[metric].append(value)
+
+    # output
+    def report(self) -> dict:
+        with self._lock:
+            return {"started": self.started, "finished": time.time(), "pid": os.getpid(),
+                    "argv": sys.argv, "stages": {name: s.report() for name, s in self.stages.items()}}
+
+    def prometheus(self, report: dict) -> str:
+        lines = []
+
+        def metric(name, kind, help_text, samples):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            lines.extend(f"{name}{{{labels}}} {value}" for labels, value in samples)
+
+        stages = report["stages"].items()
+        metric("pipeline_stage_calls_total", "counter", "Stage invocations.",
+               [(f'stage="{n}"', s["calls"]) for n, s in stages])
+        metric("pipeline_stage_wall_seconds_total", "counter", "Wall-clock time spent in the stage.",
+               [(f'stage="{n}"', s["wall_s"]) for n, s in stages])
+        metric("pipeline_stage_cpu_seconds_total", "counter", "Process CPU time spent in the stage.",
+               [(f'stage="{n}"', s["cpu_s"]) for n, s in stages])
+        metric("pipeline_stage_peak_rss_bytes", "gauge", "Peak resident memory while the stage ran.",
+               [(f'stage="{n}"', int(s["peak_rss_mb"] * 2 ** 20)) for n, s in stages])
+        metric("pipeline_stage_items_total", "counter", "Items processed by the stage.",
+               [(f'stage="{n}",unit="{k}"', v) for n, s in stages for k, v in s["counters"].items()])
+        latencies = [(f'stage="{n}",metric="{m}"', lat) for n, s in stages for m, lat in s["latencies"].items()]
+        metric("pipeline_stage_latency_seconds", "summary", "Per-item latency quantiles.",
+               [(f'{labels},quantile="{q / 100}"', lat[f"p{q}"]) for labels, lat in latencies for q in (50, 90, 99)])
+        for labels, lat in latencies:  # the summary's _sum and _count series
+            lines.append(f"pipeline_stage_latency_seconds_sum{{{labels}}} {lat['sum']}")
+            lines.append(f"pipeline_stage_latency_seconds_count{{{labels}}} {lat['count']}")
+        return "\n".join(lines) + "\n"
+
+    def write(self) -> Optional[Path]:
+        if not self.enabled or not self.stages:
+            return None
+        report = self.report()
+        self.metrics_dir.mkdir(parents=True, exist_ok=True)
+        stamp = time.strftime("%Y%m%d_%H%M%S", time.localtime(self.started))
+        json_path = self.metrics_dir / f"run_{stamp}_{os.getpid()}.json"
+        json_path.write_text(json.dumps(report, indent=2))
+        prom_path = self.metrics_dir / "pipeline.prom"
+        tmp = prom_path.with_suffix(f".{os.getpid()}.tmp")
+        tmp.write_text(self.prometheus(report))
+        os.replace(tmp, prom_path)  # collectors must never read a half-written file
+        for name, s in report["stages"].items():
+            rates = ", ".join(f"{k} {v:.1f}" for k, v in s["rates"].items())
+            logger.info(f"[{name}] {s['calls']} calls, {s['wall_s']:.1f}s wall, {s['cpu_s']:.1f}s cpu, "
+                        f"peak {s['peak_rss_mb']:.0f} MB{', ' + rates if rates else ''}")
+        logger.info(f"metrics written to {json_path}")
+        return json_path
+
+
+RECORDER = MetricsRecorder()
+_nesting = threading.local()  # per thread: the @instrumented stage being recorded, and the nested stages folded into it
+
+
+def _recorded_name(name: str) -> str:
+    aliases = getattr(_nesting, "aliases", None)
+    return aliases.get(name, name) if aliases else name
+
+
+def enable_metrics(metrics_dir: Union[str, Path]) -> None:
+    RECORDER.enable(metrics_dir)
+
+
+def write_metrics() -> Optional[Path]:
+    return RECORDER.write()
+
+
+class stage_timer:
+    """
+    Context manager timing a block as stage name, and profiling it if selected
+    (no-op when recording and profiling are off).
+    """
+
+    def __init__(self, name: str, record: bool = True) -> None:
+        self.name = name
+        self.record = record
+        self.token = None
+        self.profile = None
+
+    def __enter__(self) -> "stage_timer":
+        if PROFILER.enabled:
+            self.profile = PROFILER.start(self.name)
+        if RECORDER.enabled and self.record:
+            self.token = RECORDER.start(self.name)
+            self.wall0, self.cpu0 = time.perf_counter(), time.process_time()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        if self.token is not None:
+            RECORDER.stop(self.token, time.perf_counter() - self.wall0, time.process_time() - self.cpu0)
+        if self.profile is not None:
+            PROFILER.stop(self.profile)
+
+
+def stage_add(name: str, **counters: float) -> None:
+    if RECORDER.enabled:
+        RECORDER.add(_recorded_name(name), **counters)
+
+
+def stage_observe(name: str, metric: str, value: float) -> None:
+    if RECORDER.enabled:
+        RECORDER.observe(_recorded_name(name), metric, value)
+
+
+def instrumented(method=None, *, name: Optional[str] = None):
+    """
+    Decorator recording a method as stage "<Class>.<method>" (or name).
+    Calls nested in another instrumented stage on the same thread are folded into it.
+    """
+    def wrap(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not RECORDER.enabled and not PROFILER.enabled:
+                return func(*args, **kwargs)
+            stage = name or f"{type(args[0]).__name__}.{func.__name__}"
+            outer = getattr(_nesting, "stage", None)
+            if outer is None:
+                _nesting.stage, _nesting.aliases = stage, {}
+                try:
+                    with stage_timer(stage):
+                        return func(*args, **kwargs)
+                finally:
+                    _nesting.stage = _nesting.aliases = None
+            # the outer stage's times include this call: still profiled if selected, counted under outer
+            folded = stage not in _nesting.aliases
+            if folded:
+                _nesting.aliases[stage] = outer
+            try:
+                with stage_timer(stage, record=False):
+                    return func(*args, **kwargs)
+            finally:
+                if folded:
+                    del _nesting.aliases[stage]
+        return wrapper
+    return wrap(method) if method is not None else wrap
@@ -0,0 +1,246 @@
+#!/usr/bin/env python3
+"""
+Developed by Nikhil Nageshwar Inturi
+
+This module runs segmentation jobs for the Streamlit app in the background,
+isolated per session and per job:
+
+    <jobs_root>/<session_id>/<job_id>/{1_tif_images, 2_png_images, ..., 9_geojson_outs}
+
+JobManager owns a bounded thread pool, so several users can submit slides at
+once without blocking the UI thread or each other, and one warm model shared by
+all jobs (loaded on first use). The GPU-bound detection step takes the model
+lock per chunk of tiles, so CPU stages of other jobs keep running and
+concurrent jobs interleave on the GPU instead of queueing behind a whole slide.
+Each Job exposes live per-stage status and tile progress for the UI.
+
+With a ResultCache (utils.generate_result_cache), a job first restores every
+stage already computed for the same slide content, model and parameters
+(status "cached") and runs only the rest, storing each new stage's artifacts.
+"""
+
+# imports
+import logging, shutil, threading, time, uuid
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Union
+# local imports
+from utils.generate_result_cache import ResultCache, file_digest, stage_keys
+
+JOB_STAGES = ("pngs", "splits", "detect", "stitch", "plots", "geojsons")
+
+
+class Workspace:
+    """
+    Stage directories of one job, named like the CONFIG_DIR layout of utils.constants.
+    """
+
+    def __init__(self, root: Union[str, Path]) -> None:
+        self.root = Path(root)
+        self.tif_dir = self.root / "1_tif_images"
+        self.png_dir = self.root / "2_png_images"
+        self.split_dir = self.root / "3_split_images"
+        self.mask_dir = self.root / "4_cellpose_masks"
+        self.stitched_dir = self.root / "5_stitched_masks"
+        self.output_dir = self.root / "6_output_masks"
+        self.geojson_dir = self.root / "9_geojson_outs"
+
+    def create(self) -> "Workspace":
+        for d in (self.tif_dir, self.png_dir, self.split_dir, self.mask_dir, self.stitched_dir, self.output_dir, self.geojson_dir):
+            d.mkdir(parents=True, exist_ok=True)
+        return self
+
+
+class Job:
+    """
+    One slide moving through JOB_STAGES. status: queued | running | done | failed.
+    content_hash identifies the slide for the result cache (computed from the file when not given).
+    """
+
+    def __init__(self, session_id: str, tif_path: Path, workspace: Workspace, params: dict, content_hash: str = None) -> None:
+        self.id = uuid.uuid4().hex[:12]
+        self.session_id = session_id
+        self.tif_path = Path(tif_path)
+        self.stem = self.tif_path.stem
+        self.workspace = workspace
+        self.params = dict(params)
+        self.content_hash = content_hash
+        self.status = "queued"
+        self.stages: Dict[str, dict] = {name: {"status": "pending", "seconds": None} for name in JOB_STAGES}
+        self.tiles_done = 0
+        self.tiles_total = 0
+        self.error: Optional[str] = None
+        self.submitted = time.time()
+        self.finished: Optional[float] = None
+        self.future: Optional[Future] = None
+
+    @property
+    def current_stage(self) -> Optional[str]:
+        return next((name for name, s in self.stages.items() if s["status"] == "running"), None)
+
+    @property
+    def progress(self) -> float:
+        """
+        Fraction of the job done, counting detection by tiles.
+        """
+        done = sum(s["status"] in ("done", "skipped", "cached") for s in self.stages.values())
+        if self.stages["detect"]["status"] == "running" and self.tiles_total:
+            done += self.tiles_done / self.tiles_total
+        return done / len(self.stages)
+
+    def output(self, name: str) -> Path:
+        ws = self.workspace
+        return {"geojson": ws.geojson_dir / f"{self.stem}.geojson",
+                "cells": ws.geojson_dir / f"{self.stem}_cells.parquet",
+                "index": ws.geojson_dir / f"{self.stem}_index.npz",
+                "overlay_dzi": ws.output_dir / f"{self.stem}.dzi",
+                "binary": ws.output_dir / f"{self.stem}_binary.png",
+                "mask": ws.stitched_dir / f"{self.stem}.npy"}[name]
+
+
+class JobManager:
+    """
+    Bounded background executor for per-session segmentation jobs sharing one model.
+
+    model_loader() is called once, on the first detection; detect(model, tile_files, out_dir)
+    defaults to cellpose_sam_detect_files with the job's parameters. Jobs reuse and fill cache
+    when one is given; params["model"] then names the weights (their size/mtime enter the key).
+    """
+
+    def __init__(self, jobs_root: Union[str, Path], model_loader: Callable[[], object], max_workers: int = 2,
+                 detect_chunk: int = 16, detect: Callable = None, max_age_hours: float = 24.0,
+                 cache: ResultCache = None) -> None:
+        self.jobs_root = Path(jobs_root)
+        self.cache = cache
+        self.model_loader = model_loader
+        self.detect_chunk = detect_chunk
+        self.detect = detect
+        self.max_age_hours = max_age_hours
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="job")
+        self.jobs: Dict[str, Job] = {}
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self._lock = threading.Lock()
+        self._model = None
+        self._model_lock = threading.Lock()  # guards loading and, on one GPU, inference
+
+    # model
+    def model(self):
+        with self._model_lock:
+            if self._model is None:
+                start = time.perf_counter()
+                self._model = self.model_loader()
+                self.logger.info(f"Model loaded in {time.perf_counter() - start:.1f}s")
+            return self._model
+
+    # jobs
+    def new_workspace(self, session_id: str) -> Workspace:
+        return Workspace(self.jobs_root / session_id / uuid.uuid4().hex[:12]).create()
+
+    def submit(self, session_id: str, tif_path: Union[str, Path], params: dict, workspace: Workspace = None,
+               content_hash: str = None) -> Job:
+        """
+        Queue a slide for segmentation. tif_path may lie inside workspace.tif_dir (an upload) or anywhere else.
+        """
+        self.prune()
+        workspace = workspace or self.new_workspace(session_id)
+        job = Job(session_id, tif_path, workspace, params, content_hash=content_hash)
+        with self._lock:
+            self.jobs[job.id] = job
+        job.future = self.executor.submit(self._run, job)
+        self.logger.info(f"Job {job.id} ({job.stem}) queued for session {session_id}")
+        return job
+
+    def session_jobs(self, session_id: str) -> List[Job]:
+        with self._lock:
+            return sorted((j for j in self.jobs.values() if j.session_id == session_id), key=lambda j: j.submitted, reverse=True)
+
+    def prune(self) -> None:
+        """
+        Forget finished jobs older than max_age_hours and delete their workspaces.
+        """
+        cutoff = time.time() - self.max_age_hours * 3600
+        with self._lock:
+            old = [j for j in self.jobs.values() if j.finished is not None and j.finished < cutoff]
+            for job in old:
+                del self.jobs[job.id]
+        for job in old:
+            shutil.rmtree(job.workspace.root, ignore_errors=True)
+
+    # stages
+    def _stage_functions(self, job: Job) -> Dict[str, Callable[[], None]]:
+        from utils.generate_pngs import TiffToPngConverter
+        from utils.generate_split_images import ImageSplitter
+        from utils.generate_combine_masks import NPYMaskStitcher
+        from utils.generate_plots import PlotGenerator
+        from utils.generate_geojson_qp_mask import MaskToGeoJSONConverter
+        ws, p, stem = job.workspace, job.params, job.stem
+        png = ws.png_dir / f"{stem}.png"
+        stitched = ws.stitched_dir / f"{stem}.npy"
+        return {
+            "pngs": lambda: TiffToPngConverter(p["scaling_factor"], job.tif_path.parent, ws.png_dir).convert_file(job.tif_path, level=p.get("tif_level", 0)),
+            "splits": lambda: ImageSplitter(ws.png_dir, ws.split_dir, p["tile_width"], p["tile_height"]).split_file(png),
+            "detect": lambda: self._detect(job),
+            "stitch": lambda: NPYMaskStitcher(ws.mask_dir, ws.stitched_dir, feature_dir=ws.geojson_dir,
+                                                       image_dir=ws.png_dir).stitch_stem(stem),
+            "plots": lambda: PlotGenerator(ws.png_dir, ws.stitched_dir, ws.output_dir, overlay_color=p["overlay_color"],
+                                           boundary_color=p["boundary_color"], alpha=p["alpha"], output_mode="pyramid").plot_mask(stitched),
+            "geojsons": lambda: MaskToGeoJSONConverter(ws.stitched_dir, ws.geojson_dir, upscale_factor=p["scaling_factor"]).convert_file(stitched),
+        }
+
+    def _detect(self, job: Job) -> None:
+        tiles = sorted(job.workspace.split_dir.glob(f"{job.stem}_*_*.png"))
+        job.tiles_total, job.tiles_done = len(tiles), 0
+        detect = self.detect
+        if detect is None:
+            from model.run_cellpose_sam import cellpose_sam_detect_files
+            from utils.generate_slide_norm import SlideNormalizer
+            p, png_dir = job.params, job.workspace.png_dir
+            # slide-level bounds as in main.py, computed before the model lock is taken
+            normalizers = {job.stem: SlideNormalizer.for_slide(png_dir / f"{job.stem}.png")}
+            detect = lambda model, files, out_dir: cellpose_sam_detect_files(
+                model, files, out_dir, flow_threshold=p["flow_threshold"], cellprob_threshold=p["cellprob_threshold"], min_size=p["min_size"],
+                slide_dir=png_dir, normalizers=normalizers)
+        model = self.model()
+        for i in range(0, len(tiles), self.detect_chunk):
+            chunk = tiles[i:i + self.detect_chunk]
+            with self._model_lock:
+                detect(model, chunk, job.workspace.mask_dir)
+            job.tiles_done += len(chunk)
+
+    def _plan(self, job: Job) -> tuple:
+        """
+        Stage cache keys of the job and the stages left to run after restoring cached ones.
+        """
+        if self.cache is None:
+            return {}, list(JOB_STAGES)
+        if job.content_hash is None:
+            job.content_hash = file_digest(job.tif_path)
+        keys = stage_keys(job.content_hash, job.params, JOB_STAGES)
+        to_run = self.cache.plan(keys, job.workspace, job.stem, JOB_STAGES)
+        for name in JOB_STAGES:
+            if name not in to_run:
+                job.stages[name]["status"] = "cached"
+        if len(to_run) < len(JOB_STAGES):
+            self.logger.info(f"Job {job.id} ({job.stem}): {len(JOB_STAGES) - len(to_run)} stages from the result cache")
+        return keys, to_run
+
+    def _run(self, job: Job) -> None:
+        job.status = "running"
+        try:
+            keys, to_run = self._plan(job)
+            stages = self._stage_functions(job)
+            for name in to_run:
+                job.stages[name]["status"] = "running"
+                start = time.perf_counter()
+                stages[name]()
+                job.stages[name].update(status="done", seconds=time.perf_counter() - start)
+                if self.cache is not None:
+                    self.cache.put(keys[name], name, job.workspace, job.stem)
+            job.status = "done"
+        except Exception as e:
+            self.logger.exception(f"Job {job.id} ({job.stem}) failed")
+            if job.current_stage:
+                job.stages[job.current_stage]["status"] = "failed"
+            job.status, job.error = "failed", f"{type(e).__name__}: {e}"
+        finally:
+            job.finished = time.time()
@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+"""
+Developed by Nikhil Nageshwar Inturi
+
+This module provides MaskPreviewer, which builds the black-and-white and
+random-colour previews of a label mask at one or more downsampling factors
+without ever allocating a full-resolution RGB (or boolean) array.
+
+Labels are sampled on the strided preview grid (every d-th row and column) as
+the mask is produced: either from a whole mask (also memory-mapped) in row
+bands, or tile by tile while a GeoJSON is rasterized into training tiles. Only
+the small per-scale label grids are kept; colours are looked up on those.
+Pixels equal the previous full-size-then-strided previews exactly.
+"""
+
+# imports
+import logging
+from pathlib import Path
+from typing import Dict, Iterable, Union
+import numpy as np
+from PIL import Image
+
+PREVIEW_SEED = 42
+
+
+def preview_lut(n_labels: int) -> np.ndarray:
+    """
+    Random colour per label (background black), same colours as make_colored_preview.
+    """
+    rng = np.random.default_rng(PREVIEW_SEED)
+    return np.vstack([np.zeros((1, 3), np.uint8), rng.integers(0, 256, size=(n_labels, 3), dtype=np.uint8)])
+
+
+class MaskPreviewer:
+    """
+    Accumulate strided label samples of an (height, width) mask and save its previews.
+    """
+
+    def __init__(self, height: int, width: int, downsamples: Iterable[int] = (8,)) -> None:
+        self.height, self.width = height, width
+        self.downsamples = sorted(set(int(d) for d in downsamples))
+        self.grids: Dict[int, np.ndarray] = {
+            d: np.zeros(((height + d - 1) // d, (width + d - 1) // d), dtype=np.uint32) for d in self.downsamples
+        }
+        self.n_labels = 0
+        self.logger = logging.getLogger(self.__class__.__name__)
+
+    def add(self, y0: int, x0: int, labels: np.ndarray) -> None:
+        """
+        Sample a block of labels whose top-left pixel is (y0, x0) in the full mask.
+        Blocks may be padded past the mask edge; the padding is ignored.
+        """
+        h = min(labels.shape[0], self.height - y0)
+        w = min(labels.shape[1], self.width - x0)
+        for d, grid in self.grids.items():
+            # first row/column of the block that lies on the preview grid
+            oy, ox = -y0 % d, -x0 % d
+            if oy >= h or ox >= w:
+                continue
+            sample = labels[oy:h:d, ox:w:d]
+            gy, gx = (y0 + oy) // d, (x0 + ox) // d
+            grid[gy:gy + sample.shape[0], gx:gx + sample.shape[1]] = sample
+        # the colour table is sized by the largest label anywhere in the mask
+        if labels.size:
+            self.n_labels = max(self.n_labels, int(labels[:h, :w].max()))
+
+    def add_mask(self, mask: np.ndarray, chunk_rows: int = 1024) -> "MaskPreviewer":
+        """
+        Sample a whole mask in row bands (so a memory-mapped mask is read band by band).
+        """
+        for y0 in range(0, self.height, chunk_rows):
+            self.add(y0, 0, np.asarray(mask[y0:y0 + chunk_rows]))
+        return self
+
+    def save(self, out_dir: Union[str, Path], stem: str) -> None:
+        """
+        Write <stem>_mask_bw.png / <stem>_mask_color.png for the first (finest) factor and
+        <stem>_mask_bw_x<d>.png / <stem>_mask_color_x<d>.png for the others.
+        """
+        out_dir = Path(out_dir)
+        out_dir.mkdir(parents=True, exist_ok=True)
+        lut = preview_lut(self.n_labels)
+        for i, (d, grid) in enumerate(self.grids.items()):
+            suffix = "" if i == 0 else f"_x{d}"
+            bw_path = out_dir / f"{stem}_mask_bw{suffix}.png"
+            color_path = out_dir / f"{stem}_mask_color{suffix}.png"
+            Image.fromarray((grid > 0).astype(np.uint8) * 255, mode="L").save(bw_path)
+            Image.fromarray(lut[grid], mode="RGB").save(color_path)
+            self.logger.info(f"saved 1/{d} previews → {bw_path.name}, {color_path.name}")
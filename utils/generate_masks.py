@@ -13,6 +13,7 @@ from pathlib import Path
 import logging, numpy as np, tifffile
 # local imports
 from utils.constants import *
+from utils.generate_instrumentation import instrumented
 
 
 class MaskStitcher:
@@ -88,6 +89,7 @@ class MaskStitcher:
                 next_lbl += 1
         return mosaic
 
+    @instrumented
     def stitch_all(self) -> None:
         seg_groups = self._groups(self.seg_dir, "*.npy")
         for base, files in seg_groups.items():
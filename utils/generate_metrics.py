@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+"""
+Developed by Nikhil Nageshwar Inturi
+
+Helpers for segmentation metrics: a fast GeoJSON polygon loader, label-mask
+readers (memory-mapped where the format allows it), the chunked GT/prediction
+overlap contingency and sparse greedy matching.
+"""
+
+# imports
+import gc, itertools
+from functools import lru_cache
+from pathlib import Path
+from typing import Union
+import numpy as np, shapely, tifffile
+from PIL import Image
+from scipy import sparse
+try:
+    from orjson import loads as json_loads
+except ImportError:  # orjson is optional, the stdlib parser also accepts bytes
+    from json import loads as json_loads
+Image.MAX_IMAGE_PIXELS = None
+
+
+def load_geojson_polygons(path: Union[str, Path]) -> np.ndarray:
+    """
+    Load the geometries of a GeoJSON file as an array of Shapely geometries.
+
+    Plain Polygon FeatureCollections (what MaskToGeoJSONConverter and QuPath write) are
+    parsed directly and built in bulk from one ragged coordinate array; anything else
+    falls back to GeoPandas. Results are cached per file and invalidated by mtime/size,
+    so treat the returned array as read-only.
+    """
+    path = Path(path).resolve()
+    stat = path.stat()
+    return _load_geojson_polygons(str(path), stat.st_mtime_ns, stat.st_size)
+
+
+@lru_cache(maxsize=16)
+def _load_geojson_polygons(path: str, mtime_ns: int, size: int) -> np.ndarray:
+    # the parse allocates millions of small containers; pausing the cyclic GC
+    # avoids repeated full collections over them (they hold no cycles)
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        with open(path, "rb") as f:
+            data = json_loads(f.read())
+    finally:
+        if gc_enabled:
+            gc.enable()
+    features = data.get("features", []) if isinstance(data, dict) else data
+    geoms = [feature.get("geometry") or {} for feature in features]
+
+    if all(g.get("type") == "Polygon" and len(g.get("coordinates", ())) == 1 for g in geoms):
+        rings = [g["coordinates"][0] for g in geoms]
+        lengths = np.fromiter(map(len, rings), dtype=np.int64, count=len(rings))
+        flat = np.fromiter(itertools.chain.from_iterable(itertools.chain.from_iterable(rings)), dtype=float)
+        if len(flat) == 2 * lengths.sum():  # otherwise some vertices carry a z value
+            try:
+                shells = shapely.linearrings(flat.reshape(-1, 2), indices=np.repeat(np.arange(len(rings)), lengths))
+                return shapely.polygons(shells)
+            except shapely.errors.GEOSException:
+                pass  # degenerate rings: let GeoPandas deal with them
+
+    import geopandas as gpd
+    return np.asarray(gpd.read_file(path).geometry, dtype=object)
+
+
+def read_label_mask(path: Union[str, Path]) -> np.ndarray:
+    """
+    Open a label mask without loading it when possible.
+    .npy files and uncompressed TIFFs are memory-mapped; anything else is read.
+    """
+    path = Path(path)
+    suffix = path.suffix.lower()
+    if suffix == ".npy":
+        return np.load(path, mmap_mode="r")
+    if suffix in (".tif", ".tiff"):
+        try:
+            return tifffile.memmap(path, mode="r")
+        except ValueError:  # compressed / tiled data cannot be mapped
+            return tifffile.imread(path)
+    return np.asarray(Image.open(path))
+
+
+def _add_counts(total: np.ndarray, counts: np.ndarray) -> np.ndarray:
+    if len(counts) > len(total):
+        counts[:len(total)] += total
+        return counts
+    total[:len(counts)] += counts
+    return total
+
+
+def label_contingency(gt: np.ndarray, pred: np.ndarray, chunk_rows: int = 512):
+    """
+    Accumulate the overlap contingency between two label masks, chunk_rows rows at a time.
+
+    If pred has a different shape than gt (e.g. a stitched mask at PNG scale against a
+    full-resolution training mask) it is nearest-neighbour resampled onto the gt grid.
+
+    Returns (pair_gt, pair_pred, pair_count, gt_area, pred_area): the label IDs and pixel
+    counts of every overlapping (gt, pred) pair, and per-label areas indexed by label ID.
+    """
+    gh, gw = gt.shape[:2]
+    ph, pw = pred.shape[:2]
+    same_grid = (gh, gw) == (ph, pw)
+    col_idx = None if same_grid else (np.arange(gw) * pw) // gw
+
+    gt_area = np.zeros(1, dtype=np.int64)
+    pred_area = np.zeros(1, dtype=np.int64)
+    keys, counts = [], []
+    for y0 in range(0, gh, chunk_rows):
+        y1 = min(y0 + chunk_rows, gh)
+        g = np.asarray(gt[y0:y1]).ravel().astype(np.int64)
+        if same_grid:
+            p = np.asarray(pred[y0:y1])
+        else:
+            p = np.asarray(pred[(np.arange(y0, y1) * ph) // gh])[:, col_idx]
+        p = p.ravel().astype(np.int64)
+
+        gt_area = _add_counts(gt_area, np.bincount(g))
+        pred_area = _add_counts(pred_area, np.bincount(p))
+
+        both = (g > 0) & (p > 0)
+        chunk_keys, chunk_counts = np.unique((g[both] << 32) | p[both], return_counts=True)
+        keys.append(chunk_keys)
+        counts.append(chunk_counts)
+
+    # reduce the per-chunk pair counts with a bincount over compacted pair IDs
+    pair_keys, inverse = np.unique(np.concatenate(keys), return_inverse=True)
+    pair_count = np.bincount(inverse, weights=np.concatenate(counts)).astype(np.int64)
+    return pair_keys >> 32, pair_keys & 0xFFFFFFFF, pair_count, gt_area, pred_area
+
+
+def raster_iou_matrix(gt: np.ndarray, pred: np.ndarray, chunk_rows: int = 512) -> sparse.csr_matrix:
+    """
+    Sparse IoU matrix between the labels of two masks (rows: gt labels, cols: pred labels,
+    both in ascending label order, background excluded).
+    """
+    pair_gt, pair_pred, inter, gt_area, pred_area = label_contingency(gt, pred, chunk_rows)
+
+    gt_labels = np.flatnonzero(gt_area[1:]) + 1
+    pred_labels = np.flatnonzero(pred_area[1:]) + 1
+    gt_index = np.full(len(gt_area), -1, dtype=np.int64)
+    pred_index = np.full(len(pred_area), -1, dtype=np.int64)
+    gt_index[gt_labels] = np.arange(len(gt_labels))
+    pred_index[pred_labels] = np.arange(len(pred_labels))
+
+    union = gt_area[pair_gt] + pred_area[pair_pred] - inter
+    iou = inter / union
+    return sparse.csr_matrix((iou, (gt_index[pair_gt], pred_index[pair_pred])),
+                             shape=(len(gt_labels), len(pred_labels)))
+
+
+def greedy_match(iou_mat: sparse.spmatrix):
+    """
+    Greedy one-to-one matching in descending IoU order on a sparse IoU matrix.
+
+    Instead of walking a sorted edge list, each round matches every pair that is the
+    best remaining edge for both its row and its column and drops all edges touching
+    them. The highest remaining edge is always such a pair, so the result is identical
+    to the sequential greedy matching, in a handful of vectorized rounds.
+
+    Returns (gt_idx, pred_idx, iou) of the matched pairs.
+    """
+    coo = sparse.coo_matrix(iou_mat)
+    row, col, val = coo.row, coo.col, coo.data
+    keep = val > 0
+    row, col, val = row[keep], col[keep], val[keep]
+
+    matched_row, matched_col, matched_val = [], [], []
+    while len(val):
+        order = np.lexsort((col, row, -val))
+        row, col, val = row[order], col[order], val[order]
+        row_best = np.zeros(len(val), dtype=bool)
+        col_best = np.zeros(len(val), dtype=bool)
+        row_best[np.unique(row, return_index=True)[1]] = True
+        col_best[np.unique(col, return_index=True)[1]] = True
+        mutual = row_best & col_best
+
+        matched_row.append(row[mutual])
+        matched_col.append(col[mutual])
+        matched_val.append(val[mutual])
+        free = ~(np.isin(row, row[mutual]) | np.isin(col, col[mutual]))
+        row, col, val = row[free], col[free], val[free]
+
+    if not matched_val:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), np.empty(0, dtype=float)
+    return np.concatenate(matched_row), np.concatenate(matched_col), np.concatenate(matched_val)
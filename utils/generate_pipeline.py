@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+"""
+Developed by Nikhil Nageshwar Inturi
+
+This module provides a small declarative pipeline runner: every step of
+main.py is a Stage with declared inputs, outputs and parameters, and
+PipelineRunner runs them in dependency order, skipping the ones that are up
+to date.
+
+A stage is up to date when the fingerprint of its parameters and inputs equals
+the one recorded after its last successful run, and its outputs still match
+what that run left behind. Fingerprints are built from the name, size and
+mtime of the files matching each declared (directory, pattern), so unchanged
+inputs are never re-read. Dependencies follow from outputs feeding inputs;
+stages whose dependencies are done run concurrently.
+"""
+
+# imports
+import hashlib, json, logging, time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, Optional, Tuple, Union
+# local imports
+from utils.generate_instrumentation import stage_timer
+
+PathSpec = Union[str, Path, Tuple[Union[str, Path], str]]
+
+
+def _spec(spec: PathSpec) -> Tuple[Path, str]:
+    if isinstance(spec, tuple):
+        return Path(spec[0]), spec[1]
+    return Path(spec), "*"
+
+
+def fingerprint_paths(specs: Iterable[PathSpec]) -> str:
+    """
+    Hash of (relative name, size, mtime_ns) of every file matched by specs.
+    A spec is a file, a directory (all files below it) or a (directory, glob pattern) pair.
+    """
+    h = hashlib.blake2b(digest_size=16)
+    for spec in specs:
+        root, pattern = _spec(spec)
+        h.update(f"{root}|{pattern}\n".encode())
+        if root.is_file():
+            files = [root]
+        elif root.is_dir():
+            files = sorted(p for p in root.rglob(pattern) if p.is_file())
+        else:
+            files = []
+        for p in files:
+            stat = p.stat()
+            h.update(f"{p.relative_to(root) if p != root else p.name}|{stat.st_size}|{stat.st_mtime_ns}\n".encode())
+    return h.hexdigest()
+
+
+class Stage:
+    """
+    One pipeline step: run() must produce outputs from inputs, given params.
+    params should hold every setting that changes the outputs (it is part of the fingerprint).
+    """
+
+    def __init__(self, name: str, run: Callable[[], None], inputs: List[PathSpec] = (),
+                 outputs: List[PathSpec] = (), params: Optional[dict] = None) -> None:
+        self.name = name
+        self.run = run
+        self.inputs = list(inputs)
+        self.outputs = list(outputs)
+        self.params = dict(params or {})
+
+    def key(self) -> str:
+        h = hashlib.blake2b(digest_size=16)
+        h.update(self.name.encode())
+        h.update(json.dumps(self.params, sort_keys=True, default=str).encode())
+        h.update(fingerprint_paths(self.inputs).encode())
+        return h.hexdigest()
+
+
+class PipelineRunner:
+    """
+    Run stages in dependency order, concurrently where possible, skipping up-to-date ones.
+    State is kept as <state_dir>/<stage>.json.
+    """
+
+    def __init__(self, stages: List[Stage], state_dir: Union[str, Path], max_workers: int = 4, force: Iterable[str] = ()) -> None:
+        self.stages = {stage.name: stage for stage in stages}
+        if len(self.stages) != len(stages):
+            raise ValueError("Stage names must be unique")
+        self.state_dir = Path(state_dir)
+        self.max_workers = max_workers
+        self.force = set(force)
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.deps = self._dependencies()
+
+    def _dependencies(self) -> Dict[str, set]:
+        # stage B depends on A when one of B's inputs is (inside) one of A's outputs
+        produced = [(name, _spec(spec)[0].resolve()) for name, st in self.stages.items() for spec in st.outputs]
+        deps = {}
+        for name, stage in self.stages.items():
+            deps[name] = set()
+            for spec in stage.inputs:
+                path = _spec(spec)[0].resolve()
+                for producer, out in produced:
+                    if producer != name and (path == out or out in path.parents):
+                        deps[name].add(producer)
+        return deps
+
+    def _state_path(self, name: str) -> Path:
+        return self.state_dir / f"{name}.json"
+
+    def is_up_to_date(self, stage: Stage) -> bool:
+        state_path = self._state_path(stage.name)
+        if stage.name in self.force or not state_path.exists():
+            return False
+        state = json.loads(state_path.read_text())
+        return state.get("key") == stage.key() and state.get("outputs") == fingerprint_paths(stage.outputs)
+
+    def _run_stage(self, stage: Stage) -> bool:
+        if self.is_up_to_date(stage):
+            self.logger.info(f"[{stage.name}] up to date, skipped")
+            return False
+        key = stage.key()  # before running: inputs may not change under the stage
+        self.logger.info(f"[{stage.name}] running")
+        start = time.perf_counter()
+        with stage_timer(f"pipeline.{stage.name}"):
+            stage.run()
+        self.state_dir.mkdir(parents=True, exist_ok=True)
+        self._state_path(stage.name).write_text(json.dumps(
+            {"key": key, "outputs": fingerprint_paths(stage.outputs), "seconds": time.perf_counter() - start}))
+        self.logger.info(f"[{stage.name}] done in {time.perf_counter() - start:.1f}s")
+        return True
+
+    def run(self) -> Dict[str, str]:
+        """
+        Run the pipeline. Returns {stage: "ran" | "skipped" | "failed" | "blocked"}.
+        Raises RuntimeError at the end if any stage failed.
+        """
+        status: Dict[str, str] = {}
+        pending = dict(self.stages)
+        running = {}
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            while pending or running:
+                for name in list(pending):
+                    dep_status = [status.get(dep) for dep in self.deps[name]]
+                    if any(s in ("failed", "blocked") for s in dep_status):
+                        status[name] = "blocked"
+                        del pending[name]
+                    elif all(s in ("ran", "skipped") for s in dep_status):
+                        running[pool.submit(self._run_stage, pending.pop(name))] = name
+                if not running:
+                    break
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    try:
+                        status[name] = "ran" if future.result() else "skipped"
+                    except Exception:
+                        self.logger.exception(f"[{name}] failed")
+                        status[name] = "failed"
+
+        failed = [name for name, s in status.items() if s in ("failed", "blocked")]
+        if failed:
+            raise RuntimeError(f"Pipeline stages did not complete: {failed}")
+        return status
@@ -5,15 +5,49 @@ Developed by Nikhil Nageshwar Inturi
 This module provides PlotGenerator to process all masks in a directory:
   - For each mask, find its image by matching name stem, then output:
       1) a binary mask PNG,
-      2) an overlay PNG with colored mask + boundaries.
+      2) an overlay PNG with colored mask + per-cell boundaries.
+
+The default "array" backend writes both images straight from NumPy at the
+mask's own resolution; the "matplotlib" backend keeps the old 300 dpi figures.
+With output_mode "pyramid" (or "both") the overlay is written as a Deep Zoom
+tile pyramid, see utils.generate_tile_pyramid.
 """
 
-import matplotlib.pyplot as plt
 import numpy as np
-from PIL import Image
-from skimage.segmentation import find_boundaries
+from PIL import Image, ImageDraw
 from pathlib import Path
 import logging
+# local imports
+from utils.generate_boundaries import iter_boundary_chunks
+from utils.generate_instrumentation import instrumented, stage_add
+Image.MAX_IMAGE_PIXELS = None
+
+
+def blend_color(img: np.ndarray, mask_bool: np.ndarray, color: np.ndarray, alpha: float) -> None:
+    """
+    Blend color into img (H, W, 3 uint8) where mask_bool is set, in place.
+    Uses one 256-entry lookup table per channel, so no float copy of the image is made.
+    """
+    a = int(round(alpha * 255))
+    values = np.arange(256, dtype=np.uint16)
+    for c in range(3):
+        lut = ((values * (255 - a) + int(color[c]) * a + 127) // 255).astype(np.uint8)
+        channel = img[..., c]
+        channel[mask_bool] = lut[channel[mask_bool]]
+
+
+def save_png(arr: np.ndarray, out_path: Path, compress_level: int = 1, title: str = None) -> None:
+    """
+    Encode arr as PNG at its exact pixel size, optionally stamping a title in the top-left corner.
+    """
+    img = Image.fromarray(arr)
+    if title:
+        draw = ImageDraw.Draw(img)
+        fill = (255, 255, 255) if img.mode == "RGB" else 255
+        stroke = (0, 0, 0) if img.mode == "RGB" else 0
+        draw.text((8, 8), title, fill=fill, stroke_width=2, stroke_fill=stroke)
+    img.save(out_path, format="PNG", compress_level=compress_level)
+
 
 class PlotGenerator:
     """
@@ -28,17 +62,32 @@ class PlotGenerator:
         output_dir: Path,
         overlay_color: tuple[int,int,int] = (238,144,144),
         boundary_color: tuple[int,int,int] = (100,100,255),
-        alpha: float = 0.5
+        alpha: float = 0.5,
+        backend: str = "array",
+        compress_level: int = 1,
+        titles: bool = False,
+        output_mode: str = "png",
+        chunk_rows: int = 1024
     ) -> None:
+        if backend not in ("array", "matplotlib"):
+            raise ValueError(f"Unknown backend '{backend}', expected 'array' or 'matplotlib'")
+        if output_mode not in ("png", "pyramid", "both"):
+            raise ValueError(f"Unknown output_mode '{output_mode}', expected 'png', 'pyramid' or 'both'")
         self.image_dir = Path(image_dir)
         self.mask_dir = Path(mask_dir)
         self.output_dir = Path(output_dir)
         self.overlay_color = np.array(overlay_color, dtype=np.uint8)
         self.boundary_color = np.array(boundary_color, dtype=np.uint8)
         self.alpha = alpha
+        self.backend = backend
+        self.compress_level = compress_level
+        self.titles = titles
+        self.output_mode = output_mode
+        self.chunk_rows = chunk_rows
         self.logger = logging.getLogger(self.__class__.__name__)
         self.output_dir.mkdir(parents=True, exist_ok=True)
 
+    @instrumented
     def run(self) -> None:
         mask_paths = list(self.mask_dir.glob("*.npy"))
         if not mask_paths:
@@ -46,44 +95,70 @@ class PlotGenerator:
             return
 
         for mask_path in mask_paths:
-            stem = mask_path.stem
-            img_candidates = list(self.image_dir.glob(f"{stem}*.png"))
-            if not img_candidates:
-                self.logger.warning(f"No image found for mask '{stem}'")
-                continue
-            image_path = img_candidates[0]
-
-            img = np.array(Image.open(image_path).convert("RGB"))
-            mask = np.load(mask_path)
-
-            # binary mask plot
-            binary = (mask > 0).astype(np.uint8)
-            plt.figure(figsize=(10,10))
-            plt.imshow(binary, cmap='gray')
-            plt.axis('off')
-            plt.title(f"{stem} - Binary Mask")
-            out_gray = self.output_dir / f"{stem}_binary.png"
-            plt.savefig(out_gray, bbox_inches='tight', dpi=300)
-            plt.close()
-            self.logger.info(f"Saved binary mask plot: {out_gray.name}")
-
-            # overlay with boundaries
-            overlay = img.copy()
-            mask_bool = mask > 0
-            overlay[mask_bool] = (
-                (1 - self.alpha) * img[mask_bool] + self.alpha * self.overlay_color
-            ).astype(np.uint8)
-            boundaries = find_boundaries(mask_bool, mode='outer')
-            overlay[boundaries] = self.boundary_color
-
-            plt.figure(figsize=(10,10))
-            plt.imshow(overlay)
-            plt.axis('off')
-            plt.title(f"{stem} - Mask Overlay")
-            out_overlay = self.output_dir / f"{stem}_overlay.png"
-            plt.savefig(out_overlay, bbox_inches='tight', dpi=300)
-            plt.close()
-            self.logger.info(f"Saved overlay plot: {out_overlay.name}")
+            self.plot_mask(mask_path)
+
+    @instrumented
+    def plot_mask(self, mask_path: Path) -> None:
+        """
+        Write the binary and overlay plots for a single stitched mask.
+        """
+        stem = mask_path.stem
+        img_candidates = list(self.image_dir.glob(f"{stem}*.png"))
+        if not img_candidates:
+            self.logger.warning(f"No image found for mask '{stem}'")
+            return
+        image_path = img_candidates[0]
+
+        img = np.array(Image.open(image_path).convert("RGB"))
+        mask = np.load(mask_path, mmap_mode="r")
+        stage_add("PlotGenerator.plot_mask", images=1, pixels=mask.size)
+
+        if self.output_mode != "png":
+            from utils.generate_tile_pyramid import TilePyramidGenerator  # imports this module
+            TilePyramidGenerator(self.image_dir, self.mask_dir, self.output_dir,
+                                 overlay_color=tuple(self.overlay_color), boundary_color=tuple(self.boundary_color),
+                                 alpha=self.alpha, compress_level=self.compress_level).build(stem, img, mask)
+        draw_overlay = self.output_mode != "pyramid"
+
+        # one pass over row bands of the mask: binary mask, overlay colour and per-cell
+        # boundaries, drawn into img in place so no second full-size RGB array is made
+        mask_bool = np.empty(mask.shape, dtype=bool)
+        for y0, y1, labels, boundary in iter_boundary_chunks(mask, self.chunk_rows):
+            cells = mask_bool[y0:y1]
+            np.greater(labels, 0, out=cells)
+            if draw_overlay:
+                band = img[y0:y1]
+                blend_color(band, cells, self.overlay_color, self.alpha)
+                band[boundary] = self.boundary_color
+        self._save_binary(mask_bool, stem)
+        if not draw_overlay:
+            return
+
+        out_overlay = self.output_dir / f"{stem}_overlay.png"
+        if self.backend == "array":
+            save_png(img, out_overlay, self.compress_level, f"{stem} - Mask Overlay" if self.titles else None)
+        else:
+            self._save_figure(img, out_overlay, f"{stem} - Mask Overlay")
+        self.logger.info(f"Saved overlay plot: {out_overlay.name}")
+
+    def _save_binary(self, mask_bool: np.ndarray, stem: str) -> None:
+        out_gray = self.output_dir / f"{stem}_binary.png"
+        if self.backend == "array":
+            # a bool array encodes as a 1-bit PNG: 8x less data to deflate than 8-bit gray
+            save_png(mask_bool, out_gray, self.compress_level, f"{stem} - Binary Mask" if self.titles else None)
+        else:
+            self._save_figure(mask_bool.astype(np.uint8), out_gray, f"{stem} - Binary Mask", cmap='gray')
+        self.logger.info(f"Saved binary mask plot: {out_gray.name}")
+
+    @staticmethod
+    def _save_figure(arr: np.ndarray, out_path: Path, title: str, cmap: str = None) -> None:
+        import matplotlib.pyplot as plt
+        plt.figure(figsize=(10,10))
+        plt.imshow(arr, cmap=cmap)
+        plt.axis('off')
+        plt.title(title)
+        plt.savefig(out_path, bbox_inches='tight', dpi=300)
+        plt.close()
 
 
 # # main.py snippet (to run plots for all masks)
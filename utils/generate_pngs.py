@@ -13,6 +13,7 @@ from typing import Union
 from PIL import Image
 # local imports
 from utils.constants import *
+from utils.generate_instrumentation import instrumented, stage_add
 
 
 class TiffToPngConverter:
@@ -36,6 +37,7 @@ class TiffToPngConverter:
             self.logger.error(f"Failed to create output directory {self.output_dir}: {e}")
             raise
 
+    @instrumented
     def convert_all(self) -> None:
         """
         Convert all .tif files in the source directory.
@@ -51,20 +53,31 @@ class TiffToPngConverter:
             except Exception:
                 self.logger.exception(f"Error converting file: {tif_path}")
 
-    def convert_file(self, tif_path: Path) -> None:
+    @instrumented
+    def convert_file(self, tif_path: Path, level: int = 0) -> None:
         """
         Convert a single TIFF file to PNG, resizing by the scaling factor.
 
         Args:
             tif_path: Path to the input .tif file.
+            level: Pyramid level to resize from (0 = full resolution). The PNG is always
+                scaling_factor times the full-resolution size; a smaller level just reads less.
         """
-        img_array = tifffile.imread(str(tif_path), level=0)
-        self.logger.debug(f"Read {tif_path.name} with shape {img_array.shape}")
+        if level:
+            with tifffile.TiffFile(str(tif_path)) as tif:
+                levels = tif.series[0].levels
+                full_shape = levels[0].shape
+                img_array = levels[min(level, len(levels) - 1)].asarray()
+        else:
+            img_array = tifffile.imread(str(tif_path), level=0)
+            full_shape = img_array.shape
+        self.logger.debug(f"Read {tif_path.name} level {level} with shape {img_array.shape}")
         img = Image.fromarray(img_array)
-        new_size = (int(img_array.shape[1] * self.scaling_factor), int(img_array.shape[0] * self.scaling_factor))
+        new_size = (int(full_shape[1] * self.scaling_factor), int(full_shape[0] * self.scaling_factor))
         img_resized = img.resize(new_size, resample=Image.LANCZOS)
         output_path = self.output_dir / tif_path.with_suffix(".png").name
         img_resized.save(output_path, format="PNG")
+        stage_add("TiffToPngConverter.convert_file", images=1, bytes=img_array.nbytes)
         self.logger.info(f"Converted {tif_path.name} to {output_path}")
 
 
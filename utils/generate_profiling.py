@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+"""
+Developed by Nikhil Nageshwar Inturi
+
+Opt-in profiling of individual pipeline stages, without editing code.
+
+Every stage timed by utils.generate_instrumentation (methods decorated with
+@instrumented, "detect", the PipelineRunner / SlideScheduler stages) can be
+profiled by name. Select stages with the environment
+
+    PIPELINE_PROFILE=MaskToGeoJSONConverter,detect   stage names or fnmatch patterns;
+                                                     "Class" matches all "Class.*" stages
+    PIPELINE_PROFILE_DIR=/path/to/profiles           default: PROFILE_DIR (utils.constants)
+    PIPELINE_PROFILE_STACKS=1                        also sample call stacks
+    PIPELINE_PROFILE_TOP=25                          allocation sites listed per report
+
+or in code/config with configure_profiling(stages, profile_dir) (setup_logging
+does this for PROFILE_STAGES); the environment wins. For each profiled call,
+<profile_dir>/<stage>_<pid>_<n> gets
+
+    .prof         cProfile dump (pstats, snakeviz, ...)
+    .alloc.txt    tracemalloc: peak traced memory and the top allocation sites
+    .stacks.txt   collapsed stacks sampled every 10 ms (flamegraph.pl, speedscope)
+
+cProfile and tracemalloc are process-wide: a profiled stage that starts while
+another one is being cProfiled skips its .prof (the outer dump covers nested
+stages), and allocation reports include concurrently running stages.
+With no stage selected (and metrics off), stage wrappers only check two flags.
+"""
+
+# imports
+import cProfile, fnmatch, itertools, logging, os, sys, threading, time, tracemalloc
+from collections import Counter
+from pathlib import Path
+from typing import Iterable, Optional, Union
+
+logger = logging.getLogger(__name__)
+
+PROFILE_ENV = "PIPELINE_PROFILE"
+PROFILE_DIR_ENV = "PIPELINE_PROFILE_DIR"
+PROFILE_STACKS_ENV = "PIPELINE_PROFILE_STACKS"
+PROFILE_TOP_ENV = "PIPELINE_PROFILE_TOP"
+
+
+class StackSampler:
+    """
+    Samples one thread's Python stack at a fixed interval into collapsed-stack counts.
+    """
+
+    def __init__(self, thread_id: int, interval: float = 0.01) -> None:
+        self.thread_id = thread_id
+        self.interval = interval
+        self.counts: Counter = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{Path(code.co_filename).name}:{code.co_name}")
+                frame = frame.f_back
+            if stack:
+                self.counts[";".join(reversed(stack))] += 1
+
+    def start(self) -> "StackSampler":
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._thread.join()
+
+    def write(self, path: Path) -> None:
+        path.write_text("".join(f"{stack} {n}\n" for stack, n in self.counts.most_common()))
+
+
+class ProfileSession:
+    """
+    Profilers attached to one call of a stage.
+    """
+
+    def __init__(self, name: str, base: Path, profile: Optional[cProfile.Profile], sampler: Optional[StackSampler]) -> None:
+        self.name = name
+        self.base = base
+        self.profile = profile
+        self.sampler = sampler
+        self.snapshot = tracemalloc.take_snapshot()
+        self.started = time.perf_counter()
+        self.start_memory = 0  # traced memory at the start, and the highest seen since (see StageProfiler._fold_peak)
+        self.peak = 0
+
+    def path(self, suffix: str) -> Path:
+        return self.base.with_name(self.base.name + suffix)  # stage names contain dots: no with_suffix
+
+
+class StageProfiler:
+    """
+    Process-wide profiling switch: which stages to profile and where to write the results.
+    """
+
+    def __init__(self) -> None:
+        self.enabled = False
+        self.patterns: tuple = ()
+        self.profile_dir: Optional[Path] = None
+        self.stacks = False
+        self.top = 25
+        self._lock = threading.Lock()
+        self._counter = itertools.count()
+        self._cprofile_busy = False
+        self._sessions = set()  # active sessions, all sharing tracemalloc
+        self._owns_tracing = False
+
+    def configure(self, stages: Iterable[str] = (), profile_dir: Union[str, Path, None] = None,
+                  stacks: bool = False, top: int = 25) -> None:
+        self.patterns = tuple(s.strip() for s in stages if s and s.strip())
+        self.profile_dir = Path(profile_dir) if profile_dir is not None else None
+        self.stacks = stacks
+        self.top = top
+        self.enabled = bool(self.patterns) and self.profile_dir is not None
+        if self.enabled:
+            logger.info(f"Profiling stages {list(self.patterns)} into {self.profile_dir}")
+
+    def wants(self, name: str) -> bool:
+        return any(fnmatch.fnmatchcase(name, p) or name.startswith(f"{p}.") for p in self.patterns)
+
+    def _fold_peak(self) -> int:
+        """
+        tracemalloc keeps one peak for the process: fold it into every active session, then reset it,
+        so each session's peak covers exactly its own lifetime. Returns the traced memory now.
+        """
+        current, peak = tracemalloc.get_traced_memory()
+        for session in self._sessions:
+            session.peak = max(session.peak, peak)
+        tracemalloc.reset_peak()
+        return current
+
+    def start(self, name: str) -> Optional[ProfileSession]:
+        if not self.wants(name):
+            return None
+        self.profile_dir.mkdir(parents=True, exist_ok=True)
+        base = self.profile_dir / f"{name}_{os.getpid()}_{next(self._counter)}"
+        sampler = StackSampler(threading.get_ident()).start() if self.stacks else None
+        with self._lock:
+            profile = None
+            if not self._cprofile_busy:
+                self._cprofile_busy = True
+                profile = cProfile.Profile()
+            if not self._sessions and not tracemalloc.is_tracing():
+                tracemalloc.start()
+                self._owns_tracing = True
+            session = ProfileSession(name, base, profile, sampler)
+            session.start_memory = session.peak = self._fold_peak()
+            self._sessions.add(session)
+        if profile is not None:
+            profile.enable()
+        return session
+
+    def stop(self, session: ProfileSession) -> None:
+        wall_s = time.perf_counter() - session.started
+        if session.profile is not None:
+            session.profile.disable()
+        if session.sampler is not None:
+            session.sampler.stop()
+        snapshot = tracemalloc.take_snapshot()
+        with self._lock:
+            self._fold_peak()
+            self._sessions.discard(session)
+            if session.profile is not None:
+                self._cprofile_busy = False
+            if not self._sessions and self._owns_tracing:
+                tracemalloc.stop()  # only if it was started here (not by python -X tracemalloc)
+                self._owns_tracing = False
+        peak = session.peak - session.start_memory
+
+        written = []
+        if session.profile is not None:
+            session.profile.dump_stats(str(session.path(".prof")))
+            written.append(".prof")
+        self._write_allocations(session, snapshot, peak, wall_s)
+        written.append(".alloc.txt")
+        if session.sampler is not None:
+            session.sampler.write(session.path(".stacks.txt"))
+            written.append(".stacks.txt")
+        logger.info(f"[{session.name}] profile written to {session.base}{{{','.join(written)}}}")
+
+    def _write_allocations(self, session: ProfileSession, snapshot, peak: int, wall_s: float) -> None:
+        filters = [tracemalloc.Filter(False, tracemalloc.__file__), tracemalloc.Filter(False, __file__),
+                   tracemalloc.Filter(False, "<frozen importlib._bootstrap*>")]
+        diff = snapshot.filter_traces(filters).compare_to(session.snapshot.filter_traces(filters), "lineno")
+        lines = [f"stage: {session.name}", f"wall: {wall_s:.3f}s", f"peak traced memory: {peak / 2 ** 20:.1f} MB over the start of the stage",
+                 f"top {self.top} allocation sites still held at the end (growth over the start of the stage):"]
+        lines += [f"  {stat}" for stat in diff[:self.top]]
+        session.path(".alloc.txt").write_text("\n".join(lines) + "\n")
+
+
+PROFILER = StageProfiler()
+
+
+def configure_profiling(stages: Iterable[str] = (), profile_dir: Union[str, Path, None] = None, stacks: bool = False) -> None:
+    """
+    Profile the given stages into profile_dir; the PIPELINE_PROFILE* environment variables override both.
+    """
+    env_stages = os.environ.get(PROFILE_ENV)
+    if env_stages is not None:
+        stages = env_stages.split(",")
+    profile_dir = os.environ.get(PROFILE_DIR_ENV, profile_dir)
+    stacks = os.environ.get(PROFILE_STACKS_ENV, "1" if stacks else "0").lower() in ("1", "true", "yes")
+    top = int(os.environ.get(PROFILE_TOP_ENV, 25))
+    PROFILER.configure(stages, profile_dir, stacks, top)
@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+"""
+Developed by Nikhil Nageshwar Inturi
+
+This module provides ResultCache, a bounded on-disk cache of the Streamlit
+job artifacts (see utils.generate_jobs), keyed by what produced them:
+
+    key(stage) = hash(key(upstream stage), stage, the stage's own parameters)
+    key(pngs)  = hash(content hash of the slide, "pngs", scaling_factor)
+
+so a re-upload of the same slide (under any file name) hits every stage, a
+changed overlay colour only misses "plots", and a new model misses "detect"
+and everything downstream of it. Entries live in <cache_dir>/<key>/ with a
+meta.json and one folder per workspace directory written; they are restored
+into a job workspace by hard-linking (copying across filesystems) and evicted
+least-recently-used first once the cache exceeds max_bytes.
+"""
+
+# imports
+import hashlib, json, logging, os, shutil, threading, time, uuid
+from glob import escape as glob_escape
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Union
+
+HASH_CHUNK = 8 * 2 ** 20
+CACHE_FORMAT = 4  # part of every key: entries of an older layout (or older detect normalization) are never restored (and age out)
+
+# stage → (upstream stage, parameters that change its output)
+STAGE_DEPENDS = {
+    "pngs": (None, ("scaling_factor", "tif_level")),
+    "splits": ("pngs", ("tile_width", "tile_height")),
+    "detect": ("splits", ("model", "flow_threshold", "cellprob_threshold", "min_size")),
+    "stitch": ("detect", ()),
+    "plots": ("stitch", ("overlay_color", "boundary_color", "alpha")),
+    "geojsons": ("stitch", ("scaling_factor",)),
+}
+# stage → stages whose artifacts it reads, and what it writes ((workspace attribute, pattern) pairs)
+STAGE_INPUTS = {"pngs": (), "splits": ("pngs",), "detect": ("splits",), "stitch": ("detect", "pngs"),
+                "plots": ("stitch", "pngs"), "geojsons": ("stitch",)}
+STAGE_OUTPUTS = {
+    "pngs": (("png_dir", "{stem}.png"),),
+    "splits": (("split_dir", "{stem}_*_*.png"),),
+    "detect": (("mask_dir", "{stem}_*_*.npy"),),
+    "stitch": (("stitched_dir", "{stem}.npy"), ("geojson_dir", "{stem}_cells.parquet")),
+    "plots": (("output_dir", "{stem}*"),),
+    "geojsons": (("geojson_dir", "{stem}.geojson"), ("geojson_dir", "{stem}_index.npz")),
+}
+FINAL_STAGES = ("stitch", "plots", "geojsons")  # what a finished job shows or offers for download
+
+
+def content_hasher():
+    return hashlib.blake2b(digest_size=20)
+
+
+def file_digest(path: Union[str, Path], chunk_size: int = HASH_CHUNK) -> str:
+    """
+    Streaming blake2b of a file's content (constant memory for multi-GB slides).
+    """
+    h = content_hasher()
+    with open(path, "rb") as f:
+        while chunk := f.read(chunk_size):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _param(name: str, value) -> str:
+    if name == "model" and Path(str(value)).exists():
+        stat = Path(str(value)).stat()  # retrained weights under the same path change the key
+        return f"{value}|{stat.st_size}|{stat.st_mtime_ns}"
+    return json.dumps(value, default=str)
+
+
+def stage_keys(content_hash: str, params: dict, stages: Iterable[str] = STAGE_DEPENDS) -> Dict[str, str]:
+    keys = {}
+    for stage in stages:
+        upstream, names = STAGE_DEPENDS[stage]
+        h = hashlib.blake2b(digest_size=16)
+        h.update((keys[upstream] if upstream else f"{CACHE_FORMAT}|{content_hash}").encode())
+        h.update(stage.encode())
+        for name in names:
+            h.update(f"|{name}={_param(name, params.get(name))}".encode())
+        keys[stage] = h.hexdigest()
+    return keys
+
+
+def _link_file(src, dst) -> None:
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+
+
+def _link_or_copy(src: Path, dst: Path) -> None:
+    if src.is_dir():  # e.g. the <stem>_files tile tree of a DZI pyramid
+        shutil.copytree(src, dst, copy_function=_link_file)
+    else:
+        _link_file(src, dst)
+
+
+def _size(path: Path) -> int:
+    if path.is_dir():
+        return sum(p.stat().st_size for p in path.rglob("*") if p.is_file())
+    return path.stat().st_size
+
+
+class ResultCache:
+    """
+    Stage artifacts by key, LRU-evicted by total size.
+    """
+
+    def __init__(self, cache_dir: Union[str, Path], max_bytes: int) -> None:
+        self.cache_dir = Path(cache_dir)
+        self.max_bytes = max_bytes
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self._lock = threading.Lock()
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+
+    def _entry(self, key: str) -> Path:
+        return self.cache_dir / key
+
+    def has(self, key: str) -> bool:
+        return (self._entry(key) / "meta.json").exists()
+
+    def outputs(self, stage: str, workspace, stem: str) -> List[tuple]:
+        """
+        (workspace attribute, path) of every artifact the stage wrote for stem.
+        """
+        return [(attr, p) for attr, pattern in STAGE_OUTPUTS[stage]
+                for p in sorted(getattr(workspace, attr).glob(pattern.format(stem=glob_escape(stem))))]
+
+    def put(self, key: str, stage: str, workspace, stem: str) -> None:
+        """
+        Store the stage's outputs in the workspace under key (names relative to the slide stem).
+        """
+        if self.has(key):
+            return
+        files = self.outputs(stage, workspace, stem)
+        tmp = self.cache_dir / f".{key}.{uuid.uuid4().hex}.tmp"
+        try:
+            tmp.mkdir()
+            for attr, src in files:
+                (tmp / attr).mkdir(exist_ok=True)
+                _link_or_copy(src, tmp / attr / src.name.replace(stem, "{stem}", 1))
+            size = sum(_size(p) for p in tmp.iterdir())
+            (tmp / "meta.json").write_text(json.dumps({"stage": stage, "files": len(files), "bytes": size, "created": time.time()}))
+            os.rename(tmp, self._entry(key))
+        except OSError as e:  # stored meanwhile by a concurrent job, or no space: the job goes on uncached
+            if not self.has(key):
+                self.logger.warning(f"Could not cache {stage} as {key}: {e}")
+            shutil.rmtree(tmp, ignore_errors=True)
+            return
+        self.logger.info(f"Cached {stage} ({size / 2 ** 20:.1f} MB) as {key}")
+        self.evict(keep=key)
+
+    def restore(self, key: str, stage: str, workspace, stem: str) -> bool:
+        """
+        Link the entry's artifacts into the workspace under stem. False if the entry is gone.
+        """
+        entry = self._entry(key)
+        with self._lock:
+            try:
+                os.utime(entry / "meta.json")  # LRU: last use
+                for attr, _ in STAGE_OUTPUTS[stage]:
+                    if not (entry / attr).is_dir():
+                        continue
+                    for src in (entry / attr).iterdir():
+                        dst = getattr(workspace, attr) / src.name.replace("{stem}", stem, 1)
+                        if not dst.exists():
+                            _link_or_copy(src, dst)
+            except FileNotFoundError:
+                return False
+        return True
+
+    def entries(self) -> List[dict]:
+        entries = []
+        for meta in self.cache_dir.glob("*/meta.json"):
+            try:
+                info = json.loads(meta.read_text())
+                entries.append(dict(info, key=meta.parent.name, last_used=meta.stat().st_mtime))
+            except (OSError, ValueError):
+                continue
+        return entries
+
+    def evict(self, keep: Optional[str] = None) -> None:
+        """
+        Remove least recently used entries until the cache fits in max_bytes.
+        """
+        with self._lock:
+            entries = sorted(self.entries(), key=lambda e: e["last_used"])
+            total = sum(e["bytes"] for e in entries)
+            for e in entries:
+                if total <= self.max_bytes:
+                    break
+                if e["key"] == keep:
+                    continue
+                # rename first so a concurrent restore never sees a half-deleted entry
+                doomed = self.cache_dir / f".{e['key']}.{uuid.uuid4().hex}.evict"
+                try:
+                    os.rename(self._entry(e["key"]), doomed)
+                except OSError:
+                    continue
+                shutil.rmtree(doomed, ignore_errors=True)
+                total -= e["bytes"]
+                self.logger.info(f"Evicted {e['stage']} entry {e['key']} ({e['bytes'] / 2 ** 20:.1f} MB)")
+
+    def touch(self, key: str) -> None:
+        try:
+            os.utime(self._entry(key) / "meta.json")  # LRU: last use
+        except FileNotFoundError:
+            pass
+
+    def plan(self, keys: Dict[str, str], workspace, stem: str, stages: Iterable[str]) -> List[str]:
+        """
+        Restore what the job needs from the cache and return the stages that still have to run:
+        a stage runs if it is not cached and is a final stage or feeds one that runs (so cached
+        final artifacts never pull their upstream stages back in). Cached final artifacts and the
+        cached inputs of every stage that runs are restored; every cached entry of the job counts
+        as used, so upstream entries age out together with the final ones.
+        """
+        stages = list(stages)
+        cached = {stage for stage in stages if self.has(keys[stage])}
+        while True:
+            to_run = set()
+            for stage in reversed(stages):  # consumers come after their inputs
+                consumers = [s for s in stages if stage in STAGE_INPUTS[s]]
+                if stage not in cached and (stage in FINAL_STAGES or any(c in to_run for c in consumers)):
+                    to_run.add(stage)
+            needed = {s for s in FINAL_STAGES if s in cached} | {i for s in to_run for i in STAGE_INPUTS[s] if i in cached}
+            missing = [s for s in sorted(needed) if not self.restore(keys[s], s, workspace, stem)]
+            if not missing:
+                for stage in cached - needed:
+                    self.touch(keys[stage])
+                return [stage for stage in stages if stage in to_run]
+            cached -= set(missing)  # evicted since has(): recompute them (and restore their inputs)
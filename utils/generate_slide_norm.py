@@ -0,0 +1,243 @@
+#!/usr/bin/env python3
+"""
+Developed by Nikhil Nageshwar Inturi
+
+This module provides SlideNormalizer, a slide-level replacement for per-tile
+intensity normalization (cv2 NORM_MINMAX when writing training tiles, Cellpose's
+1st-99th percentile normalization at inference).
+
+One streaming pass over a strided subsample of the slide builds a per-channel
+histogram, from which percentile bounds are taken once and stored next to the
+slide as <stem>.norm.json. Every tile of that slide is then converted to uint8
+with a per-channel lookup table (clip, scale and cast in a single gather), so
+intensities are consistent across tile seams and no per-tile reduction is run.
+
+TIFF slides are read band by band through SlideReader, PNG slides through
+PngRowReader, so neither is ever decoded whole.
+"""
+
+# imports
+import io, json, logging, struct, zlib
+from pathlib import Path
+from typing import Iterator, Optional, Tuple, Union
+import numpy as np
+from PIL import Image
+# local imports
+from utils.generate_training_crops import SlideReader
+Image.MAX_IMAGE_PIXELS = None
+
+NORM_SUFFIX = ".norm.json"
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+PNG_CHANNELS = {0: 1, 2: 3, 3: 1, 4: 2, 6: 4}  # colour type → samples per pixel
+PNG_READ_SIZE = 2 ** 20
+PNG_BAND_ROWS = 64  # subsampled rows per decoded PNG band
+
+
+def norm_path(slide_path: Union[str, Path]) -> Path:
+    slide_path = Path(slide_path)
+    return slide_path.with_name(f"{slide_path.stem}{NORM_SUFFIX}")
+
+
+def _png_chunk(chunk_type: bytes, data: bytes) -> bytes:
+    return struct.pack(">I", len(data)) + chunk_type + data + struct.pack(">I", zlib.crc32(chunk_type + data))
+
+
+class PngRowReader:
+    """
+    Row bands of a PNG, front to back, without decoding the whole image.
+
+    The IDAT stream is inflated incrementally; each band is decoded by PIL as a
+    small PNG of its own: the previous band's last row (unfiltered), then the
+    band's filtered rows, which only ever refer to the row above them.
+    Interlaced PNGs and 16-bit colour PNGs are not streamable (see streamable).
+    """
+
+    def __init__(self, path: Union[str, Path]) -> None:
+        self.path = Path(path)
+        self.chunks = []  # (type, data) of the chunks before the image data
+        with open(self.path, "rb") as f:
+            if f.read(8) != PNG_SIGNATURE:
+                raise ValueError(f"{self.path.name} is not a PNG file")
+            while True:
+                length, chunk_type = struct.unpack(">I4s", f.read(8))
+                if chunk_type == b"IDAT":
+                    self.data_offset = f.tell() - 8
+                    break
+                self.chunks.append((chunk_type, f.read(length)))
+                f.seek(4, 1)  # CRC
+        (self.width, self.height, self.bit_depth, self.color_type,
+         _, _, self.interlace) = struct.unpack(">IIBBBBB", self.chunks[0][1])
+        self.row_bytes = (self.width * PNG_CHANNELS[self.color_type] * self.bit_depth + 7) // 8
+        self.dtype = np.dtype(np.uint16 if self.bit_depth == 16 else np.uint8)
+
+    @property
+    def streamable(self) -> bool:
+        # rows PIL decodes to exactly their PNG samples, so a decoded row can be re-encoded unfiltered
+        return not self.interlace and (self.bit_depth == 8 or (self.bit_depth == 16 and self.color_type == 0))
+
+    def _scanlines(self) -> Iterator[bytes]:
+        """
+        Filtered scanlines (filter type byte + row bytes), inflated a bounded piece at a time
+        and yielded in runs of whole scanlines.
+        """
+        inflater, pending, line = zlib.decompressobj(), bytearray(), self.row_bytes + 1
+        with open(self.path, "rb") as f:
+            f.seek(self.data_offset)
+            while True:
+                length, chunk_type = struct.unpack(">I4s", f.read(8))
+                if chunk_type == b"IEND":
+                    break
+                if chunk_type != b"IDAT":
+                    f.seek(length + 4, 1)
+                    continue
+                for start in range(0, length, PNG_READ_SIZE):
+                    data = f.read(min(PNG_READ_SIZE, length - start))
+                    while data:
+                        pending += inflater.decompress(data, PNG_READ_SIZE)
+                        data = inflater.unconsumed_tail
+                        whole = len(pending) - len(pending) % line
+                        if whole:
+                            yield bytes(pending[:whole])
+                            del pending[:whole]
+                f.seek(4, 1)  # CRC
+
+    def _decode(self, data: bytes, previous: Optional[bytes]) -> np.ndarray:
+        if previous is not None:
+            data = b"\x00" + previous + data
+        header = struct.pack(">IIBBBBB", self.width, len(data) // (self.row_bytes + 1), self.bit_depth, self.color_type, 0, 0, 0)
+        png = (PNG_SIGNATURE + _png_chunk(b"IHDR", header) + b"".join(_png_chunk(t, d) for t, d in self.chunks[1:])
+               + _png_chunk(b"IDAT", zlib.compress(data, 0)) + _png_chunk(b"IEND", b""))
+        del data
+        band = np.asarray(Image.open(io.BytesIO(png)))
+        return band[1:] if previous is not None else band
+
+    def bands(self, rows: int) -> Iterator[np.ndarray]:
+        """
+        Consecutive (rows, W) / (rows, W, C) bands of the image, the last one possibly shorter.
+        """
+        size = rows * (self.row_bytes + 1)
+        pending, previous = bytearray(), None
+        for data in self._scanlines():
+            pending += data
+            while len(pending) >= size:
+                band = self._decode(bytes(pending[:size]), previous)
+                del pending[:size]
+                previous = band[-1].astype(self.dtype.newbyteorder(">")).tobytes()
+                yield band
+        if pending:
+            yield self._decode(bytes(pending), previous)
+
+
+class SlideNormalizer:
+    """
+    Per-channel [lower, upper] intensity bounds of one slide and their uint8 lookup tables.
+    """
+
+    def __init__(self, lower, upper, dtype: Union[str, np.dtype]) -> None:
+        self.lower = np.atleast_1d(np.asarray(lower, dtype=float))
+        self.upper = np.maximum(np.atleast_1d(np.asarray(upper, dtype=float)), self.lower + 1e-6)
+        self.dtype = np.dtype(dtype)
+        self._luts = None
+
+    @staticmethod
+    def _uses_lut(dtype: np.dtype) -> bool:
+        return dtype.kind == "u" and dtype.itemsize <= 2
+
+    @classmethod
+    def from_array(cls, arr, percentiles: Tuple[float, float] = (1.0, 99.0), stride: int = 4,
+                   chunk_rows: int = 1024) -> "SlideNormalizer":
+        """
+        Bounds from every stride-th row and column of arr, a (H, W) / (H, W, C) array,
+        a SlideReader or a PngRowReader, read chunk_rows (subsampled) rows at a time.
+        """
+        rows = chunk_rows * stride
+        if isinstance(arr, PngRowReader):
+            # a decoded PNG band costs a few copies of its pixels: decode smaller ones
+            dtype, bands = arr.dtype, arr.bands(min(rows, PNG_BAND_ROWS * stride))
+        elif isinstance(arr, SlideReader):
+            dtype = arr.array.dtype
+            bands = (arr.read(y0, 0, min(rows, arr.height - y0), arr.width) for y0 in range(0, arr.height, rows))
+        else:
+            dtype = arr.dtype
+            bands = (np.asarray(arr[y0:y0 + rows]) for y0 in range(0, arr.shape[0], rows))
+        dtype = np.dtype(dtype)
+        hist, samples = None, []
+        for band in bands:
+            band = band[::stride, ::stride]
+            band = band.reshape(-1, 1) if band.ndim == 2 else band.reshape(-1, band.shape[-1])
+            if cls._uses_lut(dtype):
+                # integer data: exact histogram over all representable values
+                counts = np.stack([np.bincount(band[:, c], minlength=2 ** (8 * dtype.itemsize))
+                                   for c in range(band.shape[1])])
+                hist = counts if hist is None else hist + counts
+            else:
+                samples.append(band)
+
+        q = np.asarray(percentiles, dtype=float) / 100.0
+        if hist is not None:
+            cdf = np.cumsum(hist, axis=1)
+            bounds = np.stack([np.searchsorted(cdf[c], q * cdf[c, -1]) for c in range(len(cdf))])
+        else:
+            bounds = np.percentile(np.concatenate(samples), percentiles, axis=0).T
+        return cls(bounds[:, 0], bounds[:, 1], dtype)
+
+    @classmethod
+    def for_slide(cls, slide_path: Union[str, Path], percentiles: Tuple[float, float] = (1.0, 99.0),
+                  stride: int = 4, arr: Optional[np.ndarray] = None) -> "SlideNormalizer":
+        """
+        Load the stored bounds of a slide, or compute and store them if missing or stale.
+        arr can pass the slide when it is already in memory.
+        """
+        slide_path = Path(slide_path)
+        stat = slide_path.stat()
+        key = {"mtime_ns": stat.st_mtime_ns, "size": stat.st_size,
+               "percentiles": list(percentiles), "stride": stride}
+        sidecar = norm_path(slide_path)
+        if sidecar.exists():
+            data = json.loads(sidecar.read_text())
+            if data.get("source") == key:
+                return cls(data["lower"], data["upper"], data["dtype"])
+
+        if arr is None:
+            if slide_path.suffix.lower() in (".tif", ".tiff"):
+                arr = SlideReader(slide_path)
+            elif slide_path.suffix.lower() == ".png" and (reader := PngRowReader(slide_path)).streamable:
+                arr = reader
+            else:
+                arr = np.asarray(Image.open(slide_path))
+        normalizer = cls.from_array(arr, percentiles, stride)
+        sidecar.write_text(json.dumps({"source": key, "dtype": normalizer.dtype.str,
+                                       "lower": normalizer.lower.tolist(), "upper": normalizer.upper.tolist()}))
+        logging.getLogger(cls.__name__).info(
+            f"{slide_path.name}: bounds {normalizer.lower.tolist()} - {normalizer.upper.tolist()} → {sidecar.name}")
+        return normalizer
+
+    def luts(self) -> np.ndarray:
+        """
+        (C, 2**bits) uint8 tables mapping every input value to its normalized output.
+        """
+        if self._luts is None:
+            values = np.arange(2 ** (8 * self.dtype.itemsize), dtype=np.float32)
+            scale = 255.0 / (self.upper - self.lower)
+            self._luts = np.stack([np.clip(np.rint((values - lo) * s), 0, 255).astype(np.uint8)
+                                   for lo, s in zip(self.lower, scale)])
+        return self._luts
+
+    def apply(self, tile: np.ndarray) -> np.ndarray:
+        """
+        Normalize a (H, W) or (H, W, C) tile of this slide to uint8.
+        """
+        tile = np.asarray(tile)
+        channels = [tile] if tile.ndim == 2 else [tile[..., c] for c in range(tile.shape[-1])]
+        if len(self.lower) not in (1, len(channels)):
+            raise ValueError(f"Tile has {len(channels)} channels, bounds were computed for {len(self.lower)}")
+        out = np.empty(tile.shape, dtype=np.uint8)
+        out_channels = [out] if tile.ndim == 2 else [out[..., c] for c in range(tile.shape[-1])]
+        for c, (src, dst) in enumerate(zip(channels, out_channels)):
+            k = c if len(self.lower) > 1 else 0
+            if self._uses_lut(tile.dtype) and tile.dtype == self.dtype:
+                np.take(self.luts()[k], src, out=dst)
+            else:
+                scaled = (src.astype(np.float32) - self.lower[k]) * (255.0 / (self.upper[k] - self.lower[k]))
+                dst[...] = np.clip(np.rint(scaled), 0, 255)
+        return out
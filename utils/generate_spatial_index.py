@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+"""
+Developed by Nikhil Nageshwar Inturi
+
+This module provides CellIndex, a persistent spatial index of the cells of one
+slide, so ROI questions ("which cells lie in this dorsal horn annotation")
+never scan a whole GeoJSON or stitched mask.
+
+MaskToGeoJSONConverter builds it at export time and writes <stem>_index.npz
+next to <stem>.geojson. It holds, per cell (= position in the GeoJSON's
+features): label, bounding box, centroid and the polygon (one packed vertex
+array plus offsets), and a uniform grid over the bounding boxes stored CSR-style
+(bin offsets + cell ids, bins in row-major order), so a query touches one
+contiguous slice of cell ids per grid row it covers.
+
+Coordinates are slide pixels, as in the GeoJSON. Queries (and the polygons they
+return) may instead use space="mask": stitched-mask / PNG pixels, i.e. slide
+pixels times the SCALING_FACTOR the GeoJSON was exported with.
+
+    index = CellIndex.load(GEOJSON_OUTS_DIR / "slide_index.npz")
+    ids, polygons = index.query_box(x0, y0, x1, y1)
+    ids, polygons = index.query_polygon(roi, predicate="centroid")
+"""
+
+# imports
+import json, logging, math
+from pathlib import Path
+from typing import List, Sequence, Tuple, Union
+import numpy as np, shapely
+
+INDEX_SUFFIX = "_index.npz"
+PREDICATES = ("intersects", "within", "centroid")
+MAX_BINS = 2 ** 24
+
+
+def index_path(geojson_path: Union[str, Path]) -> Path:
+    geojson_path = Path(geojson_path)
+    return geojson_path.with_name(geojson_path.stem + INDEX_SUFFIX)
+
+
+def _grid(bboxes: np.ndarray) -> dict:
+    """
+    Uniform grid over the bounding boxes: a bin is about four typical cells wide.
+    """
+    origin = bboxes[:, :2].min(axis=0)
+    extent = bboxes[:, 2:].max(axis=0) - origin
+    size = max(4.0 * float(np.median(np.maximum(bboxes[:, 2] - bboxes[:, 0], bboxes[:, 3] - bboxes[:, 1]))), 1.0)
+    size = max(size, math.sqrt(float(extent[0] + 1) * float(extent[1] + 1) / MAX_BINS))
+    nx, ny = int(extent[0] // size) + 1, int(extent[1] // size) + 1
+
+    # every (cell, bin) pair its bounding box touches, without a per-cell loop
+    b = ((bboxes - np.tile(origin, 2)) // size).astype(np.int64)
+    widths = b[:, 2] - b[:, 0] + 1
+    counts = widths * (b[:, 3] - b[:, 1] + 1)
+    cells = np.repeat(np.arange(len(bboxes)), counts)
+    k = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    bins = (np.repeat(b[:, 1], counts) + k // np.repeat(widths, counts)) * nx + np.repeat(b[:, 0], counts) + k % np.repeat(widths, counts)
+    order = np.argsort(bins, kind="stable")
+    offsets = np.zeros(nx * ny + 1, dtype=np.int64)
+    np.cumsum(np.bincount(bins, minlength=nx * ny), out=offsets[1:])
+    return {"grid_origin": origin.astype(np.float64), "grid_size": np.float64(size), "grid_shape": np.array([ny, nx]),
+            "bin_offsets": offsets, "bin_cells": cells[order].astype(np.int32)}
+
+
+class CellIndex:
+    """
+    Cells of one slide with a uniform-grid index over their bounding boxes.
+    """
+
+    def __init__(self, arrays: dict) -> None:
+        self.labels = arrays["labels"]
+        self.bboxes = arrays["bboxes"]  # x0, y0, x1, y1 per cell
+        self.centroids = arrays["centroids"]
+        self.coords = arrays["coords"]
+        self.coord_offsets = arrays["coord_offsets"]
+        self.scaling_factor = float(arrays["scaling_factor"])
+        self.grid_origin = arrays["grid_origin"]
+        self.grid_size = float(arrays["grid_size"])
+        self.ny, self.nx = (int(n) for n in arrays["grid_shape"])
+        self.bin_offsets = arrays["bin_offsets"]
+        self.bin_cells = arrays["bin_cells"]
+        self.logger = logging.getLogger(self.__class__.__name__)
+
+    def __len__(self) -> int:
+        return len(self.labels)
+
+    # build / persist
+    @classmethod
+    def build(cls, coords: np.ndarray, lengths: Sequence[int], labels: Sequence[int], scaling_factor: float) -> "CellIndex":
+        """
+        Index polygons given as one (N_vertices, 2) slide-pixel array, the vertex count of each
+        polygon and their labels; scaling_factor maps slide pixels to mask pixels.
+        """
+        coords = np.asarray(coords, dtype=np.float32).reshape(-1, 2)
+        lengths = np.asarray(lengths, dtype=np.int64)
+        offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        arrays = {"labels": np.asarray(labels, dtype=np.uint32), "coords": coords, "coord_offsets": offsets,
+                  "scaling_factor": np.float64(scaling_factor)}
+        if len(lengths):
+            starts = offsets[:-1]
+            arrays["bboxes"] = np.column_stack([np.minimum.reduceat(coords, starts), np.maximum.reduceat(coords, starts)])
+            shells = shapely.linearrings(coords, indices=np.repeat(np.arange(len(lengths)), lengths))
+            arrays["centroids"] = shapely.get_coordinates(shapely.centroid(shapely.polygons(shells))).astype(np.float32)
+            arrays.update(_grid(arrays["bboxes"]))
+        else:
+            arrays.update(bboxes=np.zeros((0, 4), np.float32), centroids=np.zeros((0, 2), np.float32),
+                          grid_origin=np.zeros(2), grid_size=np.float64(1), grid_shape=np.array([1, 1]),
+                          bin_offsets=np.zeros(2, np.int64), bin_cells=np.zeros(0, np.int32))
+        return cls(arrays)
+
+    @classmethod
+    def from_geojson(cls, geojson_path: Union[str, Path], scaling_factor: float) -> "CellIndex":
+        """
+        Index an existing Polygon GeoJSON (e.g. one exported before indexes were written).
+        """
+        with open(geojson_path) as f:
+            features = json.load(f).get("features", [])
+        if any(feature["geometry"]["type"] != "Polygon" for feature in features):
+            raise ValueError(f"{geojson_path}: only Polygon features can be indexed")
+        rings = [feature["geometry"]["coordinates"][0] for feature in features]
+        coords = [xy[:2] for ring in rings for xy in ring]
+        labels = [feature.get("properties", {}).get("label", 0) for feature in features]
+        return cls.build(coords, [len(ring) for ring in rings], labels, scaling_factor)
+
+    def save(self, path: Union[str, Path]) -> None:
+        np.savez(path, labels=self.labels, bboxes=self.bboxes, centroids=self.centroids, coords=self.coords,
+                 coord_offsets=self.coord_offsets, scaling_factor=np.float64(self.scaling_factor),
+                 grid_origin=self.grid_origin, grid_size=np.float64(self.grid_size), grid_shape=np.array([self.ny, self.nx]),
+                 bin_offsets=self.bin_offsets, bin_cells=self.bin_cells)
+
+    @classmethod
+    def load(cls, path: Union[str, Path]) -> "CellIndex":
+        with np.load(path) as data:
+            return cls({name: data[name] for name in data.files})
+
+    # queries
+    def _to_slide(self, space: str) -> float:
+        if space not in ("slide", "mask"):
+            raise ValueError(f"space must be 'slide' or 'mask', not {space!r}")
+        return 1.0 / self.scaling_factor if space == "mask" else 1.0
+
+    def _candidates(self, x0: float, y0: float, x1: float, y1: float) -> np.ndarray:
+        """
+        Cells whose bounding box overlaps the box (slide pixels).
+        """
+        if not len(self):
+            return np.zeros(0, dtype=np.int64)
+        ox, oy = self.grid_origin
+        bx0 = max(int((x0 - ox) // self.grid_size), 0)
+        by0 = max(int((y0 - oy) // self.grid_size), 0)
+        bx1 = min(int((x1 - ox) // self.grid_size), self.nx - 1)
+        by1 = min(int((y1 - oy) // self.grid_size), self.ny - 1)
+        if bx0 > bx1 or by0 > by1:
+            return np.zeros(0, dtype=np.int64)
+        rows = np.arange(by0, by1 + 1) * self.nx
+        # each grid row of the box is one contiguous run of bins, hence of bin_cells
+        cells = np.unique(np.concatenate([self.bin_cells[self.bin_offsets[r + bx0]:self.bin_offsets[r + bx1 + 1]] for r in rows]))
+        b = self.bboxes[cells]
+        return cells[(b[:, 0] <= x1) & (b[:, 2] >= x0) & (b[:, 1] <= y1) & (b[:, 3] >= y0)]
+
+    def polygons(self, ids: np.ndarray, space: str = "slide") -> List[np.ndarray]:
+        """
+        Polygon vertices ((n, 2) arrays) of the given cells.
+        """
+        scale = 1.0 / self._to_slide(space)
+        return [self.coords[self.coord_offsets[i]:self.coord_offsets[i + 1]] * scale for i in ids]
+
+    def _shapes(self, ids: np.ndarray) -> np.ndarray:
+        starts = self.coord_offsets[ids]
+        lengths = self.coord_offsets[ids + 1] - starts
+        firsts = np.cumsum(lengths) - lengths  # where each polygon starts in the gathered vertices
+        vertex = np.arange(lengths.sum()) + np.repeat(starts - firsts, lengths)
+        shells = shapely.linearrings(self.coords[vertex], indices=np.repeat(np.arange(len(ids)), lengths))
+        return shapely.polygons(shells)
+
+    def query_box(self, x0: float, y0: float, x1: float, y1: float, space: str = "slide") -> Tuple[np.ndarray, List[np.ndarray]]:
+        """
+        Cells whose bounding box overlaps the rectangle: (cell ids, polygons in the same space).
+        """
+        s = self._to_slide(space)
+        ids = self._candidates(x0 * s, y0 * s, x1 * s, y1 * s)
+        return ids, self.polygons(ids, space)
+
+    def query_polygon(self, region, space: str = "slide", predicate: str = "intersects") -> Tuple[np.ndarray, List[np.ndarray]]:
+        """
+        Cells in a region (Shapely geometry or (n, 2) vertices): intersecting it, lying within it,
+        or with their centroid inside it. Returns (cell ids, polygons in the same space).
+        """
+        if predicate not in PREDICATES:
+            raise ValueError(f"predicate must be one of {PREDICATES}, not {predicate!r}")
+        if not isinstance(region, shapely.Geometry):
+            region = shapely.Polygon(region)
+        s = self._to_slide(space)
+        if s != 1.0:
+            region = shapely.transform(region, lambda xy: xy * s)
+        ids = self._candidates(*region.bounds)
+        if len(ids):
+            shapely.prepare(region)
+            if predicate == "centroid":
+                keep = shapely.contains_xy(region, self.centroids[ids, 0], self.centroids[ids, 1])
+            elif predicate == "within":
+                keep = shapely.contains(region, self._shapes(ids))
+            else:
+                keep = shapely.intersects(region, self._shapes(ids))
+            ids = ids[keep]
+        return ids, self.polygons(ids, space)
@@ -12,6 +12,7 @@ import numpy as np, cv2, logging
 from PIL import Image
 # local imports
 from utils.constants import setup_logging
+from utils.generate_instrumentation import instrumented, stage_add
 Image.MAX_IMAGE_PIXELS = None
 
 
@@ -36,6 +37,7 @@ class ImageSplitter:
             self.logger.error(f"Failed to create output directory {self.output_dir}: {e}")
             raise
 
+    @instrumented
     def split_all(self) -> None:
         """
         Iterate over all PNG files in source_dir and split them.
@@ -51,6 +53,7 @@ class ImageSplitter:
             except Exception:
                 self.logger.exception(f"Error splitting file: {png_file}")
 
+    @instrumented
     def split_file(self, png_path: Path) -> None:
         """
         Split a single PNG image into sub-images.
@@ -66,6 +69,7 @@ class ImageSplitter:
         cols = (width + self.sub_w - 1) // self.sub_w
         rows = (height + self.sub_h - 1) // self.sub_h
 
+        stage_add("ImageSplitter.split_file", images=1, tiles=rows * cols, bytes=img.nbytes)
         for row in range(rows):
             for col in range(cols):
                 x0 = col * self.sub_w
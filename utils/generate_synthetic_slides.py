@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+"""
+Developed by Nikhil Nageshwar Inturi
+
+This module generates synthetic slides for benchmarking the pipeline without
+the real (multi-GB, private) Xenium slides:
+
+    <out_dir>/tifs/<stem>.tif              RGB slide with blob-like "cells"
+    <out_dir>/masks/<stem>_masks.tif       matching uint32 label mask
+    <out_dir>/geojsons/<stem>.geojson      matching cell polygons (QuPath style)
+
+Cells are random ellipses: each is drawn from its polygon, so the label mask
+and the GeoJSON describe exactly the same cells. Everything is seeded, so the
+same configuration always produces the same slide.
+
+StubCellposeModel stands in for the Cellpose model on CPU (threshold + connected
+components) with the same eval() interface, so detection can be benchmarked
+without torch, a GPU or model weights.
+"""
+
+# imports
+import json, logging
+from pathlib import Path
+from typing import Dict, List, Tuple, Union
+import numpy as np, cv2, tifffile
+from scipy import ndimage
+
+logger = logging.getLogger(__name__)
+
+BACKGROUND_RGB = (40, 20, 60)
+CELL_RGB = (120, 200, 230)
+
+
+def ellipse_polygons(height: int, width: int, n_cells: int, radius_range: Tuple[int, int] = (6, 14),
+                     seed: int = 0, n_vertices: int = 24) -> List[np.ndarray]:
+    """
+    n_cells random ellipses inside the slide as (n_vertices, 2) int32 (x, y) arrays.
+    """
+    rng = np.random.default_rng(seed)
+    r_min, r_max = radius_range
+    centers = rng.uniform((r_max, r_max), (width - r_max, height - r_max), size=(n_cells, 2))
+    radii = rng.uniform(r_min, r_max, size=(n_cells, 2))
+    angles = rng.uniform(0, np.pi, size=n_cells)
+    # slightly wobbly outlines so contours are not perfectly regular
+    t = np.linspace(0, 2 * np.pi, n_vertices, endpoint=False)
+    wobble = 1 + 0.1 * rng.standard_normal((n_cells, n_vertices))
+    polygons = []
+    for (cx, cy), (rx, ry), a, w in zip(centers, radii, angles, wobble):
+        x, y = rx * w * np.cos(t), ry * w * np.sin(t)
+        xs = cx + x * np.cos(a) - y * np.sin(a)
+        ys = cy + x * np.sin(a) + y * np.cos(a)
+        polygons.append(np.stack([xs, ys], axis=1).round().astype(np.int32))
+    return polygons
+
+
+def rasterize_polygons(polygons: List[np.ndarray], height: int, width: int) -> np.ndarray:
+    """
+    uint32 label mask with polygon i drawn as label i + 1 (later cells overlap earlier ones).
+    """
+    labels = np.zeros((height, width), dtype=np.int32)  # cv2 draws into int32, not uint32
+    for i, poly in enumerate(polygons, start=1):
+        cv2.fillPoly(labels, [poly], i)
+    return labels.astype(np.uint32)
+
+
+def render_image(labels: np.ndarray, seed: int = 0, noise: float = 12.0, chunk_rows: int = 2048) -> np.ndarray:
+    """
+    uint8 RGB image of the label mask: textured bright cells on a noisy background.
+    """
+    rng = np.random.default_rng(seed + 1)
+    n = int(labels.max())
+    # per-cell brightness so cells are not all alike
+    gain = np.concatenate([[0.0], rng.uniform(0.6, 1.0, n)]).astype(np.float32)
+    background = np.array(BACKGROUND_RGB, dtype=np.float32)
+    cell = np.array(CELL_RGB, dtype=np.float32) - background
+    img = np.empty(labels.shape + (3,), dtype=np.uint8)
+    for y0 in range(0, labels.shape[0], chunk_rows):
+        band = labels[y0:y0 + chunk_rows]
+        value = background + gain[band][..., None] * cell
+        value += rng.normal(0, noise, value.shape).astype(np.float32)
+        np.clip(value, 0, 255, out=value)
+        img[y0:y0 + chunk_rows] = value
+    return img
+
+
+def polygons_to_geojson(polygons: List[np.ndarray], scale: float = 1.0) -> dict:
+    """
+    FeatureCollection in the format written by MaskToGeoJSONConverter.
+    """
+    features = []
+    for i, poly in enumerate(polygons, start=1):
+        coords = (poly * scale).astype(int).tolist()
+        coords.append(coords[0])
+        features.append({
+            "type": "Feature",
+            "geometry": {"type": "Polygon", "coordinates": [coords]},
+            "properties": {"label": i},
+        })
+    return {"type": "FeatureCollection", "features": features}
+
+
+def write_synthetic_slide(out_dir: Union[str, Path], stem: str = "synthetic", height: int = 4096, width: int = 4096,
+                          n_cells: int = 2000, radius_range: Tuple[int, int] = (6, 14), seed: int = 0,
+                          tile: int = 512, compression: str = None) -> Dict[str, Path]:
+    """
+    Write one synthetic slide (TIFF), its label mask and GeoJSON under out_dir.
+    Returns {"tif": ..., "mask": ..., "geojson": ...}.
+    """
+    out_dir = Path(out_dir)
+    paths = {"tif": out_dir / "tifs" / f"{stem}.tif",
+             "mask": out_dir / "masks" / f"{stem}_masks.tif",
+             "geojson": out_dir / "geojsons" / f"{stem}.geojson"}
+    for path in paths.values():
+        path.parent.mkdir(parents=True, exist_ok=True)
+
+    polygons = ellipse_polygons(height, width, n_cells, radius_range, seed)
+    labels = rasterize_polygons(polygons, height, width)
+    img = render_image(labels, seed)
+    tifffile.imwrite(paths["tif"], img, photometric="rgb", tile=(tile, tile), compression=compression)
+    tifffile.imwrite(paths["mask"], labels, photometric="minisblack", tile=(tile, tile), compression="zlib")
+    paths["geojson"].write_text(json.dumps(polygons_to_geojson(polygons)))
+    logger.info(f"Wrote synthetic slide '{stem}' ({height}x{width}, {n_cells} cells) to {out_dir}")
+    return paths
+
+
+class StubCellposeModel:
+    """
+    CPU stand-in for models.CellposeModel: smooth, threshold against the tile's
+    own intensity statistics, label connected components. Accepts (and ignores)
+    the Cellpose eval keyword arguments.
+    """
+
+    def __init__(self, sigma: float = 1.0, min_size: int = 4) -> None:
+        self.sigma = sigma
+        self.min_size = min_size
+
+    def eval(self, x, **kwargs):
+        imgs = x if isinstance(x, list) else [x]
+        masks = [self._segment(np.asarray(img)) for img in imgs]
+        flows = [[None, None, None] for _ in imgs]
+        return masks, flows, None
+
+    def _segment(self, img: np.ndarray) -> np.ndarray:
+        gray = img.mean(axis=-1) if img.ndim == 3 else img.astype(np.float32)
+        smooth = ndimage.gaussian_filter(gray.astype(np.float32), self.sigma)
+        labels, n = ndimage.label(smooth > smooth.mean() + 0.5 * smooth.std())
+        if n and self.min_size > 1:
+            sizes = np.bincount(labels.ravel())
+            keep = sizes >= self.min_size
+            keep[0] = False
+            relabel = np.zeros(n + 1, dtype=np.int32)
+            relabel[keep] = np.arange(1, keep.sum() + 1)
+            labels = relabel[labels]
+        return labels.astype(np.int32)
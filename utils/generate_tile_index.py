@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""
+Developed by Nikhil Nageshwar Inturi
+
+Per-tile index of the training tiles written by split_folder, and a sampler
+built on it.
+
+While tiling, every (image, mask) tile gets one row in OUT_DIR/tile_index.csv:
+cell count, labelled-pixel fraction and intensity stats of the written image.
+tile_sampling_probs turns the index into per-tile sampling probabilities that
+drop tiles without cells and give equal weight to sparse and dense regions, in
+the form train.train_seg takes as train_probs.
+"""
+
+# imports
+import logging
+from pathlib import Path
+from typing import List, Union
+import numpy as np, pandas as pd
+
+TILE_INDEX_NAME = "tile_index.csv"
+
+logger = logging.getLogger(__name__)
+
+
+def tile_record(img_name: str, msk_name: str, slide: str, row: int, col: int,
+                img_tile: np.ndarray, msk_tile: np.ndarray, written: bool = True) -> dict:
+    """
+    Index row for one tile. img_tile is the (uint8) image as written.
+    """
+    counts = np.bincount(np.asarray(msk_tile).ravel())
+    return {
+        "image": img_name,
+        "mask": msk_name,
+        "slide": slide,
+        "row": row,
+        "col": col,
+        "n_cells": int(np.count_nonzero(counts[1:])),
+        "fg_fraction": float(1.0 - counts[0] / msk_tile.size) if len(counts) else 0.0,
+        "mean_intensity": float(img_tile.mean()),
+        "std_intensity": float(img_tile.std()),
+        "max_intensity": float(img_tile.max()),
+        "written": written,
+    }
+
+
+def write_tile_index(records: List[dict], out_dir: Union[str, Path]) -> Path:
+    """
+    Write (or update) OUT_DIR/tile_index.csv; rows of re-written tiles replace the old ones.
+    """
+    index_path = Path(out_dir) / TILE_INDEX_NAME
+    index = pd.DataFrame.from_records(records)
+    if index_path.exists():
+        old = pd.read_csv(index_path)
+        index = pd.concat([old[~old["image"].isin(index["image"])], index], ignore_index=True)
+    index.to_csv(index_path, index=False)
+    logger.info(f"tile index: {len(records)} tiles, {int((index['n_cells'] == 0).sum())} without cells → {index_path}")
+    return index_path
+
+
+def load_tile_index(out_dir: Union[str, Path]) -> pd.DataFrame:
+    index_path = Path(out_dir) / TILE_INDEX_NAME
+    if not index_path.exists():
+        raise FileNotFoundError(f"no tile index at {index_path}, run split_folder first")
+    return pd.read_csv(index_path)
+
+
+def tile_sampling_probs(index: pd.DataFrame, min_cells: int = 1, n_strata: int = 4) -> pd.Series:
+    """
+    Sampling probability per tile (indexed by image name).
+
+    Tiles with fewer than min_cells cells, or not written, get 0. The rest are split
+    into n_strata cell-count quantile bins and every bin gets the same total weight,
+    so a few dense regions do not dominate the epoch, nor many near-empty ones.
+    """
+    keep = (index["n_cells"] >= min_cells) & index["written"].astype(bool)
+    probs = pd.Series(0.0, index=index["image"].values)
+    if not keep.any():
+        return probs
+    cells = index.loc[keep, "n_cells"]
+    strata = pd.qcut(cells.rank(method="first"), q=min(n_strata, len(cells)), labels=False)
+    weights = 1.0 / strata.map(strata.value_counts())
+    probs[index.loc[keep, "image"].values] = (weights / weights.sum()).values
+    return probs
@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+"""
+Developed by Nikhil Nageshwar Inturi
+
+This module provides TilePyramidGenerator, which writes mask overlays as a
+Deep Zoom (DZI) tile pyramid instead of one giant PNG per slide:
+
+    <output_dir>/<stem>.dzi
+    <output_dir>/<stem>_files/<level>/<col>_<row>.png
+
+The full-resolution level is rendered tile by tile from the image and the label
+mask (per-cell boundaries from utils.generate_boundaries); every lower level is
+built from the 2x2 child tiles of the level above. Tiles without tissue or
+cells are not written, and a region can be re-rendered after edits without
+touching the rest of the pyramid.
+"""
+
+# imports
+import logging, math
+import xml.etree.ElementTree as ET
+from pathlib import Path
+from typing import Optional, Tuple, Union
+import numpy as np
+from PIL import Image
+# local imports
+from utils.generate_boundaries import window_boundaries
+from utils.generate_plots import blend_color
+Image.MAX_IMAGE_PIXELS = None
+
+DZI_NAMESPACE = "http://schemas.microsoft.com/deepzoom/2008"
+
+
+def pyramid_levels(width: int, height: int) -> list[Tuple[int, int]]:
+    """
+    (width, height) of every DZI level, from level 0 (1x1) to the full-resolution level.
+    """
+    max_level = max(math.ceil(math.log2(max(width, height, 1))), 0)
+    dims = []
+    for level in range(max_level + 1):
+        scale = 2 ** (max_level - level)
+        dims.append(((width + scale - 1) // scale, (height + scale - 1) // scale))
+    return dims
+
+
+def read_pyramid_view(dzi_path: Union[str, Path], max_size: int = 2048) -> Image.Image:
+    """
+    Assemble the deepest pyramid level whose larger side fits in max_size,
+    reading only that level's tiles. Missing (empty) tiles stay black.
+    """
+    dzi_path = Path(dzi_path)
+    root = ET.parse(dzi_path).getroot()
+    tile_size = int(root.get("TileSize"))
+    fmt = root.get("Format")
+    size = root.find(f"{{{DZI_NAMESPACE}}}Size")
+    dims = pyramid_levels(int(size.get("Width")), int(size.get("Height")))
+
+    level = max(lv for lv, (w, h) in enumerate(dims) if max(w, h) <= max_size or lv == 0)
+    width, height = dims[level]
+    view = Image.new("RGB", (width, height))
+    level_dir = dzi_path.with_name(f"{dzi_path.stem}_files") / str(level)
+    for tile_path in level_dir.glob(f"*.{fmt}"):
+        col, row = (int(v) for v in tile_path.stem.split("_"))
+        with Image.open(tile_path) as tile:
+            view.paste(tile.convert("RGB"), (col * tile_size, row * tile_size))
+    return view
+
+
+class TilePyramidGenerator:
+    """
+    Render image/mask overlays (same colours as PlotGenerator) into a DZI tile pyramid.
+    """
+
+    def __init__(
+        self,
+        image_dir: Path,
+        mask_dir: Path,
+        output_dir: Path,
+        overlay_color: tuple[int,int,int] = (238,144,144),
+        boundary_color: tuple[int,int,int] = (100,100,255),
+        alpha: float = 0.5,
+        tile_size: int = 512,
+        tile_format: str = "png",
+        tissue_threshold: int = 10,
+        min_tissue_fraction: float = 0.01,
+        compress_level: int = 1
+    ) -> None:
+        self.image_dir = Path(image_dir)
+        self.mask_dir = Path(mask_dir)
+        self.output_dir = Path(output_dir)
+        self.overlay_color = np.array(overlay_color, dtype=np.uint8)
+        self.boundary_color = np.array(boundary_color, dtype=np.uint8)
+        self.alpha = alpha
+        self.tile_size = tile_size
+        self.tile_format = tile_format
+        self.tissue_threshold = tissue_threshold
+        self.min_tissue_fraction = min_tissue_fraction
+        self.compress_level = compress_level
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+
+    def run(self) -> None:
+        mask_paths = list(self.mask_dir.glob("*.npy"))
+        if not mask_paths:
+            self.logger.warning(f"No .npy masks found in {self.mask_dir}")
+            return
+
+        for mask_path in mask_paths:
+            stem = mask_path.stem
+            img_candidates = list(self.image_dir.glob(f"{stem}*.png"))
+            if not img_candidates:
+                self.logger.warning(f"No image found for mask '{stem}'")
+                continue
+            image = np.array(Image.open(img_candidates[0]).convert("RGB"))
+            self.build(stem, image, np.load(mask_path, mmap_mode="r"))
+
+    def build(self, stem: str, image: np.ndarray, mask: np.ndarray,
+              region: Optional[Tuple[int, int, int, int]] = None) -> Path:
+        """
+        Write (or update) the pyramid for one slide.
+
+        Args:
+            stem: Output name; tiles go to <stem>_files next to <stem>.dzi.
+            image: (H, W, 3) uint8 image.
+            mask: (H, W) label mask at the same resolution (may be memory-mapped).
+            region: Optional (x0, y0, x1, y1) in full-resolution pixels; only tiles
+                intersecting it are re-rendered on every level.
+        """
+        height, width = mask.shape[:2]
+        if image.shape[:2] != (height, width):
+            raise ValueError(f"Image {image.shape[:2]} and mask {(height, width)} sizes differ for '{stem}'")
+        dims = pyramid_levels(width, height)
+        max_level = len(dims) - 1
+        tiles_dir = self.output_dir / f"{stem}_files"
+        x0, y0, x1, y1 = region if region is not None else (0, 0, width, height)
+
+        written = 0
+        for level in range(max_level, -1, -1):
+            level_dir = tiles_dir / str(level)
+            level_dir.mkdir(parents=True, exist_ok=True)
+            scale = 2 ** (max_level - level)
+            lw, lh = dims[level]
+            cols = range((x0 // scale) // self.tile_size, (max(x1 - 1, x0) // scale) // self.tile_size + 1)
+            rows = range((y0 // scale) // self.tile_size, (max(y1 - 1, y0) // scale) // self.tile_size + 1)
+            for row in rows:
+                for col in cols:
+                    tx0, ty0 = col * self.tile_size, row * self.tile_size
+                    tx1, ty1 = min(tx0 + self.tile_size, lw), min(ty0 + self.tile_size, lh)
+                    if level == max_level:
+                        tile = self._render_tile(image, mask, tx0, ty0, tx1, ty1)
+                    else:
+                        cw, ch = dims[level + 1]
+                        child_span = (min(2 * tx1, cw) - 2 * tx0, min(2 * ty1, ch) - 2 * ty0)
+                        tile = self._reduce_children(tiles_dir / str(level + 1), col, row, child_span)
+                    written += self._write_tile(level_dir / f"{col}_{row}.{self.tile_format}", tile)
+
+        dzi_path = self.output_dir / f"{stem}.dzi"
+        self._write_dzi(dzi_path, width, height)
+        self.logger.info(f"Wrote {written} pyramid tiles for '{stem}' → {dzi_path.name}")
+        return dzi_path
+
+    def _has_tissue(self, tile: np.ndarray) -> bool:
+        bright = np.count_nonzero(tile.max(axis=2) > self.tissue_threshold)
+        return bright >= self.min_tissue_fraction * tile.shape[0] * tile.shape[1]
+
+    def _render_tile(self, image: np.ndarray, mask: np.ndarray, x0: int, y0: int, x1: int, y1: int):
+        labels, boundary = window_boundaries(mask, y0, y1, x0, x1)
+        tile = np.array(image[y0:y1, x0:x1])
+        cells = labels > 0
+        if not cells.any() and not self._has_tissue(tile):
+            return None
+
+        blend_color(tile, cells, self.overlay_color, self.alpha)
+        tile[boundary] = self.boundary_color
+        return tile
+
+    def _reduce_children(self, child_dir: Path, col: int, row: int, child_span: Tuple[int, int]):
+        canvas, found = None, False
+        for dy in (0, 1):
+            for dx in (0, 1):
+                child_path = child_dir / f"{2 * col + dx}_{2 * row + dy}.{self.tile_format}"
+                if not child_path.exists():
+                    continue
+                if canvas is None:
+                    canvas = Image.new("RGB", child_span)
+                with Image.open(child_path) as child:
+                    canvas.paste(child.convert("RGB"), (dx * self.tile_size, dy * self.tile_size))
+                found = True
+        if not found:
+            return None
+        return np.asarray(canvas.reduce(2))
+
+    def _write_tile(self, tile_path: Path, tile) -> int:
+        if tile is None:
+            tile_path.unlink(missing_ok=True)  # region became empty after an edit
+            return 0
+        Image.fromarray(tile).save(tile_path, compress_level=self.compress_level)
+        return 1
+
+    def _write_dzi(self, dzi_path: Path, width: int, height: int) -> None:
+        dzi_path.write_text(
+            '<?xml version="1.0" encoding="UTF-8"?>\n'
+            f'<Image xmlns="{DZI_NAMESPACE}" Format="{self.tile_format}" Overlap="0" TileSize="{self.tile_size}">\n'
+            f'  <Size Width="{width}" Height="{height}"/>\n'
+            '</Image>\n'
+        )
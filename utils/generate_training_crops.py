@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+"""
+Developed by Nikhil Nageshwar Inturi
+
+This module provides RandomCropDataset, a lazy alternative to writing every
+training tile to disk with split_folder: random crops are read on demand from
+the original slide TIFFs and their label masks (or rasterized straight from the
+GeoJSON annotations), so only the pixels of each crop are ever loaded.
+
+Slides are memory-mapped when stored uncompressed; compressed/tiled TIFFs are
+read region by region through tifffile's Zarr store when zarr is installed and
+loaded whole (with a warning) otherwise.
+"""
+
+# imports
+import logging
+from pathlib import Path
+from typing import Optional, Tuple, Union
+import numpy as np, tifffile
+
+
+class SlideReader:
+    """
+    Region reader over a (H, W) or (H, W, C) / (C, H, W) TIFF that never loads more than it must.
+    """
+
+    def __init__(self, path: Path) -> None:
+        self.path = Path(path)
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.array = self._open(self.path)
+        # (C,H,W) → (H,W,C) if few channels, same rule as read_tif
+        self.channels_first = self.array.ndim == 3 and self.array.shape[0] <= 4
+        shape = self.array.shape[1:] if self.channels_first else self.array.shape[:2]
+        self.height, self.width = int(shape[0]), int(shape[1])
+
+    def _open(self, path: Path):
+        try:
+            return tifffile.memmap(path, mode="r")
+        except ValueError:
+            pass  # compressed or tiled
+        try:
+            import zarr
+            return zarr.open(tifffile.imread(path, aszarr=True, series=0, level=0), mode="r")
+        except ImportError:
+            self.logger.warning(f"{path.name} cannot be memory-mapped and zarr is not installed; loading it into RAM")
+            return tifffile.imread(path)
+
+    def read(self, y0: int, x0: int, h: int, w: int) -> np.ndarray:
+        if self.channels_first:
+            return np.transpose(np.asarray(self.array[:, y0:y0 + h, x0:x0 + w]), (1, 2, 0))
+        return np.asarray(self.array[y0:y0 + h, x0:x0 + w])
+
+
+class RandomCropDataset:
+    """
+    Sample random (image, mask) crops from whole slides.
+
+    Pairs every <stem>.tif in img_dir with <stem>_masks.tif in mask_dir, or with
+    <stem>.geojson in geojson_dir when given. Slides are picked proportionally to
+    their area. Crops without any labelled pixel are kept only with probability
+    empty_keep_prob (after max_tries redraws the last crop is returned anyway).
+    """
+
+    def __init__(self, img_dir: Union[str, Path], mask_dir: Union[str, Path] = None, crop_h: int = 1024,
+                 crop_w: int = 1024, empty_keep_prob: float = 0.1, max_tries: int = 10,
+                 geojson_dir: Union[str, Path] = None, seed: Optional[int] = None) -> None:
+        self.crop_h, self.crop_w = crop_h, crop_w
+        self.empty_keep_prob = empty_keep_prob
+        self.max_tries = max_tries
+        self.rng = np.random.default_rng(seed)
+        self.logger = logging.getLogger(self.__class__.__name__)
+
+        if geojson_dir is not None:
+            # geopandas/rasterio: only loaded for GeoJSON labels (SlideReader is also used for inference)
+            from utils.generate_training_dataset import PolygonRasterizer
+        self.slides = []
+        for img_path in sorted(Path(img_dir).glob("*.tif")):
+            if img_path.name.endswith("_masks.tif"):
+                continue
+            if geojson_dir is not None:
+                label_path = Path(geojson_dir) / f"{img_path.stem}.geojson"
+            else:
+                label_path = Path(mask_dir) / f"{img_path.stem}_masks.tif"
+            if not label_path.exists():
+                self.logger.warning(f"no labels found for {img_path.name}, skipping")
+                continue
+            image = SlideReader(img_path)
+            labels = PolygonRasterizer(img_path, label_path) if geojson_dir is not None else SlideReader(label_path)
+            if (labels.height, labels.width) != (image.height, image.width):
+                raise ValueError(f"Dimension mismatch {img_path.name} vs {label_path.name}")
+            self.slides.append((image, labels))
+        if not self.slides:
+            raise FileNotFoundError(f"no image/label pairs found in {img_dir}")
+
+        areas = np.array([image.height * image.width for image, _ in self.slides], dtype=float)
+        self.slide_probs = areas / areas.sum()
+        self.logger.info(f"RandomCropDataset over {len(self.slides)} slides")
+
+    def __len__(self) -> int:
+        return len(self.slides)
+
+    def _crop(self, slide_idx: int, y0: int, x0: int) -> Tuple[np.ndarray, np.ndarray]:
+        image, labels = self.slides[slide_idx]
+        img = image.read(y0, x0, self.crop_h, self.crop_w)
+        if not isinstance(labels, SlideReader):  # PolygonRasterizer
+            mask = labels.tile(y0, x0, self.crop_h, self.crop_w)[:img.shape[0], :img.shape[1]]
+        else:
+            mask = labels.read(y0, x0, self.crop_h, self.crop_w).astype(np.uint16)
+        return img, mask
+
+    def sample(self) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Draw one (image, mask) crop. Crops are clipped, not padded, at slide edges.
+        """
+        for _ in range(self.max_tries):
+            slide_idx = self.rng.choice(len(self.slides), p=self.slide_probs)
+            image, _ = self.slides[slide_idx]
+            y0 = int(self.rng.integers(0, max(image.height - self.crop_h, 0) + 1))
+            x0 = int(self.rng.integers(0, max(image.width - self.crop_w, 0) + 1))
+            img, mask = self._crop(slide_idx, y0, x0)
+            if mask.any() or self.rng.random() < self.empty_keep_prob:
+                return img, mask
+        return img, mask
+
+    def batch(self, n: int) -> Tuple[list, list]:
+        crops = [self.sample() for _ in range(n)]
+        return [img for img, _ in crops], [mask for _, mask in crops]
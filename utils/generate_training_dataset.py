@@ -1,64 +1,142 @@
 """
-Create a uint16 mask PNG from a GeoJSON file and write two down‑sampled
-previews (black‑and‑white and random‑colour) for easy visual inspection.
+Create a uint16 mask PNG from a GeoJSON file (or rasterize it straight into
+training tiles) and write two down‑sampled previews (black‑and‑white and
+random‑colour) for easy visual inspection; see utils.generate_mask_previews
+for previews built while the mask is rasterized.
 """
 
 from pathlib import Path
-import warnings, numpy as np, geopandas as gpd, rasterio, cv2
+import warnings, numpy as np, geopandas as gpd, rasterio, cv2, shapely
 from shapely.geometry import Polygon, MultiPolygon
 from PIL import Image
+import tifffile
 from tifffile import imread
 from utils.constants import *
+from utils.generate_mask_previews import MaskPreviewer, preview_lut
 Image.MAX_IMAGE_PIXELS = None
 warnings.filterwarnings("ignore", category=Image.DecompressionBombWarning)
 
-def geojson_to_mask_png(image_path: Path, geojson_path: Path, mask_out: Path) -> None:
+class PolygonRasterizer:
     """
-    Rasterize GeoJSON polygons into a uint16 label mask PNG.
+    Burn the polygons of a GeoJSON file into uint16 labels on the pixel grid of an image.
+
+    All vertices are mapped to pixel coordinates with one batched affine transform and
+    rounded the same way the per-point world_to_px conversion did, so labels are
+    identical to the original rasterization. Labels are the 1-based feature index.
     """
-    with rasterio.open(image_path) as src:
-        transform = src.transform
-        height, width = src.height, src.width
-        crs = src.crs
-
-    mask = np.zeros((height, width), dtype=np.uint16)
-    gdf = gpd.read_file(geojson_path)
-
-    if crs is not None and gdf.crs is not None and gdf.crs != crs:
-        gdf = gdf.to_crs(crs)
-
-    def world_to_px(tx, x, y):
-        c, r = ~tx * (x, y)
-        return int(round(c)), int(round(r))
-
-    for idx, geom in enumerate(gdf.geometry, start=1):
-        polys = geom.geoms if isinstance(geom, MultiPolygon) else [geom]
-        for poly in polys:
-            pts = np.array(
-                [world_to_px(transform, x, y) for x, y in poly.exterior.coords],
-                dtype=np.int32
-            )
-            cv2.fillPoly(mask, [pts], color=idx)
 
+    def __init__(self, image_path: Path, geojson_path: Path) -> None:
+        with rasterio.open(image_path) as src:
+            transform = src.transform
+            self.height, self.width = src.height, src.width
+            crs = src.crs
+
+        if crs is None:
+            # nothing to reproject against: use the fast polygon loader
+            from utils.generate_metrics import load_geojson_polygons
+            geoms = load_geojson_polygons(geojson_path)
+        else:
+            gdf = gpd.read_file(geojson_path)
+            if gdf.crs is not None and gdf.crs != crs:
+                gdf = gdf.to_crs(crs)
+            geoms = np.asarray(gdf.geometry, dtype=object)
+
+        # one exterior ring per polygon part; multipolygon parts keep their feature's label
+        parts, feature_idx = shapely.get_parts(geoms, return_index=True)
+        coords, ring_idx = shapely.get_coordinates(shapely.get_exterior_ring(parts), return_index=True)
+        inv = ~transform
+        x, y = coords[:, 0], coords[:, 1]
+        cols = np.rint(x * inv.a + y * inv.b + inv.c).astype(np.int32)
+        rows = np.rint(x * inv.d + y * inv.e + inv.f).astype(np.int32)
+
+        pts = np.stack([cols, rows], axis=1)
+        lengths = np.bincount(ring_idx, minlength=len(parts))
+        starts = np.cumsum(lengths) - lengths
+        keep = lengths > 0
+        self.rings = [r for r, k in zip(np.split(pts, starts[1:]), keep) if k]
+        self.labels = (feature_idx[keep] + 1).tolist()
+        # per-ring bounding boxes, used to pick the rings that touch a tile
+        starts = starts[keep]
+        self.x_min, self.x_max = np.minimum.reduceat(cols, starts), np.maximum.reduceat(cols, starts)
+        self.y_min, self.y_max = np.minimum.reduceat(rows, starts), np.maximum.reduceat(rows, starts)
+
+    def full_mask(self) -> np.ndarray:
+        """
+        Rasterize every polygon onto a full-resolution canvas.
+        """
+        mask = np.zeros((self.height, self.width), dtype=np.uint16)
+        for pts, label in zip(self.rings, self.labels):
+            cv2.fillPoly(mask, [pts], color=label)
+        return mask
+
+    def tile(self, y0: int, x0: int, tile_h: int, tile_w: int) -> np.ndarray:
+        """
+        Rasterize only the polygons touching the tile at (y0, x0). The result equals
+        mask[y0:y0+tile_h, x0:x0+tile_w] zero-padded to (tile_h, tile_w), without ever
+        allocating the full canvas.
+        """
+        tile = np.zeros((tile_h, tile_w), dtype=np.uint16)
+        hit = np.flatnonzero((self.x_max >= x0) & (self.x_min < x0 + tile_w) &
+                             (self.y_max >= y0) & (self.y_min < y0 + tile_h))
+        if len(hit) == 0:
+            return tile
+
+        # fillPoly clips polygons at the canvas edge differently from an unclipped fill, so
+        # draw on a canvas that holds every touching polygon whole and is clipped only where
+        # the full-size canvas would be (the image border)
+        cy0 = max(min(y0, int(self.y_min[hit].min())), 0)
+        cx0 = max(min(x0, int(self.x_min[hit].min())), 0)
+        cy1 = min(max(y0 + tile_h, int(self.y_max[hit].max()) + 1), self.height)
+        cx1 = min(max(x0 + tile_w, int(self.x_max[hit].max()) + 1), self.width)
+        canvas = np.zeros((cy1 - cy0, cx1 - cx0), dtype=np.uint16)
+        offset = np.array([cx0, cy0], dtype=np.int32)
+        for i in hit:  # keep feature order so overlaps resolve as on the full canvas
+            cv2.fillPoly(canvas, [self.rings[i] - offset], color=self.labels[i])
+
+        crop = canvas[y0 - cy0:y0 - cy0 + tile_h, x0 - cx0:x0 - cx0 + tile_w]
+        tile[:crop.shape[0], :crop.shape[1]] = crop
+        return tile
+
+
+def geojson_to_mask_png(image_path: Path, geojson_path: Path, mask_out: Path) -> np.ndarray:
+    """
+    Rasterize GeoJSON polygons into a uint16 label mask PNG.
+    Returns the mask so callers do not have to read it back from disk.
+    """
+    mask = PolygonRasterizer(image_path, geojson_path).full_mask()
     cv2.imwrite(str(mask_out), mask)
+    return mask
+
+
+def geojson_to_mask_tif(image_path: Path, geojson_path: Path, mask_out: Path, preview_downsamples=(8,),
+                        band_rows: int = 1024) -> MaskPreviewer:
+    """
+    Rasterize GeoJSON polygons into a uint16 label mask TIFF in row bands, written
+    through a memory map and sampled for the previews band by band, so the
+    full-resolution mask is never held in memory. Returns the filled MaskPreviewer.
+    """
+    rasterizer = PolygonRasterizer(image_path, geojson_path)
+    h, w = rasterizer.height, rasterizer.width
+    previewer = MaskPreviewer(h, w, downsamples=preview_downsamples)
+    mask = tifffile.memmap(str(mask_out), shape=(h, w), dtype=np.uint16)
+    for y0 in range(0, h, band_rows):
+        band = rasterizer.tile(y0, 0, band_rows, w)
+        mask[y0:y0 + band_rows] = band[:h - y0]
+        previewer.add(y0, 0, band)
+    mask.flush()
+    del mask
+    return previewer
 
 
 def make_bw_preview(label_mask: np.ndarray, out_png: Path, downsample: int = 8):
-    preview = (label_mask > 0).astype(np.uint8) * 255
-    if downsample > 1:
-        preview = preview[::downsample, ::downsample]
+    # subsample first: only the preview-sized grid is ever compared/allocated
+    preview = (label_mask[::downsample, ::downsample] > 0).astype(np.uint8) * 255
     Image.fromarray(preview, mode="L").save(out_png)
     print(f"saved B/W preview → {out_png}")
 
 
 def make_colored_preview(label_mask: np.ndarray, out_png: Path, downsample: int = 8):
-    rng = np.random.default_rng(42)
-    lut = np.vstack(
-        [np.zeros((1, 3), np.uint8),
-         rng.integers(0, 256, size=(label_mask.max(), 3), dtype=np.uint8)]
-    )
-    rgb = lut[label_mask]
-    if downsample > 1:
-        rgb = rgb[::downsample, ::downsample]
+    lut = preview_lut(int(label_mask.max()))
+    rgb = lut[label_mask[::downsample, ::downsample]]
     Image.fromarray(rgb, mode="RGB").save(out_png)
-    print(f"saved colour preview → {out_png}")
\ No newline at end of file
+    print(f"saved colour preview → {out_png}")
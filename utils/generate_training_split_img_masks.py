@@ -3,6 +3,19 @@
 Split every TIFF in IMG_DIR and its matching mask in MASK_DIR into 640×640 or 1024x1024 tiles.
 Image tiles are saved as 8‑bit TIFFs: mask tiles are saved
 as 16‑bit TIFFs with “_mask” suffix so Cellpose can pair them automatically.
+Masks can also be rasterized per tile straight from the GeoJSON annotations
+(geojson_dir), so the full-resolution mask is never materialized.
+With compute_flows=True the Cellpose flow targets of every mask tile are
+precomputed in worker processes while tiling runs and stored in
+OUT_DIR/_flows (see utils.generate_flow_cache).
+Non-uint8 images are scaled to uint8 with slide-level percentile bounds
+(utils.generate_slide_norm) unless normalize="tile" asks for the old per-tile
+min-max scaling.
+Every tile is also recorded in OUT_DIR/tile_index.csv (cell count, foreground
+fraction, intensity stats; see utils.generate_tile_index); with skip_empty=True
+tiles without any labelled pixel are indexed but not written.
+With preview_dir set, mask previews are sampled from the tiles as they are
+made (utils.generate_mask_previews).
 
 Result:
     OUT_DIR/
@@ -17,8 +30,14 @@ Author : Nikhil Nageshwar Inturi  (modified to handle separate img/mask dir
 
 # imports
 from pathlib import Path
-import logging, numpy as np, tifffile, cv2
+import logging, multiprocessing, os, numpy as np, tifffile, cv2
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
 from utils.constants import setup_logging
+from utils.generate_slide_norm import SlideNormalizer
+from utils.generate_flow_cache import FLOW_CACHE_DIR, cache_flows, flow_path, mask_digest
+from utils.generate_tile_index import tile_record, write_tile_index
+from utils.generate_mask_previews import MaskPreviewer
+from utils.generate_training_dataset import PolygonRasterizer
 
 setup_logging(logging.INFO)
 
@@ -44,43 +63,125 @@ def pad(tile: np.ndarray, th: int, tw: int) -> np.ndarray:
     return np.pad(tile, pads, mode="constant", constant_values=0)
 
 
-def tile_pair(img_path: Path, mask_path: Path, out_dir: Path, TILE_H: int, TILE_W: int):
+def _init_flow_worker():
+    import torch
+    torch.set_num_threads(1)  # one process per core already
+
+
+def _submit_flows(flow_executor: ProcessPoolExecutor, flow_jobs: dict, flow_pending: set, max_pending: int,
+                  msk_tile: np.ndarray, cache_dir: Path, digest: str) -> None:
+    # every queued job holds a copy of its mask tile: wait for workers once max_pending are in flight
+    if len(flow_pending) >= max_pending:
+        done, _ = wait(flow_pending, return_when=FIRST_COMPLETED)
+        flow_pending -= done
+    future = flow_executor.submit(cache_flows, msk_tile, cache_dir, digest)
+    flow_jobs[digest] = future
+    flow_pending.add(future)
+
+
+def tile_pair(img_path: Path, mask_path: Path, out_dir: Path, TILE_H: int, TILE_W: int, geojson_path: Path = None,
+              flow_executor: ProcessPoolExecutor = None, flow_jobs: dict = None, flow_pending: set = None,
+              flow_max_pending: int = 8, normalize: str = "slide", index_records: list = None,
+              skip_empty: bool = False, preview_dir: Path = None, preview_downsamples: tuple = (8,)):
     stem = img_path.stem
     img = read_tif(img_path)
-    mask = read_tif(mask_path).astype(np.uint16)
-    if img.shape[:2] != mask.shape[:2]:
-        raise ValueError(f"Dimension mismatch {img_path.name} vs {mask_path.name}")
+    if geojson_path is not None:
+        mask, rasterizer = None, PolygonRasterizer(img_path, geojson_path)
+        if img.shape[:2] != (rasterizer.height, rasterizer.width):
+            raise ValueError(f"Dimension mismatch {img_path.name} vs {geojson_path.name}")
+    else:
+        mask = read_tif(mask_path).astype(np.uint16)
+        if img.shape[:2] != mask.shape[:2]:
+            raise ValueError(f"Dimension mismatch {img_path.name} vs {mask_path.name}")
+
+    normalizer = None
+    if img.dtype != np.uint8 and normalize == "slide":
+        normalizer = SlideNormalizer.for_slide(img_path, arr=img)
 
     H, W = img.shape[:2]
     nrows = (H + TILE_H - 1) // TILE_H
     ncols = (W + TILE_W - 1) // TILE_W
+    previewer = MaskPreviewer(H, W, preview_downsamples) if preview_dir is not None else None
 
     for r in range(nrows):
         for c in range(ncols):
             y0, x0 = r * TILE_H, c * TILE_W
             y1, x1 = min(y0 + TILE_H, H), min(x0 + TILE_W, W)
             img_tile = pad(img[y0:y1, x0:x1], TILE_H, TILE_W)
-            msk_tile = pad(mask[y0:y1, x0:x1], TILE_H, TILE_W)
+            if mask is None:
+                msk_tile = rasterizer.tile(y0, x0, TILE_H, TILE_W)
+            else:
+                msk_tile = pad(mask[y0:y1, x0:x1], TILE_H, TILE_W)
+            if previewer is not None:
+                previewer.add(y0, x0, msk_tile)
             img_name = f"{stem}_{r}_{c}.tif"
             msk_name = f"{stem}_{r}_{c}_masks.tif"
 
-            if img_tile.dtype != np.uint8:
+            if normalizer is not None:
+                img_write = normalizer.apply(img_tile)
+            elif img_tile.dtype != np.uint8:
                 img_write = cv2.normalize(
                     img_tile, None, 0, 255, cv2.NORM_MINMAX).astype(np.uint8)
             else:
                 img_write = img_tile
+            write = not (skip_empty and not msk_tile.any())
+            if index_records is not None:
+                index_records.append(tile_record(img_name, msk_name, stem, r, c, img_write, msk_tile, written=write))
+            if not write:
+                continue
             tifffile.imwrite(out_dir / img_name, img_write)
             tifffile.imwrite(out_dir / msk_name, msk_tile)
             logging.info("saved %s / %s", img_name, msk_name)
 
+            if flow_executor is not None:
+                digest = mask_digest(msk_tile)
+                if digest not in flow_jobs and not flow_path(out_dir / FLOW_CACHE_DIR, digest).exists():
+                    _submit_flows(flow_executor, flow_jobs, flow_pending, flow_max_pending, msk_tile, out_dir / FLOW_CACHE_DIR, digest)
+
+    if previewer is not None:
+        previewer.save(preview_dir, stem)
 
-def split_folder(img_dir: Path, mask_dir: Path, out_dir: Path, TILE_H: int, TILE_W: int):
+
+def split_folder(img_dir: Path, mask_dir: Path, out_dir: Path, TILE_H: int, TILE_W: int, geojson_dir: Path = None,
+                 compute_flows: bool = False, n_workers: int = None, normalize: str = "slide", skip_empty: bool = False,
+                 preview_dir: Path = None, preview_downsamples: tuple = (8,)):
     out_dir.mkdir(parents=True, exist_ok=True)
+    flow_executor = None
+    if compute_flows:
+        # fork where available: the pipeline scripts calling this have no __main__ guard
+        # and would be re-run by spawned workers
+        ctx = multiprocessing.get_context("fork" if "fork" in multiprocessing.get_all_start_methods() else None)
+        flow_executor = ProcessPoolExecutor(max_workers=n_workers, mp_context=ctx, initializer=_init_flow_worker)
+    flow_jobs, flow_pending, index_records = {}, set(), []
+    try:
+        _split_all(img_dir, mask_dir, out_dir, TILE_H, TILE_W, geojson_dir, flow_executor=flow_executor,
+                   flow_jobs=flow_jobs, flow_pending=flow_pending, flow_max_pending=2 * (n_workers or os.cpu_count() or 1),
+                   normalize=normalize, index_records=index_records, skip_empty=skip_empty,
+                   preview_dir=preview_dir, preview_downsamples=preview_downsamples)
+    finally:
+        if flow_executor is not None:
+            flow_executor.shutdown()  # waits for the pending flow jobs
+    if index_records:
+        write_tile_index(index_records, out_dir)
+    for future in flow_jobs.values():
+        future.result()  # re-raise worker errors
+    if compute_flows:
+        logging.info("precomputed flows for %d unique mask tiles in %s", len(flow_jobs), out_dir / FLOW_CACHE_DIR)
+
+
+def _split_all(img_dir, mask_dir, out_dir, TILE_H, TILE_W, geojson_dir, **tile_kwargs):
     for img_path in img_dir.glob("*.tif"):
         if img_path.name.endswith("_masks.tif"):
             continue
+        if geojson_dir is not None:
+            geojson_path = geojson_dir / f"{img_path.stem}.geojson"
+            if not geojson_path.exists():
+                logging.warning("no geojson found for %s, skipping", img_path.name)
+                continue
+            tile_pair(img_path, None, out_dir, TILE_H, TILE_W, geojson_path=geojson_path, **tile_kwargs)
+            continue
         mask_path = mask_dir / f"{img_path.stem}_masks.tif"
         if not mask_path.exists():
             logging.warning("no mask found for %s, skipping", img_path.name)
             continue
-        tile_pair(img_path, mask_path, out_dir, TILE_H, TILE_W)
\ No newline at end of file
+        tile_pair(img_path, mask_path, out_dir, TILE_H, TILE_W, **tile_kwargs)
\ No newline at end of file
@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+"""
+Developed by Nikhil Nageshwar Inturi
+
+This module brings slides into the Streamlit app without reading them twice:
+
+    SlideUpload    writes an upload stream to disk in one pass, hashing it for the
+                   result cache and inspecting the TIFF structure (size, pyramid
+                   levels, tiling, compression) as soon as all its IFDs (next-IFD
+                   chain and SubIFDs) have been written, which for slides written
+                   IFD-first is within the first chunks
+    server_slide   validates a slide already on the server (no copy); its cache
+                   fingerprint is path + size + mtime, like the stage fingerprints
+                   of PipelineRunner, instead of a full read
+
+A Streamlit UploadedFile is already held in memory in full, so the chunked
+write does not lower the peak for browser uploads (those are capped by
+server.maxUploadSize); slides too large for that go through server_slide.
+
+TiffInfo.png_level() picks the pyramid level TiffToPngConverter should
+downscale from: the smallest level still at least as large as the PNG.
+"""
+
+# imports
+import hashlib, logging, struct
+from pathlib import Path
+from typing import Iterable, List, Optional, Tuple, Union
+# local imports
+from utils.generate_result_cache import HASH_CHUNK, content_hasher
+
+logger = logging.getLogger(__name__)
+
+
+class TiffInfo:
+    """
+    Structure of a TIFF slide as far as the conversion cares.
+    """
+
+    def __init__(self, width: int, height: int, dtype: str, axes: str, levels: List[Tuple[int, int]],
+                 tiled: bool, compression: str) -> None:
+        self.width = width
+        self.height = height
+        self.dtype = dtype
+        self.axes = axes
+        self.levels = levels  # (width, height) per level, level 0 first
+        self.tiled = tiled
+        self.compression = compression
+
+    @classmethod
+    def read(cls, path: Union[str, Path]) -> "TiffInfo":
+        import tifffile
+        with tifffile.TiffFile(str(path)) as tif:
+            series = tif.series[0]
+            axes = series.axes
+            levels = [(l.shape[axes.index("X")], l.shape[axes.index("Y")]) for l in series.levels]
+            page = series.pages[0]
+            return cls(levels[0][0], levels[0][1], str(series.dtype), axes, levels, bool(page.is_tiled), page.compression.name)
+
+    def png_level(self, scaling_factor: float) -> int:
+        """
+        Smallest pyramid level at least as large as the scaling_factor-downscaled PNG.
+        """
+        target = int(self.width * scaling_factor)
+        return max((i for i, (w, _) in enumerate(self.levels) if w >= target), default=0)
+
+    def describe(self) -> str:
+        pyramid = f"{len(self.levels)}-level pyramid" if len(self.levels) > 1 else "no pyramid"
+        return f"{self.width}x{self.height} {self.dtype} ({self.axes}), {pyramid}, {'tiled' if self.tiled else 'stripped'}, {self.compression}"
+
+
+TAG_TYPE_SIZES = {1: 1, 2: 1, 3: 2, 4: 4, 5: 8, 6: 1, 7: 1, 8: 2, 9: 4, 10: 8, 11: 4, 12: 8, 13: 4, 16: 8, 17: 8, 18: 8}
+SUBIFDS_TAG = 330  # pyramid levels of OME-TIFF / tifffile slides
+
+
+def _pending_ifds(f, written: int, pending: List[int], visited: set, big: bool, byteorder: str) -> List[int]:
+    """
+    Walk the IFDs (next-IFD chain and SubIFDs) reachable from pending through the written bytes.
+    Returns the IFDs not fully written yet (entries and out-of-line tag values); [] once all are.
+    """
+    count_fmt, entry_fmt, offset_fmt = ("Q", "HHQ8s", "Q") if big else ("H", "HHI4s", "I")
+    count_size, entry_size, offset_size = (struct.calcsize(byteorder + fmt) for fmt in (count_fmt, entry_fmt, offset_fmt))
+    waiting = []
+    while pending:
+        offset = pending.pop()
+        if offset in visited:  # malformed file with an IFD cycle
+            continue
+        if offset + count_size > written:
+            waiting.append(offset)
+            continue
+        f.seek(offset)
+        (n,) = struct.unpack(byteorder + count_fmt, f.read(count_size))
+        if offset + count_size + n * entry_size + offset_size > written:
+            waiting.append(offset)
+            continue
+        entries = f.read(n * entry_size + offset_size)
+        children, complete = [], True
+        for k in range(n):
+            tag, dtype, count, value = struct.unpack_from(byteorder + entry_fmt, entries, k * entry_size)
+            size = TAG_TYPE_SIZES.get(dtype, 1) * count
+            if size > offset_size:
+                (value_offset,) = struct.unpack(byteorder + offset_fmt, value)
+                if value_offset + size > written:
+                    complete = False
+                    break
+                if tag == SUBIFDS_TAG:
+                    f.seek(value_offset)
+                    value = f.read(size)
+            if tag == SUBIFDS_TAG:
+                item_fmt = "Q" if TAG_TYPE_SIZES.get(dtype) == 8 else "I"
+                children += list(struct.unpack_from(byteorder + item_fmt * count, value))
+        if not complete:
+            waiting.append(offset)
+            continue
+        visited.add(offset)
+        (next_offset,) = struct.unpack_from(byteorder + offset_fmt, entries, n * entry_size)
+        pending += [o for o in children + [next_offset] if o]
+    return waiting
+
+
+class SlideUpload:
+    """
+    Stream an upload to disk in chunks of chunk_size, hashing and inspecting it on the way.
+
+    After write(): content_hash, bytes and info (None if the file is not a readable TIFF).
+    """
+
+    def __init__(self, path: Union[str, Path], chunk_size: int = HASH_CHUNK) -> None:
+        self.path = Path(path)
+        self.chunk_size = chunk_size
+        self.content_hash: Optional[str] = None
+        self.bytes = 0
+        self.info: Optional[TiffInfo] = None
+        self.inspected_at: Optional[int] = None  # bytes written when info was read
+        self._pending: List[int] = []  # IFD offsets still to walk (see _pending_ifds)
+        self._visited: set = set()
+        self._header: Optional[tuple] = None
+        self._inspect_failed = False
+
+    def write(self, stream) -> "SlideUpload":
+        h = content_hasher()
+        with open(self.path, "wb") as f, open(self.path, "rb") as reader:
+            while chunk := stream.read(self.chunk_size):
+                h.update(chunk)
+                f.write(chunk)
+                self.bytes += len(chunk)
+                if self.info is None and not self._inspect_failed:
+                    f.flush()
+                    self._inspect(reader)
+        self.content_hash = h.hexdigest()
+        if self.info is None:  # IFDs only at the end of the file, or a damaged chain
+            self._read_info()
+        logger.info(f"Wrote {self.path.name} ({self.bytes / 2 ** 20:.1f} MB)"
+                    + (f": {self.info.describe()}, known after {self.inspected_at / 2 ** 20:.1f} MB" if self.info else ""))
+        return self
+
+    def _inspect(self, reader) -> None:
+        if self._header is None:
+            reader.seek(0)
+            head = reader.read(16)
+            if len(head) < 16:
+                return
+            byteorder = {b"II": "<", b"MM": ">"}.get(head[:2])
+            if byteorder is None:
+                self._inspect_failed = True  # not a TIFF
+                return
+            (version,) = struct.unpack(byteorder + "H", head[2:4])
+            big = version == 43
+            self._pending = list(struct.unpack(byteorder + ("Q" if big else "I"), head[8:16] if big else head[4:8]))
+            self._header = (big, byteorder)
+        big, byteorder = self._header
+        self._pending = _pending_ifds(reader, self.bytes, self._pending, self._visited, big, byteorder)
+        if not self._pending:
+            self._read_info()
+            self._inspect_failed = self.info is None  # not readable by tifffile yet: retry once at the end
+
+    def _read_info(self) -> None:
+        try:
+            self.info = TiffInfo.read(self.path)
+            self.inspected_at = self.bytes
+        except Exception as e:
+            logger.debug(f"{self.path.name}: no TIFF structure after {self.bytes} bytes ({e})")
+
+
+def stat_digest(path: Union[str, Path]) -> str:
+    """
+    Cache fingerprint of a server-side slide without reading it: resolved path, size and mtime.
+    """
+    path = Path(path).resolve()
+    stat = path.stat()
+    return hashlib.blake2b(f"{path}|{stat.st_size}|{stat.st_mtime_ns}".encode(), digest_size=20).hexdigest()
+
+
+def server_slide(path: Union[str, Path], roots: Iterable[Union[str, Path]]) -> Path:
+    """
+    Resolve a slide path typed into the app, accepting only existing .tif/.tiff files under one of roots.
+    """
+    resolved = Path(path).expanduser().resolve()
+    if not any(resolved.is_relative_to(Path(root).resolve()) for root in roots):
+        raise ValueError(f"{path} is not inside an allowed slide directory")
+    if resolved.suffix.lower() not in (".tif", ".tiff") or not resolved.is_file():
+        raise ValueError(f"{path} is not a TIFF file")
+    return resolved
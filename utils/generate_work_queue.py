@@ -0,0 +1,237 @@
+#!/usr/bin/env python3
+"""
+Developed by Nikhil Nageshwar Inturi
+
+This module provides WorkQueue, a lease-file work queue that lets several
+nodes sharing one filesystem (e.g. NFS under CONFIG_DIR) split pipeline work
+without colliding:
+
+    <queue_dir>/<stage>/leases/<item>.lease    held by one node while it works
+    <queue_dir>/<stage>/done/<item>            written once the item succeeded
+
+An item (a slide stem, a tile range "<stem>@<start>-<end>", ...) is claimed by
+hard-linking a private temp file to its lease name, which is atomic and fails
+if the lease exists, also over NFS. The owner renews the lease (mtime) from a
+heartbeat thread; a lease not renewed for lease_seconds is taken over by
+atomically renaming it away, so exactly one node reclaims work from a crashed
+one. Expiry is measured against the filesystem's own clock, not the node's.
+"""
+
+# imports
+import json, logging, os, socket, threading, time, uuid
+from pathlib import Path
+from typing import Callable, Iterable, List, Optional, Sequence, Tuple, Union
+
+
+class LeaseLost(RuntimeError):
+    pass
+
+
+def tile_ranges(stem: str, n_tiles: int, chunk: int) -> List[str]:
+    """
+    Work items covering tiles [0, n_tiles) of a slide in chunks: "<stem>@<start>-<end>".
+    """
+    return [f"{stem}@{start}-{min(start + chunk, n_tiles)}" for start in range(0, n_tiles, chunk)]
+
+
+def parse_tile_range(item: str) -> Tuple[str, int, int]:
+    stem, span = item.rsplit("@", 1)
+    start, end = span.split("-")
+    return stem, int(start), int(end)
+
+
+class Lease:
+    """
+    A claimed item. Renewed in the background while held; use as a context manager:
+    success marks the item done, an exception releases it for other nodes.
+    """
+
+    def __init__(self, queue: "WorkQueue", stage: str, item: str, token: str) -> None:
+        self.queue, self.stage, self.item, self.token = queue, stage, item, token
+        self.path = queue._lease_path(stage, item)
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._heartbeat, daemon=True)
+        self._thread.start()
+
+    def _heartbeat(self) -> None:
+        while not self._stop.wait(self.queue.lease_seconds / 3):
+            try:
+                self.renew()
+            except LeaseLost:
+                self.queue.logger.error(f"lost lease on {self.stage}/{self.item}")
+                return
+
+    def renew(self) -> None:
+        if not self.queue._owns(self.path, self.token):
+            raise LeaseLost(f"{self.stage}/{self.item} was reclaimed by another node")
+        os.utime(self.path)
+
+    def complete(self) -> None:
+        self._stop.set()
+        if not self.queue._owns(self.path, self.token):
+            raise LeaseLost(f"{self.stage}/{self.item} was reclaimed by another node")
+        self.queue._write_atomic(self.queue._done_path(self.stage, self.item),
+                                 json.dumps({"node": self.queue.node_id, "finished": time.time()}))
+        self.release()
+
+    def release(self) -> None:
+        self._stop.set()
+        if self.queue._owns(self.path, self.token):
+            self.path.unlink(missing_ok=True)
+
+    def __enter__(self) -> "Lease":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        if exc_type is None:
+            self.complete()
+        else:
+            self.release()
+
+
+class WorkQueue:
+    """
+    Claim, renew, complete and reclaim work items per stage in a shared queue directory.
+    """
+
+    def __init__(self, queue_dir: Union[str, Path], node_id: Optional[str] = None, lease_seconds: float = 300.0) -> None:
+        self.queue_dir = Path(queue_dir)
+        self.node_id = node_id or f"{socket.gethostname()}-{os.getpid()}"
+        self.lease_seconds = lease_seconds
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.queue_dir.mkdir(parents=True, exist_ok=True)
+
+    # paths
+    def _stage_dir(self, stage: str, kind: str) -> Path:
+        path = self.queue_dir / stage / kind
+        path.mkdir(parents=True, exist_ok=True)
+        return path
+
+    def _lease_path(self, stage: str, item: str) -> Path:
+        return self._stage_dir(stage, "leases") / f"{item}.lease"
+
+    def _done_path(self, stage: str, item: str) -> Path:
+        return self._stage_dir(stage, "done") / item
+
+    # helpers
+    def _write_atomic(self, path: Path, text: str) -> None:
+        tmp = path.with_name(f".{path.name}.{uuid.uuid4().hex}.tmp")
+        tmp.write_text(text)
+        os.replace(tmp, path)
+
+    def _owns(self, lease_path: Path, token: str) -> bool:
+        try:
+            return json.loads(lease_path.read_text()).get("token") == token
+        except (FileNotFoundError, ValueError):
+            return False
+
+    def _fs_now(self) -> float:
+        # current time as the shared filesystem stamps it, so node clock skew does not matter
+        probe = self.queue_dir / f".clock-{self.node_id}"
+        probe.touch()
+        os.utime(probe)
+        return probe.stat().st_mtime
+
+    # queue operations
+    def is_done(self, stage: str, item: str) -> bool:
+        return self._done_path(stage, item).exists()
+
+    def all_done(self, stage: str, items: Iterable[str]) -> bool:
+        return all(self.is_done(stage, item) for item in items)
+
+    def try_claim(self, stage: str, item: str) -> Optional[Lease]:
+        """
+        Claim item for this node, reclaiming an expired lease. Returns None if done or held.
+        """
+        if self.is_done(stage, item):
+            return None
+        lease_path = self._lease_path(stage, item)
+        if lease_path.exists():
+            try:
+                age = self._fs_now() - lease_path.stat().st_mtime
+            except FileNotFoundError:
+                age = None  # released meanwhile
+            if age is not None:
+                if age < self.lease_seconds:
+                    return None
+                stale = lease_path.with_name(f".{lease_path.name}.{uuid.uuid4().hex}.stale")
+                try:
+                    os.rename(lease_path, stale)  # only one node's rename of the expired lease succeeds
+                except FileNotFoundError:
+                    return None
+                if self._fs_now() - stale.stat().st_mtime < self.lease_seconds:
+                    # renewed (or re-claimed) between the age check and the rename: put it back
+                    try:
+                        os.link(stale, lease_path)
+                    except FileExistsError:
+                        pass
+                    stale.unlink(missing_ok=True)
+                    return None
+                self.logger.warning(f"reclaimed expired lease {stage}/{item} ({age:.0f}s old)")
+                stale.unlink(missing_ok=True)
+
+        token = uuid.uuid4().hex
+        tmp = lease_path.with_name(f".{lease_path.name}.{token}.tmp")
+        tmp.write_text(json.dumps({"node": self.node_id, "token": token, "claimed": time.time()}))
+        try:
+            os.link(tmp, lease_path)
+        except FileExistsError:
+            return None
+        finally:
+            tmp.unlink(missing_ok=True)
+        if self.is_done(stage, item):  # finished by another node between the checks
+            lease_path.unlink(missing_ok=True)
+            return None
+        return Lease(self, stage, item, token)
+
+    def work(self, tasks: Sequence[Tuple[str, Union[Sequence[str], Callable[[], Sequence[str]]],
+                                         Callable[[str], None], Optional[Callable[[str], bool]]]],
+             poll_seconds: float = 5.0, max_failures: int = 3) -> List[Tuple[str, str]]:
+        """
+        Process (stage, items, fn, ready) tasks until every item of every task is done.
+
+        items may be a callable returning the current items, for work that only becomes known
+        as earlier stages finish (e.g. tile ranges of a slide once it is split).
+        ready(item), if given, gates an item on other work (e.g. stitching a slide once all of
+        its tile ranges are detected). Later tasks are preferred, so slides already in flight
+        finish before new ones start. A failed item is released for any node to retry; this
+        node gives it up after max_failures attempts. Returns when nothing is left that this
+        node can do and no other node holds a lease that could unblock it.
+        Returns the (stage, item) pairs processed by this node.
+        """
+        processed, failures = [], {}
+        while True:
+            pending, held, claimed = False, False, None
+            for stage, items, fn, ready in reversed(tasks):
+                for item in (items() if callable(items) else items):
+                    if self.is_done(stage, item) or failures.get((stage, item), 0) >= max_failures:
+                        continue
+                    pending = True
+                    if ready is not None and not ready(item):
+                        continue
+                    lease = self.try_claim(stage, item)
+                    if lease is not None:
+                        claimed = (lease, fn)
+                        break
+                    held = held or self._lease_path(stage, item).exists()
+                if claimed:
+                    break
+            if claimed is None:
+                if not pending:
+                    return processed
+                if not held:
+                    self.logger.warning(f"{self.node_id}: remaining items are blocked by failed work, stopping")
+                    return processed
+                time.sleep(poll_seconds)  # everything left is held by other nodes or waits on them
+                continue
+
+            lease, fn = claimed
+            try:
+                with lease:
+                    fn(lease.item)
+                processed.append((lease.stage, lease.item))
+            except LeaseLost:
+                self.logger.exception(f"{lease.stage}/{lease.item} finished after its lease was reclaimed")
+            except Exception:
+                failures[(lease.stage, lease.item)] = failures.get((lease.stage, lease.item), 0) + 1
+                self.logger.exception(f"{lease.stage}/{lease.item} failed on {self.node_id}, released")